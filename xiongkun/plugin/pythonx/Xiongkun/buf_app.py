@@ -1,11 +1,14 @@
 import sys
 import os
+import time
 import os.path as osp
 from .func_register import *
 from .vim_utils import *
 from collections import OrderedDict
 from .rpc import rpc_call, rpc_wait, rpc_server, rpc_server
 from .rpc import LocalServerContextManager
+from .rpc_server.vimrpc.candidate_store import items_digest, items_delta
+from .search_scheduler import SearchScheduler
 from .log import debug
 from .remote_fs import GoToLocation, FileSystem
 from . import remote_fs
@@ -1048,6 +1051,9 @@ class SimpleInputBuffer(WidgetBufferWithInputs):
         return True
 
 class FuzzyList(WidgetBufferWithInputs):
+    search_function = "fuzzyfinder.search"
+    uploaded = {} # (local, name) -> (items_digest, items) last sent to the server.
+
     def __init__(self, type, items, name="FuzzyList", history=None, options={}):
         widgets = [
             ListBoxWidget(name="result", height=14, items=[]),
@@ -1066,6 +1072,7 @@ class FuzzyList(WidgetBufferWithInputs):
         self.type = type
         self.previewing=False
         self.local = default_options.get("local", 0)
+        self.scheduler = SearchScheduler(self.send_search, self.update_ui, PythonFunctionTimer())
         super().__init__(root, name, history, default_options)
         self.set_items(self.type, self.items)
 
@@ -1089,7 +1096,12 @@ class FuzzyList(WidgetBufferWithInputs):
 
     def on_search(self):
         search_text = self.widgets['input'].text.strip().lower()
-        self.rpc_call_wrapper("fuzzyfinder.search", self.update_ui, self.type, search_text)
+        self.scheduler.submit(search_text)
+
+    def send_search(self, search_text, on_return):
+        if self.state == "exit":
+            return
+        self.rpc_call_wrapper(self.search_function, on_return, self.type, search_text)
 
     def rpc_call_wrapper(self, *args, **kwargs):
         if self.local == 1: 
@@ -1115,11 +1127,17 @@ class FuzzyList(WidgetBufferWithInputs):
         return True
 
     def set_items(self, name, items):
-        def do_set(cur_type):
-            if cur_type is False:
+        # the server keeps the list by its digest, a list changed since the 
+        # last upload (a buffer opened) is sent as a delta of that version.
+        key = (self.local, name)
+        digest = items_digest(items)
+        base = FuzzyList.uploaded.get(key, None)
+        delta = items_delta(base[1], items) if base is not None and base[0] != digest else None
+        def do_set(synced):
+            if synced is False:
                 self.rpc_call_wrapper("fuzzyfinder.set_items", None, name, items)
-        hashid = hash(tuple(items))
-        self.rpc_call_wrapper("fuzzyfinder.is_init", do_set, name, hashid)
+        FuzzyList.uploaded[key] = (digest, list(items))
+        self.rpc_call_wrapper("fuzzyfinder.sync_items", do_set, name, digest, base[0] if delta is not None else None, delta)
 
     def show_label(self):
         def on_select(item):
@@ -1285,6 +1303,7 @@ class BookmarkFinderBuffer(FuzzyList):
 
 class FileFinderBuffer(FuzzyList):
     default_directory = FileSystem().cwd
+    search_function = "filefinder.search"
 
     def __init__(self, directory=None, name="FileFinder", history=None, options={}, on_enter=None):
         self.directory = directory if directory is not None else self.default_directory
@@ -1304,10 +1323,6 @@ class FileFinderBuffer(FuzzyList):
         files = rpc_wait("filefinder.set_root", directory)
         return files
 
-    def on_search(self):
-        search_text = self.widgets['input'].text.strip().lower()
-        self.rpc_call_wrapper("filefinder.search", self.update_ui, self.type, search_text)
-
     def set_items(self, name, items):
         pass
 
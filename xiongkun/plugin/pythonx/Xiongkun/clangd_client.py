@@ -263,8 +263,9 @@ class CancelManager:
         if abspath in self.file2ids: 
             for idx in self.file2ids[abspath]:
                 print (f"cancel {idx}")
-                self.server.call("cancel", None, filepath, idx)
-                if id in self.server.channel.callbacks: del self.server.channel.callbacks[idx]
+                if idx in self.server.channel.callbacks: 
+                    self.server.channel.cancel(idx)
+                    del self.server.channel.callbacks[idx]
 
 def show_diagnostics_in_textprop(package):
     """ 
@@ -749,7 +750,7 @@ def lsp_server():
     if clangd is None: 
         _EndAutoCompile()
         _StartAutoCompile()
-        clangd = LSPClient(f"127.0.0.1:{py_server_local_creator.port()}")
+        clangd = LSPClient(py_server_local_creator.address())
     return clangd.lsp_server
 
 def set_remote_lsp(config_file):
@@ -763,4 +764,7 @@ def set_remote_lsp(config_file):
     with open(config_file, 'r') as f:  
         data = yaml.safe_load(f)  
     host = data['host']
+    from .rpc import remote_project
+    if data.get('mux', False) and remote_project is not None and remote_project.remote_host == host: 
+        host = remote_project.host # share the mux connection of the project.
     clangd = LSPClient(host)
@@ -1,5 +1,6 @@
 from threading import Thread, Lock, currentThread
 from queue import Queue
+from collections import deque
 import traceback
 import time
 from contextlib import contextmanager
@@ -9,7 +10,9 @@ from .log import log, debug
 import multiprocessing
 import vim
 from .vim_utils import *
+import re
 import json
+import itertools
 from .func_register import vim_register
 from .log import debug
 import time
@@ -32,9 +35,14 @@ def create_rpc_handle(name, function_name, receive_name):
     endfunction
     """)
 
-    vim.command(f"""function! {name}SendMessageSync(id, channel, package)
+    # wait the response of id, the id is matched by a regex: `[id, ...` or `Z<id>:...`,
+    # so the other messages are only decoded once when they are dispatched after.
+    # other packers (haskell) fallback to ServerGetId.
+    # timeout is in seconds, -1 waits forever. "" is returned without the response.
+    vim.command(f"""function! {name}SendMessageSync(id, channel, package, timeout)
         call ch_sendraw(a:channel, a:package)
-        let receive_jsons = []
+        let received = []
+        let start = reltime()
         while 1
             let out = ch_read(a:channel, {{'timeout': 1000}})
             if out == ""
@@ -43,21 +51,24 @@ def create_rpc_handle(name, function_name, receive_name):
                     echom "[Warnings] Connection error: ".status
                     break
                 endif
-                sleep 100m
-                continue
+            else
+                let cur_id = matchstr(out, '^[[Z]\\zs-\\?\\d\\+')
+                if cur_id == ""
+                    let cur_id = {name}ServerGetId(out)
+                endif
+                if str2nr(cur_id) == a:id
+                    break
+                endif
+                call add(received, out)
+                let out = ""
             endif
-            let json = json_decode(out)
-            let cur_id = {name}ServerGetId(out)
-            if cur_id == a:id
-                call {name}Server(a:channel, out)
+            if a:timeout >= 0 && reltimefloat(reltime(start)) > a:timeout
                 break
-            else
-                call add(receive_jsons, json)
             endif
         endwhile
 
-        for json in receive_jsons
-            call {name}Server(a:channel, out)
+        for msg in received
+            call {name}Server(a:channel, msg)
         endfor
         return out
     endfunction""")
@@ -80,62 +91,158 @@ def create_rpc_handle(name, function_name, receive_name):
     """ % name
     )
 
+def local_socket_path():
+    """ unix socket of the local server, None if the vim can't ch_open it.
+    """
+    if vimeval('has("patch-8.2.4684")') != '1': 
+        return None
+    directory = os.path.join(os.environ.get("XDG_RUNTIME_DIR", None) or "/tmp", f"xkvim-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, f"rpc.{os.getpid()}.sock")
+
 @Singleton
 class PyLocalCreator:
     def __init__(self):
-        self._port = find_free_port()
-        self._log_path = f"/tmp/log.{self._port}"
+        # unix socket: no loopback tcp, no race of find_free_port.
+        self._unix_path = local_socket_path()
+        self._port = None if self._unix_path else find_free_port()
+        self._log_path = f"/tmp/log.{self._port or os.getpid()}"
 
     def port(self): 
         return self._port
 
+    def address(self): 
+        if self._unix_path: 
+            return f"unix:{self._unix_path}"
+        return f"127.0.0.1:{self._port}"
+
     def cmd (self): 
-        return f"python3 {HOME_PREFIX}/xkvim/xiongkun/plugin/pythonx/Xiongkun/rpc_server/tcp_server.py --host 127.0.0.1 --port {self._port} 1>{self._log_path} 2>&1"
+        listen = f"--unix {self._unix_path}" if self._unix_path else f"--host 127.0.0.1 --port {self._port}"
+        if os.environ.get("XKVIM_RPC_RECORD", None): # record the sessions for rpc_server/benchmark/replay.py
+            listen += f" --record {os.environ['XKVIM_RPC_RECORD']}"
+        return f"python3 {HOME_PREFIX}/xkvim/xiongkun/plugin/pythonx/Xiongkun/rpc_server/tcp_server.py {listen} 1>{self._log_path} 2>&1"
+
+    def wait(self, timeout=2.0):
+        # the waittime of ch_open is for tcp, wait the socket file here.
+        start = time.time()
+        while self._unix_path and not os.path.exists(self._unix_path) and time.time() - start < timeout: 
+            time.sleep(0.01)
+
+    def cleanup(self):
+        if self._unix_path and os.path.exists(self._unix_path): 
+            os.unlink(self._unix_path)
 
     def log_path(self):
         return self._log_path
 
 py_server_local_creator = PyLocalCreator()
 
+from .rpc_server.message_codec import decode_message
+from .rpc_server.metrics import Metrics, format_table, format_lists
+
 class PyPackProtocal:
+    mode = 'nl'
     def __init__(self):
-        pass
+        self.received_bytes = 0
+        self.decoded_bytes = 0
 
     def pack(self, package):
-        escaped = escape(json.dumps(package), '\\')
-        escaped = escape(escaped, '"')
+        escaped = json.dumps(package).replace('\\', '\\\\').replace('"', '\\"')
         str_package = '"' + escaped + '\n"'
         #debug("PyPackProtocal pack: ", str_package)
         return str_package
         
     def unpack(self, strs):
-        return json.loads(strs)
+        return json.loads(self.decode(strs))
+
+    def decode(self, strs):
+        """ decompress the `Z<id>:` messages of a zlib session.
+        """
+        decoded = decode_message(strs)
+        self.received_bytes += len(strs)
+        self.decoded_bytes += len(decoded)
+        return decoded
+
+class PyFramePackProtocal(PyPackProtocal):
+    """ packer of the `vimrpc2` mode, the channel is opened in raw mode.
+        pack return bytes, they are handed to vim by a variable, so no escape is needed.
+        received chunks are feed into a FrameStream and splited into payloads.
+    """
+    mode = 'raw'
+    def __init__(self):
+        super().__init__()
+        from .rpc_server.socket_stream import FrameStream
+        self.stream = FrameStream()
+
+    def pack(self, package):
+        return self.stream.pack(json.dumps(package).encode('utf-8'))
+
+    def feed(self, bytes):
+        self.stream.put_bytes(bytes)
+        messages = []
+        while self.stream.can_read():
+            messages.append(str(self.stream.readline(), 'utf-8'))
+        return messages
+
+    def get_id(self, msg):
+        if msg.startswith("Z"):
+            return int(msg[1:msg.index(':')])
+        return int(msg[1:msg.index(',')])
+
+# priority of a request, sent as the 4th item: [id, name, args, priority],
+# when the mode line has `priority` (the older servers unpack 3 items).
+# the server starts the smaller first and runs BACKGROUND in niced workers.
+# a sync call (rpc_wait) blocks vim, it is always INTERACTIVE.
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+rpc_priority = {
+    'fuzzyfinder.search': INTERACTIVE,
+    'filefinder.search': INTERACTIVE,
+    'remotefs.fetch': INTERACTIVE,
+    'grepfinder.search': BACKGROUND,
+    'grepfinder.sema_filter': BACKGROUND,
+    'grepfinder.context_filter': BACKGROUND,
+    'filefinder.set_root': BACKGROUND,
+}
 
 class RPCChannel:
+    sent_timeout = 600.0 # seconds, a call not answered by then is forgotten.
+
     def delete(self):
         if hasattr(self, "local_server"): 
             os.killpg(self.local_server.pid, signal.SIGKILL)
+            if hasattr(self.creator, "cleanup"): 
+                self.creator.cleanup()
     def __init__(self, name, remote_server, type, function, noblock=0, creator=None, packer=None):
+        if packer is None:
+            packer = PyFramePackProtocal() if type and type.split()[0] == "vimrpc2" else PyPackProtocal()
         config = {
-            'mode': 'nl',
+            'mode': getattr(packer, 'mode', 'nl'),
             'callback': f'{name}Server',
             'drop': 'auto',
             'noblock': noblock,
             'waittime': -1,
         }
+        start = time.time()
         if remote_server is None: 
             self.creator = py_server_local_creator if creator is None else creator
-            port = self.creator.port()
             print ("Creating server : ", self.creator.cmd())
-            remote_server = f"127.0.0.1:{port}"
+            if hasattr(self.creator, "address"): 
+                remote_server = self.creator.address()
+            else: 
+                remote_server = f"127.0.0.1:{self.creator.port()}"
             start_server_cmd = self.creator.cmd()
             self.local_server = subprocess.Popen([start_server_cmd], shell=True, universal_newlines=False, close_fds=True, preexec_fn=os.setsid)
             config['waittime'] = 1000
+            if hasattr(self.creator, "wait"): 
+                self.creator.wait()
+        if remote_server.startswith("unix:"): 
+            config.pop('waittime') # E475 for the unix socket.
 
         self.channel_name = f"g:{name}_channel"
         self.receive_name = f"g:{name}_receive"
         self.name = name
-        self.packer = PyPackProtocal() if packer is None else packer
+        self.packer = packer
+        self.framed = isinstance(packer, PyFramePackProtocal)
         self.func_name = function
         create_rpc_handle(name, self.func_name, self.receive_name)
         self.job_name = remote_server
@@ -146,6 +253,7 @@ class RPCChannel:
         if status != "open": 
             print ("Failed to connect to server.")
             vimcommand(f'ch_close({self.channel_name})')
+        self.open_cost = time.time() - start # includes starting the local server.
 
         if type: 
             vimcommand(
@@ -156,38 +264,122 @@ class RPCChannel:
         self.id = 0
         self.receives = {}
         self.callbacks = {} # id -> (on_receive)
+        self.cancellable = type is not None # the servers of xkvim understand `cancel`.
+        self.prioritized = type is not None and "priority" in type.split()[1:]
+        self.metrics = Metrics()
+        self.sent = {} # id -> (name, time) of the calls not answered, for sent_timeout.
 
     def receive(self):
+        if self.framed:
+            for msg in self.packer.feed(vim.bindeval(self.receive_name)):
+                self.on_receive(msg)
+            return
         msg = vimeval(f"{self.receive_name}")
         if not msg: return
         self.on_receive(msg)
 
     def getId(self):
+        """ the id of a message for SendMessageSync, parsed as the matchstr of
+            SendMessageSync, not unpacked: the packer counts it in on_receive.
+        """
         msg = vimeval(f"{self.receive_name}")
-        id, is_finished, output = self.packer.unpack(msg)
+        match = re.match(r"[\[Z](-?\d+)", msg)
+        if match: 
+            return int(match.group(1))
+        if isinstance(self.packer, PyPackProtocal): 
+            return int(json.loads(decode_message(msg))[0])
+        id, is_finished, output = self.packer.unpack(msg) # haskell.
         return int(id)
 
+    def unpack(self, msg):
+        """ unpack a response and record it in the metrics of its method.
+        """
+        start = time.time()
+        id, is_finished, output = self.packer.unpack(msg)
+        call = self.sent.get(id, None)
+        if call is not None: 
+            name, sent = call
+            now = time.time()
+            self.metrics.observe(name, 'unpack', now - start)
+            self.metrics.count(name, 'bytes_in', len(msg))
+            if is_finished: 
+                self.metrics.observe(name, 'total', now - sent)
+                self.sent.pop(id, None)
+        return id, is_finished, output
+
     def on_receive(self, msg):
         debug("XKXKXK:", "on_receive.", msg)
-        id, is_finished, output = self.packer.unpack(msg)
+        id, is_finished, output = self.unpack(msg)
         if id not in self.callbacks: 
             # maybe keeplive package.
             return
         on_return = self.callbacks[id]
-        on_return(id, is_finished, output)
         if is_finished: 
-            if id in self.callbacks: 
-                self.callbacks.pop(id)
+            # pop before on_return, the stream is finished if it is deleted in on_return.
+            self.callbacks.pop(id)
+        on_return(id, is_finished, output)
 
-    def send(self, package, sync=None):
+    def send(self, package, sync=None, timeout=None):
+        """ sync is the id to wait for, the response is returned, or None 
+            after timeout seconds (None waits forever) or a connection error.
+        """
+        start = time.time()
         str_package = self.packer.pack(package)
+        if package[0] >= 0: 
+            name = package[1]
+            if name != "cancel": # not answered by every server (lsp), only counted.
+                self.sent.pop(package[0], None) # a stream sends again, keep the order of time.
+                self.sent[package[0]] = (name, start)
+                self.forget_sent(start)
+            self.metrics.count(name, 'calls')
+            self.metrics.count(name, 'bytes_out', len(str_package))
+            self.metrics.observe(name, 'pack', time.time() - start)
         from .log import log
+        if self.framed:
+            vim.vars[f"{self.name}_send"] = str_package
+            str_package = f"g:{self.name}_send"
         if sync is None: 
             vim.eval(f'ch_sendraw({self.channel_name}, {str_package})')
+        elif self.framed:
+            vim.eval(f'ch_sendraw({self.channel_name}, {str_package})')
+            return self.wait_frame(sync, timeout)
         else: 
             assert isinstance(sync, int)
             debug("Start wait for id: ", sync)
-            return vim.eval(f'{self.name}SendMessageSync({sync}, {self.channel_name}, {str_package})')
+            wait = -1 if timeout is None else timeout
+            return vim.eval(f'{self.name}SendMessageSync({sync}, {self.channel_name}, {str_package}, {wait})') or None
+
+    def forget_sent(self, now):
+        """ drop the calls not answered in sent_timeout (a dead server), 
+            sent is in the order of send, the oldest are first.
+        """
+        for id, (name, sent) in list(itertools.islice(self.sent.items(), 16)):
+            if now - sent < self.sent_timeout: break
+            del self.sent[id]
+
+    def wait_frame(self, id, timeout=None):
+        """ the SendMessageSync of the vimrpc2 mode.
+            the other messages are dispatched after the response is found.
+        """
+        received = []
+        output = None
+        start = time.time()
+        while output is None:
+            if timeout is not None and time.time() - start > timeout: 
+                break
+            chunk = vim.bindeval(f"ch_read({self.channel_name}, {{'timeout': 1000}})")
+            if not chunk:
+                status = vimeval(f"ch_status({self.channel_name})")
+                if status in ["fail", "closed"]:
+                    print (f"[Warnings] Connection error: {status}")
+                    return None
+                continue
+            for msg in self.packer.feed(chunk):
+                if output is None and self.packer.get_id(msg) == id: output = msg
+                else: received.append(msg)
+        for msg in received:
+            self.on_receive(msg)
+        return output
 
     def stream_new(self, id=None):
         class RPCStream:
@@ -196,13 +388,20 @@ class RPCChannel:
                 self.is_deleted=False
                 self.channel = channel
             
-            def send(self, name, sync=None, *args):
+            def send(self, name, sync=None, *args, timeout=None):
                 assert self.is_deleted == False
                 package = [self.id, name, args]
-                return self.channel.send(package, sync)
+                priority = INTERACTIVE if sync is not None else rpc_priority.get(name, NORMAL)
+                if self.channel.prioritized and priority != NORMAL: 
+                    package.append(priority)
+                return self.channel.send(package, sync, timeout)
 
             def delete(self):
+                if self.is_deleted: return
                 self.is_deleted = True
+                if self.id in self.channel.callbacks: 
+                    # not finished, stop it in the server too.
+                    self.channel.cancel(self.id)
                 self.channel.stream_del(self)
 
             def register_hook(self, on_receive): 
@@ -213,6 +412,16 @@ class RPCChannel:
             id = self.id
         return RPCStream(self, id)
 
+    def cancel(self, id):
+        """ send `cancel(id)`, the server drops or stops the call, its output never comes.
+        """
+        call = self.sent.pop(id, None)
+        if call is not None: 
+            self.metrics.count(call[0], 'cancelled')
+        if not self.cancellable: return
+        self.id += 1
+        self.send([self.id, "cancel", [id]])
+
     def stream_del(self, stream): 
         if stream.id in self.callbacks: 
             self.callbacks.pop(stream.id)
@@ -221,8 +430,11 @@ def dummy_callback(*args, **kwargs):
     return None
 
 class RPCServer:
+    stats_timeout = 3.0 # seconds
+
     def __init__(self, name="RPC", remote_server=None, type="vimrpc", function="Xiongkun.rpc_server()", creator=None, packer=None):
         self.channel = RPCChannel(name, remote_server, type, function, 0, creator, packer=packer)
+        self.sync_latency = deque(maxlen=1000) # seconds of the last call_sync.
 
     def call(self, name, on_return, *args):
         stream = self.channel.stream_new()
@@ -235,11 +447,19 @@ class RPCServer:
         stream.send(name, None, *args)
         return stream
 
-    def call_sync(self, name, *args):
+    def call_sync(self, name, *args, timeout=None):
+        """ the output of name, None when there is no response in timeout seconds.
+        """
         stream = self.channel.stream_new()
-        stream.register_hook(dummy_callback)
-        output = stream.send(name, stream.id, *args)
-        id, is_finished, output = self.channel.packer.unpack(output)
+        start = time.time()
+        output = stream.send(name, stream.id, *args, timeout=timeout)
+        if output is None: 
+            self.channel.cancel(stream.id) # a late response is dropped by on_receive.
+            stream.delete()
+            return None
+        id, is_finished, output = self.channel.unpack(output)
+        stream.delete()
+        self.sync_latency.append(time.time() - start)
         return output
 
     def call_stream(self, name, on_return, on_finish, *args): 
@@ -268,8 +488,24 @@ class RPCServer:
     def keeplive(self):
         self.channel.send([-1, "keeplive", []])
 
+    def stats(self):
+        packer = self.channel.packer
+        client = {}
+        if hasattr(packer, "decoded_bytes"): 
+            client['received_bytes'] = packer.received_bytes
+            client['decoded_bytes'] = packer.decoded_bytes
+            client['ratio'] = packer.received_bytes / packer.decoded_bytes if packer.decoded_bytes else 1.0
+        client['channel_open_ms'] = self.channel.open_cost * 1000
+        if self.sync_latency: 
+            costs = sorted(self.sync_latency)
+            client['rpc_wait_p50_ms'] = costs[len(costs) // 2] * 1000
+            client['rpc_wait_p99_ms'] = costs[min(len(costs)-1, len(costs) * 99 // 100)] * 1000
+        client['methods'] = self.channel.metrics.snapshot()
+        # None from a server without the `stats` builtin (older ones, haskell).
+        return {'server': self.call_sync("stats", timeout=self.stats_timeout), 'client': client}
+
         
-local_rpc = RPCServer("Local", None, "vimrpc", function="Xiongkun.rpc_local_server()")
+local_rpc = RPCServer("Local", None, "vimrpc2 priority", function="Xiongkun.rpc_local_server()")
 commands("""
 augroup LocalServerDelete
     autocmd!
@@ -332,9 +568,33 @@ class RemoteProject:
         self.origin_directory = self.root_directory
         self.last_directory = self.origin_directory
         self.host = data['host']
-        self.rpc = RPCServer(remote_server=self.host)
+        self.remote_host = self.host
+        if data.get('mux', False): 
+            # `mux: true` carries rpc, lsp and bash over one connection by a local mux_client.
+            self.host = self.start_mux()
+        # `protocol: vimrpc2` for length prefixed frames, old servers only know vimrpc.
+        # `compress: zlib` to compress the large responses, worth it on slow links.
+        # `priority: true` when the server knows the priority of the requests.
+        self.protocol = data.get('protocol', 'vimrpc')
+        if data.get('compress', None): 
+            self.protocol += " " + data['compress']
+        if data.get('priority', False): 
+            self.protocol += " priority"
+        self.rpc = RPCServer(remote_server=self.host, type=self.protocol)
         print (self.root_directory, self.host)
 
+    def start_mux(self):
+        host, port = self.remote_host.split(":")
+        cmd = ["python3", f"{HOME_PREFIX}/xkvim/xiongkun/plugin/pythonx/Xiongkun/rpc_server/client/mux_client.py", 
+               "--host", host.strip(), "--port", port.strip()]
+        # not in a shell, so mux_client exits with vim by checking its parent.
+        self.mux = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+        ready = self.mux.stdout.readline().split() # `ready <port>` when listening.
+        if not ready: 
+            print ("Failed to start mux client, connect directly.")
+            return self.remote_host
+        return f"127.0.0.1:{ready[1]}"
+
     def change_directory(self, work_directory):
         self.last_directory = self.root_directory
         self.root_directory = work_directory
@@ -350,6 +610,33 @@ remote_project = None
 def TestRPC(args):
     print (rpc_wait("filefinder.set_root", "/home/data"))
 
+def stats_lines(stats):
+    """ text of RPCServer.stats(), a table of methods, the candidate lists and the other counters of each side.
+    """
+    lines = []
+    for side, stages in [('server', ['queue', 'execute', 'serialize', 'total']), ('client', ['pack', 'unpack', 'total'])]:
+        lines.append(f"# {side}")
+        if stats[side] is None: 
+            lines.extend(["stats not supported", ""])
+            continue
+        values = dict(stats[side])
+        lines.extend(format_table(values.pop('methods', {}), stages))
+        lines.extend(format_lists(values.pop('lists', {})))
+        lines.append("  ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}" for key, value in values.items()))
+        lines.append("")
+    return lines
+
+@vim_register(command="RPCStats")
+def RPCStats(args):
+    from .windows import GPW, PreviewWindow
+    lines = stats_lines(rpc_server().stats())
+    width = min(max(len(line) for line in lines), int(vim.eval("&columns")) - 4)
+    height = min(len(lines), int(vim.eval("&lines")) - 6)
+    options = {"minwidth": width, "maxwidth": width, "minheight": height, "maxheight": height}
+    GPW.tmp_window()
+    GPW.set_showable([PreviewWindow.ContentItem("RPCStats", lines, "", 1, options)])
+    GPW.show()
+
 @vim_register(command="Show")
 def ShowLog(args):
     vim.command(f"tabe {RPCChannel.rpc_log}")
@@ -0,0 +1,166 @@
+"""
+deterministic fake source trees for the benchmarks of the services, so
+they don't need a checkout of Paddle on the machine.
+
+the same arguments give the same tree (names, contents and sizes), a tree
+is reused if its `.fake_repo.json` matches, so a 1M files tree is written
+only once.
+
+    shape  : default (8 dirs x 5 levels), wide (64 x 2), deep (2 x 14).
+    excludes: `.vim_config.yaml` excludes build/ .git/ third_party/ *.o *.log *.json,
+             those directories get `excluded` of the files.
+    large  : `large_files` files of `large_size` bytes.
+    needle : `xkvim_needle_<n>` is written into `needles` files, to know
+             what a grep has to find.
+
+    python3 benchmark/fake_repo.py /tmp/fake_repo --files 100000 --shape wide
+"""
+import os
+import json
+import random
+import argparse
+
+SHAPES = {
+    'default': (8, 5),
+    'wide': (64, 2),
+    'deep': (2, 14),
+}
+
+WORDS = ["paddle", "fluid", "operators", "kernel", "phi", "core", "utils", "python", "tests",
+         "framework", "memory", "platform", "distributed", "jit", "ir", "pass", "api", "infer",
+         "tensor", "dense", "sparse", "reduce", "conv", "pool", "attention", "allocator", "stream"]
+
+EXCLUDED_DIRS = ["build", ".git", "third_party"]
+EXCLUDED_SUFFIX = [".o", ".log"]
+
+CONFIG = """search_config: [
+    '--exclude-dir="/build/*"',
+    '--exclude-dir="/.git/*"',
+    '--exclude-dir="/third_party/*"',
+    '--exclude="*.o"',
+    '--exclude="*.log"',
+    '--exclude="*.json"',
+    '--exclude="tags"',
+]
+"""
+
+def cpp_source(rnd, name, lines):
+    words = [rnd.choice(WORDS) for _ in range(8)]
+    out = [f'#include "{words[0]}/{words[1]}.h"', "#include <vector>", "", f"namespace {words[2]} {{", ""]
+    while len(out) < lines:
+        func = f"{rnd.choice(WORDS).capitalize()}{rnd.choice(WORDS).capitalize()}"
+        out += [f"void {func}(const DenseTensor& {words[3]}, DenseTensor* out) {{",
+                f"  auto dims = {words[3]}.dims();",
+                f"  for (int64_t i = 0; i < dims[0]; ++i) {{",
+                f"    out->data<float>()[i] = {words[4]}::{rnd.choice(WORDS)}(i) * {rnd.randint(1, 99)};",
+                "  }",
+                "}", ""]
+    out += [f"}}  // namespace {words[2]}", f"// {name}"]
+    return "\n".join(out) + "\n"
+
+def python_source(rnd, name, lines):
+    words = [rnd.choice(WORDS) for _ in range(6)]
+    out = [f"import {words[0]}", f"from {words[1]} import {words[2]}", ""]
+    while len(out) < lines:
+        func = f"{rnd.choice(WORDS)}_{rnd.choice(WORDS)}"
+        out += [f"def {func}(x, {words[3]}=None):",
+                f"    y = {words[2]}.{rnd.choice(WORDS)}(x, axis={rnd.randint(0, 3)})",
+                f"    return y + {rnd.randint(1, 99)}", ""]
+    out.append(f"# {name}")
+    return "\n".join(out) + "\n"
+
+def make_dirs(rnd, num, width, depth):
+    """ num relative directories of a tree with `width` children per directory and at most `depth` levels.
+    """
+    dirs, level = [], [""]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(width):
+                if len(dirs) >= num: return dirs
+                path = os.path.join(parent, f"{rnd.choice(WORDS)}_{len(dirs)}")
+                dirs.append(path)
+                next_level.append(path)
+        level = next_level
+    return dirs or [""]
+
+def make_repo(root, files=10000, shape="default", files_per_dir=20, excluded=0.1,
+              large_files=2, large_size=8 * 1024 * 1024, needles=50, seed=0):
+    """ write the tree into root, return its manifest (the arguments and the expected counts).
+    """
+    args = dict(files=files, shape=shape, files_per_dir=files_per_dir, excluded=excluded,
+                large_files=large_files, large_size=large_size, needles=needles, seed=seed)
+    manifest_path = os.path.join(root, ".fake_repo.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as fp:
+            manifest = json.load(fp)
+        if manifest["args"] == args: return manifest
+        raise RuntimeError(f"{root} is a fake repo of other arguments, remove it first.")
+    if os.path.exists(root) and os.listdir(root):
+        raise RuntimeError(f"{root} is not empty.")
+    rnd = random.Random(seed)
+    width, depth = SHAPES[shape]
+    dirs = make_dirs(rnd, max(1, files // files_per_dir), width, depth)
+    num_excluded = int(files * excluded)
+    needle_ids = set(rnd.sample(range(files - num_excluded), min(needles, files - num_excluded)))
+    included = []
+    for i in range(files):
+        if i < files - num_excluded:
+            directory = rnd.choice(dirs)
+            suffix = rnd.choice([".cc", ".h", ".py", ".cu"])
+        else: # in an excluded directory or with an excluded suffix.
+            if rnd.random() < 0.5:
+                directory = os.path.join(rnd.choice(EXCLUDED_DIRS), rnd.choice(dirs))
+                suffix = rnd.choice([".cc", ".h", ".py"])
+            else:
+                directory = rnd.choice(dirs)
+                suffix = rnd.choice(EXCLUDED_SUFFIX)
+        name = os.path.join(directory, f"{rnd.choice(WORDS)}_{i}{suffix}")
+        lines = rnd.randint(10, 80)
+        content = python_source(rnd, name, lines) if suffix == ".py" else cpp_source(rnd, name, lines)
+        if i in needle_ids: content += f"// xkvim_needle_{i}\n"
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            fp.write(content)
+        if i < files - num_excluded: included.append(name)
+    for i in range(large_files):
+        name = os.path.join(rnd.choice(dirs), f"large_{i}.cc")
+        included.append(name)
+        with open(os.path.join(root, name), "w") as fp:
+            written = 0
+            while written < large_size:
+                chunk = cpp_source(rnd, name, 200)
+                fp.write(chunk)
+                written += len(chunk)
+    with open(os.path.join(root, ".vim_config.yaml"), "w") as fp:
+        fp.write(CONFIG)
+    manifest = {
+        "args": args,
+        "dirs": len(dirs),
+        "included_files": len(included) + 1, # with .vim_config.yaml
+        "needles": len(needle_ids),
+        "sample": sorted(included)[:: max(1, len(included) // 100)], # names to search for.
+    }
+    with open(manifest_path, "w") as fp: # written last, a killed run is not reused.
+        json.dump(manifest, fp)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=str)
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--shape", type=str, default="default", choices=list(SHAPES))
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--excluded", type=float, default=0.1, help="part of the files that the excludes skip.")
+    parser.add_argument("--large-files", type=int, default=2)
+    parser.add_argument("--large-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--needles", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = make_repo(args.root, args.files, args.shape, args.files_per_dir, args.excluded,
+                         args.large_files, args.large_size, args.needles, args.seed)
+    print (f"{args.root}: {manifest['dirs']} dirs, {manifest['included_files']} searchable files, {manifest['needles']} needles")
+
+if __name__ == "__main__":
+    main()
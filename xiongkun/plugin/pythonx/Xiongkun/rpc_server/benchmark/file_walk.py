@@ -0,0 +1,62 @@
+"""
+the wall time of GetSearchFiles on a fake repo (benchmark/fake_repo.py):
+
+find   : `find ROOT -not -path ...` read line by line, os.path.isfile per
+         line, as GetSearchFiles was.
+walker : FileWalker with 1 and `--threads` threads, os.scandir and the
+         type of the entries, the excluded directories are not read.
+
+the dentries are cached after the first round, so both run on a warm
+cache (`echo 3 > /proc/sys/vm/drop_caches` between runs for a cold disk).
+the lists must be the same, in the same order.
+
+    python3 benchmark/file_walk.py --files 100000 1000000
+"""
+import os
+import sys
+import time
+import statistics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_repo import make_repo
+from vimrpc.utils import GetSearchConfig, GetSearchFilesFind
+from vimrpc.file_walker import FileWalker
+
+def timeit(fn, rounds):
+    costs, output = [], None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        output = fn()
+        costs.append(time.perf_counter() - start)
+    return costs, output
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, nargs="+", default=[100000])
+    parser.add_argument("--shape", type=str, default="default")
+    parser.add_argument("--large-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--threads", type=int, default=FileWalker.threads)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    print (f"{'files':>10s} {'engine':12s} {'min (ms)':>10s} {'median':>10s} {'found':>10s}")
+    for num in args.files:
+        root = f"/tmp/xkvim-fake-repo-{num}-{args.shape}"
+        make_repo(root, num, args.shape, large_size=args.large_size)
+        excludes = GetSearchConfig(root)
+        engines = [("find", lambda: GetSearchFilesFind(root))]
+        for threads in sorted({1, args.threads}):
+            walker = FileWalker(excludes)
+            walker.threads = threads
+            engines.append((f"walker x{threads}", lambda walker=walker: walker.walk(root)))
+        outputs = {}
+        for name, fn in engines:
+            costs, output = timeit(fn, args.rounds)
+            outputs[name] = output
+            print (f"{num:10d} {name:12s} {min(costs)*1000:10.1f} {statistics.median(costs)*1000:10.1f} {len(output):10d}")
+        expected = outputs.pop("find")
+        for name, output in outputs.items():
+            if list(output) != expected:
+                raise AssertionError(f"{name} differs from find.")
+
+if __name__ == "__main__":
+    main()
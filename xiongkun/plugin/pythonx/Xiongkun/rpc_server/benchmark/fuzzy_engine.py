@@ -0,0 +1,76 @@
+"""
+the two rankings of CandidateIndex on one shard, in this process:
+
+python: a loop per candidate, the mask then shortest_match (str.find).
+numpy : PackedCandidates, the strings as uint8 matrices ranked a query
+        char per pass, without NumPy the index falls back to python.
+
+build is CandidateIndex(items) (set_items of a shard), cold is a query
+without the kept survivors, typing is a keystroke per char of --query
+then backspace to the half (the survivors are refined). the results of
+the two are compared, they must be the same.
+
+    python3 benchmark/fuzzy_engine.py --num 100000 500000 2000000
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from keystroke_latency import fake_paths, percentile
+from vimrpc.fuzzy_index import CandidateIndex, np
+
+COLD = ["o", "ker", "opk", "operatorkernel", "fluid_12.cc", "ker +python -tests", "zzqq"]
+
+def search(index, query):
+    text, *qualifier = query.split(" ")
+    return index.search(text, qualifier, 17)
+
+def bench(items, use_numpy, typing, rounds):
+    CandidateIndex.use_numpy = use_numpy
+    start = time.perf_counter()
+    index = CandidateIndex(items)
+    build = time.perf_counter() - start
+    cold, results = {}, {}
+    for query in COLD:
+        costs = []
+        for _ in range(rounds):
+            index.refines.clear()
+            start = time.perf_counter()
+            results[query] = search(index, query)
+            costs.append(time.perf_counter() - start)
+        cold[query] = min(costs)
+    keys = [typing[:i] for i in range(1, len(typing)+1)] + [typing[:i] for i in range(len(typing)-1, len(typing)//2, -1)]
+    costs = []
+    index.refines.clear()
+    for key in keys:
+        start = time.perf_counter()
+        results["typing " + key] = search(index, key)
+        costs.append(time.perf_counter() - start)
+    return build, cold, costs, results
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, nargs="+", default=[100000, 500000])
+    parser.add_argument("--query", type=str, default="operatorkernel")
+    parser.add_argument("--rounds", type=int, default=3, help="cold queries report the best of N.")
+    args = parser.parse_args()
+    if np is None:
+        print ("numpy is not installed, only the python ranking.")
+    for num in args.num:
+        items = fake_paths(num)
+        engines = [("python", False)] + ([("numpy", True)] if np is not None else [])
+        outputs = { name: bench(items, use_numpy, args.query, args.rounds) for name, use_numpy in engines }
+        print (f"== {num} candidates")
+        print (f"{'ms':22s}" + "".join(f"{name:>12s}" for name, _ in engines))
+        print (f"{'build':22s}" + "".join(f"{outputs[name][0]*1000:12.1f}" for name, _ in engines))
+        for query in COLD:
+            print (f"{'cold ' + query:22s}" + "".join(f"{outputs[name][1][query]*1000:12.1f}" for name, _ in engines))
+        for p in [50, 99]:
+            print (f"{f'typing p{p}':22s}" + "".join(f"{percentile(outputs[name][2], p)*1000:12.1f}" for name, _ in engines))
+        print (f"{'typing total':22s}" + "".join(f"{sum(outputs[name][2])*1000:12.1f}" for name, _ in engines))
+        if len(engines) > 1 and outputs["python"][3] != outputs["numpy"][3]:
+            raise AssertionError("the rankings of python and numpy differ.")
+
+if __name__ == "__main__":
+    main()
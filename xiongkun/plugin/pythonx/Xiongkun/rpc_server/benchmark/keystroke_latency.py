@@ -0,0 +1,87 @@
+"""
+per-keystroke latency of fuzzyfinder.search.
+
+before: the old AsyncServer path, kill + fork a process per call, which 
+        forks a KillablePool(20) to match the candidates.
+after : the warm WorkerPool, the shards stay in the scatter workers.
+
+    python3 benchmark/keystroke_latency.py --num 200000
+"""
+import os
+import sys
+import time
+import random
+import multiprocessing as mp
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vimrpc.fuzzy_list import FuzzyList, fuzzy_match_pool, merge_search
+from vimrpc.decorator import default_map_fn
+from vimrpc.functions import KillablePool
+from vimrpc.worker_pool import WorkerPool
+
+def fake_paths(num, seed=0):
+    rnd = random.Random(seed)
+    words = ["paddle", "fluid", "operators", "kernel", "phi", "core", "utils", "python", "tests",
+             "framework", "memory", "platform", "distributed", "jit", "ir", "pass", "api", "infer"]
+    suffix = [".cc", ".h", ".py", ".cu", ".txt"]
+    paths = []
+    for i in range(num):
+        depth = rnd.randint(2, 6)
+        parts = [rnd.choice(words) for _ in range(depth)]
+        paths.append("/".join(parts) + f"/{rnd.choice(words)}_{i}{rnd.choice(suffix)}")
+    return paths
+
+def percentile(costs, p):
+    costs = sorted(costs)
+    return costs[min(len(costs)-1, int(len(costs) * p / 100))]
+
+def report(name, costs):
+    print (f"{name:8s} p50 {percentile(costs, 50)*1000:8.1f} ms   p99 {percentile(costs, 99)*1000:8.1f} ms")
+
+def old_search(queue, id, items, search_text):
+    num_worker = 20
+    with KillablePool(num_worker) as p:
+        inputs = default_map_fn(1, num_worker, search_text, items)
+        outputs = p.map(fuzzy_match_pool, inputs)
+    queue.put((id, True, merge_search(outputs, "bench", search_text)))
+
+def bench_old(items, keys):
+    queue = mp.Queue()
+    costs = []
+    for id, key in enumerate(keys):
+        start = time.time()
+        p = mp.Process(target=old_search, args=(queue, id, items, key))
+        p.start()
+        queue.get()
+        costs.append(time.time() - start)
+        p.join()
+    return costs
+
+def bench_new(items, keys):
+    queue = mp.Queue()
+    pool = WorkerPool()
+    fuzzy = FuzzyList(queue, pool)
+    pool.register("fuzzyfinder", fuzzy)
+    pool.start(queue)
+    fuzzy.set_items(-1, "bench", items)
+    search = fuzzy.get_service("search")
+    costs = []
+    for id, key in enumerate(keys):
+        start = time.time()
+        search(id, "bench", key)
+        queue.get()
+        costs.append(time.time() - start)
+    pool.terminal_all()
+    return costs
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=100000)
+    parser.add_argument("--query", type=str, default="operatorkernel")
+    args = parser.parse_args()
+    mp.set_start_method("fork")
+    items = fake_paths(args.num)
+    keys = [args.query[:i] for i in range(1, len(args.query)+1)]
+    print (f"{args.num} candidates, {len(keys)} keystrokes.")
+    report("before", bench_old(items, keys))
+    report("after", bench_new(items, keys))
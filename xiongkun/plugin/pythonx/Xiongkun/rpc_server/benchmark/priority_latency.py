@@ -0,0 +1,85 @@
+"""
+latency of an interactive filefinder.search while a grep crawl runs.
+
+normal    : the grep is sent without priority, its egreps compete with the search.
+background: the grep is sent as [id, name, args, 2], it runs in the niced
+            background worker and its egreps are niced (with their autogroup).
+
+    python3 benchmark/priority_latency.py --directory /usr
+"""
+import os
+import sys
+import time
+import json
+import socket
+import signal
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+
+def percentile(costs, p):
+    costs = sorted(costs)
+    return costs[min(len(costs)-1, int(len(costs) * p / 100))]
+
+class Client:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.sendall(b"vimrpc priority\n")
+        self.buf = b""
+
+    def send(self, id, name, args, priority=None):
+        package = [id, name, args] + ([priority] if priority is not None else [])
+        self.sock.sendall(json.dumps(package).encode("utf-8") + b"\n")
+
+    def wait(self, id):
+        while True:
+            while b"\n" not in self.buf:
+                data = self.sock.recv(65536)
+                if not data: raise EOFError("server closed.")
+                self.buf += data
+            line, self.buf = self.buf.split(b"\n", 1)
+            if json.loads(line)[0] == id: return
+
+def start_server(path):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "tcp_server.py"), "--unix", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    while not os.path.exists(path): time.sleep(0.01)
+    return proc
+
+def bench(path, directory, pattern, grep_priority, num):
+    proc = start_server(path)
+    try:
+        client = Client(path)
+        client.send(1, "filefinder.set_root", [ROOT])
+        client.wait(1)
+        if grep_priority != "idle":
+            client.send(2, "grepfinder.search", [directory, pattern], grep_priority)
+            time.sleep(0.3)
+        costs = []
+        for i in range(num):
+            start = time.time()
+            client.send(100 + i, "filefinder.search", ["x", "tcpserver"], INTERACTIVE)
+            client.wait(100 + i)
+            costs.append(time.time() - start)
+        client.send(3, "cancel", [2])
+        return costs
+    finally:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        if os.path.exists(path): os.unlink(path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", type=str, default="/usr")
+    parser.add_argument("--pattern", type=str, default="(a|e)[a-z]*(b|q)[a-z]*(c|x)[0-9]")
+    parser.add_argument("--num", type=int, default=20)
+    args = parser.parse_args()
+    path = f"/tmp/xkvim-bench-{os.getpid()}.sock"
+    for name, priority in [("idle", "idle"), ("normal", None), ("background", BACKGROUND)]:
+        costs = bench(path, args.directory, args.pattern, priority, args.num)
+        print (f"{name:10s} p50 {percentile(costs, 50)*1000:8.1f} ms   p99 {percentile(costs, 99)*1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
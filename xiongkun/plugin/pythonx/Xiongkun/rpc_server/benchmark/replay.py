@@ -0,0 +1,186 @@
+"""
+replay a session recorded by `tcp_server.py --record DIR` against a local
+server, without vim: the requests are sent with their recorded pacing, the
+latency of every call and the cpu of the server are reported.
+
+    first : request sent -> first response (the first chunk of a stream).
+    total : request sent -> the finished response.
+    cpu   : user + sys seconds of the server and its children (the session
+            process, warm workers, egrep / find), from /proc.
+
+    XKVIM_RPC_RECORD=/tmp/xkvim-record vim ...        # or tcp_server.py --record
+    python3 benchmark/replay.py /tmp/xkvim-record/vimrpc-*.jsonl --speed 0
+    python3 benchmark/replay.py session.jsonl --max-gap 1 --rewrite /home/me/Paddle=/data/Paddle
+
+--speed 2 halves the gaps between the requests, 0 sends them at once,
+--max-gap cuts the idle time (the user reading code) to at most N seconds.
+run it with --server pointing to an older tcp_server.py to compare.
+"""
+import os
+import sys
+import time
+import json
+import socket
+import signal
+import argparse
+import threading
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from socket_stream import SockStream, FrameStream
+from message_codec import decode_message
+from traffic_recorder import load_recording
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(costs, p):
+    costs = sorted(costs)
+    return costs[min(len(costs)-1, int(len(costs) * p / 100))]
+
+def start_server(server, path):
+    proc = subprocess.Popen([sys.executable, server, "--unix", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + 10
+    while not os.path.exists(path):
+        if time.time() > deadline: raise TimeoutError("server is not listening.")
+        time.sleep(0.01)
+    return proc
+
+def group_cpu(pgid):
+    """ user + sys seconds of the alive processes of the group, with their waited children.
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/stat") as fp:
+                fields = fp.read().rsplit(")", 1)[1].split()
+        except OSError: # exited.
+            continue
+        if int(fields[2]) == pgid: # fields[0] is the state, see proc(5).
+            total += sum(int(f) for f in fields[11:15]) # utime stime cutime cstime
+    return total / ticks
+
+def schedule(requests, speed, max_gap):
+    """ (send time from the start, request) with the gaps scaled by speed and cut by max_gap.
+    """
+    output, last, offset = [], 0.0, 0.0
+    for record in requests:
+        gap = record["t"] - last
+        last = record["t"]
+        if max_gap is not None: gap = min(gap, max_gap)
+        offset += gap / speed if speed else 0.0
+        output.append((offset, record["req"]))
+    return output
+
+def rewrite(req, pairs):
+    if not pairs: return req
+    text = json.dumps(req)
+    for old, new in pairs:
+        text = text.replace(json.dumps(old)[1:-1], json.dumps(new)[1:-1])
+    return json.loads(text)
+
+class Replayer:
+    def __init__(self, path, header, requests, responses):
+        self.header = header
+        self.mode = header["mode"]
+        self.stream = FrameStream() if self.mode == "vimrpc2" else SockStream()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.sendall(" ".join([self.mode] + header.get("options", [])).encode("utf-8") + b"\n")
+        self.methods = {} # id -> name
+        self.sent = {}
+        self.first = {}
+        self.finished = {}
+        self.bytes = 0
+        self.done_sending = None
+        # the calls finished in the recording, the cancelled ones never finish.
+        self.expected = set(r["id"] for r in responses if r["done"] and r["id"] >= 0)
+
+    def send(self, plan):
+        start = time.time()
+        for offset, req in plan:
+            delay = start + offset - time.time()
+            if delay > 0: time.sleep(delay)
+            self.methods[req[0]] = req[1]
+            self.sent[req[0]] = time.time()
+            self.sock.sendall(self.stream.pack(json.dumps(req).encode("utf-8")))
+        self.done_sending = time.time()
+
+    def receive(self, timeout, idle):
+        """ until the calls finished in the recording finish, a search sent 
+            without the pacing can be superseded by the next one and never 
+            finish, so stop `idle` seconds after the last response as well.
+        """
+        deadline = time.time() + timeout
+        self.last = last = time.time()
+        self.sock.settimeout(0.1)
+        while not self.expected <= set(self.finished) and time.time() < deadline:
+            if self.done_sending and time.time() - max(last, self.done_sending) > idle:
+                break
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not data: break
+            now = self.last = last = time.time()
+            self.bytes += len(data)
+            self.stream.put_bytes(data)
+            while self.stream.can_read():
+                id, is_finished, output = json.loads(decode_message(str(self.stream.readline(), "utf-8")))
+                self.first.setdefault(id, now)
+                if is_finished: self.finished[id] = now
+
+    def report(self):
+        firsts, totals = {}, {}
+        for id, name in self.methods.items():
+            if id in self.first:
+                firsts.setdefault(name, []).append(self.first[id] - self.sent[id])
+            if id in self.finished:
+                totals.setdefault(name, []).append(self.finished[id] - self.sent[id])
+        lines = [f"{'method':28s} {'calls':>6s} {'done':>6s} {'first p50/p99 ms':>22s} {'total p50/p99 ms':>22s}"]
+        for name in sorted(set(self.methods.values()), key=lambda name: -list(self.methods.values()).count(name)):
+            calls = list(self.methods.values()).count(name)
+            line = f"{name[:28]:28s} {calls:6d} {len(totals.get(name, [])):6d}"
+            for costs in [firsts.get(name, None), totals.get(name, None)]:
+                line += f" {percentile(costs, 50)*1000:10.2f}/{percentile(costs, 99)*1000:<10.2f}" if costs else f" {'-':>22s}"
+            lines.append(line)
+        missing = self.expected - set(self.finished)
+        if missing: lines.append(f"not finished (superseded or lost): {sorted(missing)[:20]}")
+        return lines
+
+def replay(server, recording, speed, max_gap, pairs, timeout, idle):
+    header, requests, responses = load_recording(recording)
+    plan = [ (offset, rewrite(req, pairs)) for offset, req in schedule(requests, speed, max_gap) ]
+    path = f"/tmp/xkvim-replay-{os.getpid()}.sock"
+    proc = start_server(server, path)
+    try:
+        start = time.time()
+        replayer = Replayer(path, header, requests, responses)
+        sender = threading.Thread(target=replayer.send, args=(plan,), daemon=True)
+        sender.start()
+        replayer.receive(timeout + (plan[-1][0] if plan else 0), idle)
+        wall = replayer.last - start # to the last response.
+        cpu = group_cpu(proc.pid)
+    finally:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        if os.path.exists(path): os.unlink(path)
+    print (f"== {os.path.basename(recording)}: {header['mode']} {' '.join(header.get('options', []))}, {len(plan)} requests, recorded {requests[-1]['t'] if requests else 0:.1f} s")
+    print ("\n".join(replayer.report()))
+    print (f"wall {wall:.2f} s   server cpu {cpu:.2f} s   received {replayer.bytes / 1024:.1f} KB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recordings", type=str, nargs="+", help="files written by tcp_server.py --record DIR")
+    parser.add_argument("--server", type=str, default=os.path.join(ROOT, "tcp_server.py"))
+    parser.add_argument("--speed", type=float, default=1.0, help="1 keeps the recorded pacing, 0 sends all the requests at once.")
+    parser.add_argument("--max-gap", type=float, default=None, help="cut the gaps between requests to N seconds.")
+    parser.add_argument("--rewrite", type=str, action="append", default=[], help="OLD=NEW, replace the paths of the recording machine.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait the responses after the last request.")
+    parser.add_argument("--idle", type=float, default=2.0, help="stop after N seconds without responses, the rest are reported as not finished.")
+    args = parser.parse_intermixed_args()
+    pairs = [ item.split("=", 1) for item in args.rewrite ]
+    for recording in args.recordings:
+        replay(args.server, recording, args.speed, args.max_gap, pairs, args.timeout, args.idle)
+
+if __name__ == "__main__":
+    main()
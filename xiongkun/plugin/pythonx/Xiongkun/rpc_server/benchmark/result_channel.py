@@ -0,0 +1,57 @@
+"""
+time from a worker putting a result to the send loop getting it.
+
+before: mp.Manager().Queue(), a proxy through the manager process.
+after : ResultChannel, a pipe selected by the send loop.
+
+    python3 benchmark/result_channel.py
+"""
+import os
+import sys
+import time
+import select
+import multiprocessing as mp
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vimrpc.worker_pool import ResultChannel
+
+def fuzzy_result():
+    return [f"paddle/fluid/operators/kernel_{i}.cc" for i in range(17)], "kernel"
+
+def grep_chunk():
+    return [{'filename': f'/home/data/paddle/fluid/file_{i}.cc', 'lnum': str(i), 'text': 'x' * 80, 'cmd': str(i), 'source': 'Grep'} for i in range(1000)]
+
+def producer(queue, payload, num):
+    for i in range(num):
+        queue.put((i, time.time(), payload))
+        time.sleep(0.002)
+
+def percentile(costs, p):
+    costs = sorted(costs)
+    return costs[min(len(costs)-1, int(len(costs) * p / 100))]
+
+def bench(queue, get, payload, num=300):
+    p = mp.Process(target=producer, args=(queue, payload, num))
+    p.start()
+    costs = []
+    for i in range(num):
+        id, start, _ = get()
+        costs.append(time.time() - start)
+    p.join()
+    return costs
+
+def channel_get(channel):
+    def get():
+        select.select([channel.fileno()], [], [])
+        return channel.get()
+    return get
+
+if __name__ == "__main__":
+    mp.set_start_method("fork")
+    manager = mp.Manager()
+    for name, payload in [("fuzzy result", fuzzy_result()), ("grep chunk", grep_chunk())]:
+        queue = manager.Queue()
+        old = bench(queue, lambda: queue.get(timeout=1), payload)
+        channel = ResultChannel()
+        new = bench(channel, channel_get(channel), payload)
+        print (f"{name:14s} manager queue p50 {percentile(old, 50)*1e6:8.0f} us p99 {percentile(old, 99)*1e6:8.0f} us"
+               f" | ResultChannel p50 {percentile(new, 50)*1e6:8.0f} us p99 {percentile(new, 99)*1e6:8.0f} us")
@@ -0,0 +1,93 @@
+" latency of the sync rpc wait (rpc_wait) in vim, no python needed.
+"
+"   python3 tcp_server.py --host 127.0.0.1 --port 8765 &
+"   PORT=8765 vim -Nu NONE -es -S benchmark/rpc_wait_latency.vim
+"
+" old: the SendMessageSync before, it json_decode every message and sleep 100m when ch_read timeout.
+" new: the id is matched by a regex, no sleep, the other messages are dispatched without decode.
+" every sync call receives an unrelated large response first (fetch of $VIMRUNTIME/doc/eval.txt).
+
+let s:dispatched = 0
+function! BenchServer(channel, msg)
+    let s:dispatched += 1
+endfunction
+
+function! OldSendMessageSync(id, channel, package)
+    call ch_sendraw(a:channel, a:package)
+    let receive_jsons = []
+    while 1
+        let out = ch_read(a:channel, {'timeout': 1000})
+        if out == ""
+            let status = ch_status(a:channel)
+            if status == "fail" || status ==  "closed"
+                break
+            endif
+            sleep 100m
+            continue
+        endif
+        let json = json_decode(out)
+        let cur_id = json_decode(out)[0]
+        if cur_id == a:id
+            call BenchServer(a:channel, out)
+            break
+        else
+            call add(receive_jsons, out)
+        endif
+    endwhile
+    for received in receive_jsons
+        call BenchServer(a:channel, received)
+    endfor
+    return out
+endfunction
+
+function! NewSendMessageSync(id, channel, package)
+    call ch_sendraw(a:channel, a:package)
+    let received = []
+    while 1
+        let out = ch_read(a:channel, {'timeout': 1000})
+        if out == ""
+            let status = ch_status(a:channel)
+            if status == "fail" || status ==  "closed"
+                break
+            endif
+            continue
+        endif
+        if str2nr(matchstr(out, '^[[Z]\zs-\?\d\+')) == a:id
+            break
+        endif
+        call add(received, out)
+    endwhile
+    for msg in received
+        call BenchServer(a:channel, msg)
+    endfor
+    return out
+endfunction
+
+function! s:Percentile(costs, p)
+    let sorted = sort(copy(a:costs), 'f')
+    return sorted[min([len(sorted)-1, float2nr(len(sorted) * a:p / 100.0)])] * 1000
+endfunction
+
+function! s:Bench(name, Fn)
+    let channel = ch_open("127.0.0.1:" . $PORT, {'mode': 'nl', 'callback': 'BenchServer', 'waittime': 1000})
+    call ch_sendraw(channel, "vimrpc\n")
+    let costs = []
+    let id = 1
+    let bigfile = $VIMRUNTIME . "/doc/eval.txt"
+    for i in range(200)
+        let id += 1
+        call ch_sendraw(channel, json_encode([id, "remotefs.fetch", [bigfile]]) . "\n")
+        let id += 1
+        let start = reltime()
+        call call(a:Fn, [id, channel, json_encode([id, "remotefs.exists", ["/tmp"]]) . "\n"])
+        call add(costs, reltimefloat(reltime(start)))
+    endfor
+    call ch_close(channel)
+    call add(s:lines, printf("%s: p50 %.2f ms p99 %.2f ms", a:name, s:Percentile(costs, 50), s:Percentile(costs, 99)))
+endfunction
+
+let s:lines = []
+call s:Bench("old", function("OldSendMessageSync"))
+call s:Bench("new", function("NewSendMessageSync"))
+call writefile(s:lines, "/dev/stdout")
+qa!
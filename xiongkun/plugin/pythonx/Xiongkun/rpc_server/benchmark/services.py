@@ -0,0 +1,179 @@
+"""
+benchmark suite of the services on a fake repo (benchmark/fake_repo.py),
+in the way of pytest-benchmark: every case runs `--rounds` times after a
+warmup, the table has min / mean / median / stddev, `--save` writes the
+results and `--compare` prints the change against a saved run.
+
+    python3 benchmark/services.py --files 100000 --save before.json
+    ... change the code ...
+    python3 benchmark/services.py --files 100000 --compare before.json -k fuzzy
+
+the functions are called in this process, not through the server, see
+replay.py for the latency of a whole session.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import importlib.util
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_repo import make_repo, cpp_source
+from vimrpc.utils import GetSearchFiles, GetSearchFilesFind, GetSearchConfig, GetSearchGrepArgs
+from vimrpc.fuzzy_list import fuzzy_match
+from vimrpc.fuzzy_index import CandidateIndex
+from vimrpc.grep_search import GrepSearcher, do_grep_search
+from vimrpc.remote_fs import RemoteFS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_clangd_client_utils():
+    # only this file: Xiongkun/ imports vim and its traceback.py shadows the stdlib one.
+    path = os.path.join(os.path.dirname(ROOT), "clangd_client_utils.py")
+    spec = importlib.util.spec_from_file_location("clangd_client_utils", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class ListQueue:
+    """ the queue of the services, keep the stream chunks.
+    """
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+class Suite:
+    def __init__(self, root, manifest):
+        self.root = root
+        self.manifest = manifest
+        self.cases = [] # (name, fn, check), check(output of the last round) raises if it is wrong.
+
+    def case(self, name, fn, check=None):
+        self.cases.append((name, fn, check))
+
+    def run(self, pattern, rounds, warmup, max_time):
+        results = {}
+        for name, fn, check in self.cases:
+            if pattern and pattern not in name: continue
+            for _ in range(warmup): fn()
+            costs = []
+            start = time.time()
+            while len(costs) < rounds and (not costs or time.time() - start < max_time):
+                begin = time.perf_counter()
+                output = fn()
+                costs.append(time.perf_counter() - begin)
+            if check is not None: check(output)
+            results[name] = {
+                'rounds': len(costs),
+                'min': min(costs),
+                'max': max(costs),
+                'mean': statistics.mean(costs),
+                'median': statistics.median(costs),
+                'stddev': statistics.stdev(costs) if len(costs) > 1 else 0.0,
+            }
+            print (format_row(name, results[name]), flush=True)
+        return results
+
+def format_row(name, result, base=None):
+    line = f"{name[:40]:40s} {result['min']*1000:10.2f} {result['mean']*1000:10.2f} {result['median']*1000:10.2f} {result['stddev']*1000:10.2f} {result['rounds']:6d}"
+    if base is not None:
+        line += f" {(result['median'] / base['median'] - 1) * 100:+9.1f}%"
+    return line
+
+def header(compare=False):
+    return f"{'name (ms)':40s} {'min':>10s} {'mean':>10s} {'median':>10s} {'stddev':>10s} {'rounds':>6s}" + (f" {'vs base':>10s}" if compare else "")
+
+def expect(name, value, expected):
+    if value != expected:
+        raise AssertionError(f"{name}: got {value}, expected {expected}")
+
+def build_suite(root, manifest):
+    suite = Suite(root, manifest)
+    files = list(GetSearchFiles(root, relative=True))
+    rnd = random.Random(0)
+    sample = manifest["sample"]
+
+    suite.case("GetSearchFiles", lambda: GetSearchFiles(root),
+               lambda output: expect("GetSearchFiles", len(output), manifest["included_files"]))
+    suite.case("GetSearchFiles[find]", lambda: GetSearchFilesFind(root),
+               lambda output: expect("GetSearchFiles[find]", len(output), manifest["included_files"]))
+
+    basename = os.path.splitext(os.path.basename(rnd.choice(sample)))[0]
+    queries = [("short", basename[:3]), ("basename", basename), ("qualified", f"{basename[:4]} +{sample[0].split('/')[0]}"), ("miss", "zzqqxx")]
+    index = CandidateIndex(files) # built by set_items, once for the keystrokes.
+    suite.case("CandidateIndex", lambda: CandidateIndex(files))
+    def cold(query): # the first query on the list, not refined.
+        index.refines.clear()
+        return fuzzy_match(query, index)
+    for tag, query in queries:
+        suite.case(f"fuzzy_match[{tag}]", lambda query=query: cold(query))
+    def typing(): # a keystroke per char, then backspace to the half.
+        index.refines.clear()
+        keys = [basename[:i] for i in range(1, len(basename)+1)] + [basename[:i] for i in range(len(basename)-1, len(basename)//2, -1)]
+        return [ fuzzy_match(key, index) for key in keys ]
+    suite.case("fuzzy_match[typing]", typing)
+
+    extra_args = GetSearchGrepArgs(GetSearchConfig(root))
+    needle = "xkvim_needle_[0-9]+"
+    suite.case("do_grep_search[needle]", lambda: do_grep_search((needle, extra_args, root, 1, ListQueue())),
+               lambda output: expect("do_grep_search", len(output), manifest["needles"]))
+    suite.case("do_grep_search[common]", lambda: do_grep_search(("DenseTensor", extra_args, root, 1, ListQueue())))
+    def grep_split():
+        queue = ListQueue()
+        GrepSearcher(queue, None).search(1, root, needle)
+        return [item for id, is_finished, chunk in queue.items for item in chunk]
+    suite.case("GrepSearcher.search[needle]", grep_split,
+               lambda output: expect("GrepSearcher.search", len(output), manifest["needles"]))
+
+    suite.case("RemoteFS.tree", lambda: RemoteFS().tree(1, root))
+
+    utils = load_clangd_client_utils()
+    for lines in [1000, 10000]:
+        old = cpp_source(random.Random(lines), "delta.cc", lines).split("\n")
+        new = list(old)
+        for idx in sorted(rnd.sample(range(len(new)), 10), reverse=True): # edits of a save.
+            if idx % 2: new.insert(idx, "  // edited")
+            else: del new[idx]
+        suite.case(f"get_content_deltas[{lines} lines]", lambda old=old, new=new: utils.get_content_deltas(old, new),
+                   lambda output, old=old, new=new: expect("apply_content_deltas", utils.apply_content_deltas(old, output), new))
+    return suite
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", type=str, default=None, help="the fake repo, default /tmp/xkvim-fake-repo-<files>-<shape>")
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--shape", type=str, default="default")
+    parser.add_argument("--large-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("-k", type=str, default="", help="only the cases whose name contains it.")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--max-time", type=float, default=10.0, help="stop a case after N seconds, at least one round.")
+    parser.add_argument("--save", type=str, default=None)
+    parser.add_argument("--compare", type=str, default=None)
+    args = parser.parse_args()
+    root = args.root or f"/tmp/xkvim-fake-repo-{args.files}-{args.shape}"
+    start = time.time()
+    manifest = make_repo(root, args.files, args.shape, large_size=args.large_size)
+    print (f"{root}: {manifest['included_files']} searchable files, ready in {time.time() - start:.1f} s")
+    suite = build_suite(root, manifest)
+    base = None
+    if args.compare:
+        with open(args.compare) as fp:
+            base = json.load(fp)["results"]
+    print (header())
+    results = suite.run(args.k, args.rounds, args.warmup, args.max_time)
+    if base is not None:
+        print (f"\ncompared with {args.compare}")
+        print (header(True))
+        for name, result in results.items():
+            print (format_row(name, result, base.get(name, None)))
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump({"root": root, "manifest_args": manifest["args"], "results": results}, fp, indent=2)
+
+if __name__ == "__main__":
+    main()
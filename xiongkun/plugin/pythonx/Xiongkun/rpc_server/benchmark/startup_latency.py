@@ -0,0 +1,84 @@
+"""
+time from starting the server to the first rpc response, what vim waits
+for when it starts.
+
+    connect: the unix socket accepts a connection.
+    first  : the first response of a `vimrpc` session, the session process
+             creates the services before it reads the request.
+
+before: every service module (requests, bs4, tree_sitter ...) is imported
+        by the server and every service is created for a session.
+after : remotefs / hoogle / config are loaded by the first call, run it
+        with --server pointing to an older tcp_server.py to compare.
+
+    python3 benchmark/startup_latency.py --repeat 10
+"""
+import os
+import sys
+import time
+import json
+import socket
+import signal
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(costs, p):
+    costs = sorted(costs)
+    return costs[min(len(costs)-1, int(len(costs) * p / 100))]
+
+def connect(path, deadline):
+    while time.time() < deadline:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except OSError:
+            sock.close()
+            time.sleep(0.001)
+    raise TimeoutError("server is not listening.")
+
+def first_response(sock, name, args):
+    sock.sendall(b"vimrpc\n")
+    sock.sendall(json.dumps([1, name, args]).encode("utf-8") + b"\n")
+    received = b""
+    while b"\n" not in received:
+        data = sock.recv(65536)
+        if not data: raise EOFError("server closed.")
+        received += data
+    return json.loads(received.split(b"\n")[0])
+
+def once(server, path, name, args):
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, server, "--unix", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        sock = connect(path, start + 10)
+        connected = time.time() - start
+        first_response(sock, name, args)
+        first = time.time() - start
+        sock.close()
+    finally:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        if os.path.exists(path): os.unlink(path)
+    return connected, first
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", type=str, default=os.path.join(ROOT, "tcp_server.py"))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--call", type=str, default="filefinder.set_root", help="filefinder.set_root / remotefs.fetch ...")
+    args = parser.parse_args()
+    path = f"/tmp/xkvim-bench-{os.getpid()}.sock"
+    call_args = [ROOT] if args.call == "filefinder.set_root" else [os.path.abspath(__file__)]
+    connects, firsts = [], []
+    for i in range(args.repeat):
+        connected, first = once(args.server, path, args.call, call_args)
+        connects.append(connected)
+        firsts.append(first)
+    print (f"connect p50 {percentile(connects, 50)*1000:8.1f} ms   max {max(connects)*1000:8.1f} ms")
+    print (f"first   p50 {percentile(firsts, 50)*1000:8.1f} ms   max {max(firsts)*1000:8.1f} ms   ({args.call})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Carry the connections of vim (rpc, lsp, bash) to the remote server over one
+# connection, see mux_session.py. vim connects to 127.0.0.1:<listen-port>.
+import os
+import sys
+import socket
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mux_session import MuxSession
+
+def parameter_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Support Args:")
+    parser.add_argument("--host",                 type=str,   help="remote server host")
+    parser.add_argument("--port",                 type=int,   help="remote server port")
+    parser.add_argument("--listen-port",          type=int,   default=0, help="local port, 0 for a free one.")
+    return parser.parse_args()
+
+args = parameter_parser()
+listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+listen.bind(("127.0.0.1", args.listen_port))
+listen.listen(20)
+sock = socket.create_connection((args.host, args.port))
+sock.sendall(b"mux\n")
+session = MuxSession(sock)
+print (f"ready {listen.getsockname()[1]}", flush=True)
+while not session.closed:
+    if os.getppid() == 1: break # father process is killed, we exit.
+    session.poll(listen)
+session.close()
+listen.close()
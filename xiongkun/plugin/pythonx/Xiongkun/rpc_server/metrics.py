@@ -0,0 +1,134 @@
+from threading import Lock
+
+class Histogram:
+    """
+    Latency histogram with buckets of milliseconds growing by sqrt(2): the
+    bucket i counts the samples <= 0.25 * 2**(i/2) ms (0.25 ms ... 32 s),
+    the last one the rest. percentiles are the upper bound of their bucket.
+    """
+    bounds = [ 0.25 * 2 ** (i / 2) for i in range(35) ]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        idx = 0
+        while idx < len(self.bounds) and ms > self.bounds[idx]:
+            idx += 1
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        if self.count == 0: return 0.0
+        rank = self.count * p / 100
+        seen = 0
+        for idx, num in enumerate(self.buckets):
+            seen += num
+            if seen >= rank and num:
+                return self.bounds[idx] if idx < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+        }
+
+class MethodMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.histograms = {}
+
+    def observe(self, stage, seconds):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram()
+        self.histograms[stage].add(seconds)
+
+    def to_dict(self):
+        output = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+        for stage, histogram in self.histograms.items():
+            output[stage] = histogram.to_dict()
+        return output
+
+class Metrics:
+    """
+    Counters and latency histograms per rpc method, used by the server
+    (ServerCluster) and the client (RPCChannel), reported by `stats`.
+
+    stages of the server: queue (received -> started in the thread pool),
+    execute (started -> the output is ready, includes the warm workers),
+    serialize (encode of every response), total (received -> last sent).
+    stages of the client: pack / unpack and total (sent -> last received).
+    """
+    def __init__(self):
+        self.methods = {}
+        self.lock = Lock()
+
+    def _method(self, name):
+        if name not in self.methods:
+            self.methods[name] = MethodMetrics()
+        return self.methods[name]
+
+    def count(self, name, key, num=1):
+        with self.lock: # the send loop and the thread pools.
+            metrics = self._method(name)
+            setattr(metrics, key, getattr(metrics, key) + num)
+
+    def observe(self, name, stage, seconds):
+        with self.lock:
+            self._method(name).observe(stage, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return { name: metrics.to_dict() for name, metrics in self.methods.items() }
+
+def format_table(methods, stages):
+    """ lines of a text table of Metrics.snapshot(), for :RPCStats.
+    """
+    header = f"{'method':28s} {'calls':>6s} {'err':>4s} {'cancel':>6s} {'in KB':>8s} {'out KB':>8s}"
+    for stage in stages:
+        header += f" {stage + ' p50/p99 ms':>22s}"
+    lines = [header]
+    for name, m in sorted(methods.items(), key=lambda item: -item[1]['calls']):
+        line = f"{name[:28]:28s} {m['calls']:6d} {m['errors']:4d} {m['cancelled']:6d} {m['bytes_in']/1024:8.1f} {m['bytes_out']/1024:8.1f}"
+        for stage in stages:
+            h = m.get(stage, None)
+            line += f" {h['p50_ms']:10.2f}/{h['p99_ms']:<10.2f}" if h else f" {'-':>22s}"
+        lines.append(line)
+    return lines
+
+def format_lists(lists):
+    """ lines of the candidate lists of the FuzzyLists (CandidateStore.stats() by path), for :RPCStats.
+    """
+    lines = []
+    for path, store in lists.items():
+        lines.append(f"{path}: {store['used_kb']/1024:.1f} / {store['budget_kb']/1024:.0f} MB, {store['evicted']} evicted")
+        for name, l in store['lists'].items():
+            lines.append(f"  {name[:40]:40s} {l['items']:9d} items {l['kb']:10.1f} KB  idle {l['idle_s']:7.0f} s" + ("  pinned" if l['pinned'] else ""))
+    return lines
+
+if __name__ == "__main__":
+    metrics = Metrics()
+    for i in range(100):
+        metrics.count("remotefs.fetch", "calls")
+        metrics.observe("remotefs.fetch", "total", i / 1000)
+    print ("\n".join(format_table(metrics.snapshot(), ["total"])))
@@ -0,0 +1,173 @@
+import socket
+import select
+from collections import deque
+from socket_stream import FrameStream
+
+OPEN, DATA, WINDOW, CLOSE = b'O', b'D', b'W', b'C'
+
+class _Channel:
+    def __init__(self, id, sock, window):
+        self.id = id
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.send_window = window # bytes the peer can still buffer for us.
+        self.pending = None # one chunk read from sock, waiting for its turn.
+        self.incoming = bytearray() # received from the peer, not written to sock yet.
+        self.consumed = 0 # written to sock, not acknowledged to the peer yet.
+        self.closing = False # the peer closed, close sock after incoming is written.
+
+class MuxSession:
+    """
+    Many logical channels over one connection, used by the `mux` mode.
+
+    every message is a FrameStream frame whose payload is
+
+        type(1 byte) + channel id (8 hex digits) + data
+
+    OPEN starts a channel, its first bytes are the mode line of the channel
+    (vimrpc2 / lsp / bash ...), so the handlers behind don't know the mux.
+    flow control is per channel: a channel sends at most `window` bytes not
+    acknowledged by WINDOW, which the receiver sends after writing them to
+    the local socket. a slow reader only stops its own channel. sending is
+    round robin and one chunk at a time, so a chatty terminal can't starve
+    the completions.
+    """
+    window = 256 * 1024
+    chunk = 16 * 1024
+
+    def __init__(self, sock, on_open=None):
+        """ on_open(id) returns the local socket of a channel opened by the peer,
+            None to refuse it.
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        if sock.family != socket.AF_UNIX: 
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # small frames of many channels.
+        self.stream = FrameStream()
+        self.on_open = on_open
+        self.channels = {}
+        self.ready = deque() # channels with pending data, round robin.
+        self.out = bytearray() # bytes to write to the connection.
+        self.next_id = 1
+        self.closed = False
+
+    def _frame(self, type, id, data=b''):
+        self.out += self.stream.pack(type + b"%08x" % id + data)
+
+    def open(self, sock):
+        id = self.next_id
+        self.next_id += 1
+        self.channels[id] = _Channel(id, sock, self.window)
+        self._frame(OPEN, id)
+        return id
+
+    def _drop(self, ch):
+        self.channels.pop(ch.id, None)
+        try:
+            ch.sock.close()
+        except OSError:
+            pass
+
+    def _read_local(self, ch):
+        try:
+            data = ch.sock.recv(min(self.chunk, ch.send_window))
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._frame(CLOSE, ch.id)
+            self._drop(ch)
+            return
+        ch.send_window -= len(data)
+        ch.pending = data
+        self.ready.append(ch)
+
+    def _write_local(self, ch):
+        try:
+            n = ch.sock.send(ch.incoming)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._frame(CLOSE, ch.id)
+            self._drop(ch)
+            return
+        del ch.incoming[:n]
+        ch.consumed += n
+        if ch.consumed >= self.window // 4 or (not ch.incoming and ch.consumed):
+            self._frame(WINDOW, ch.id, b"%d" % ch.consumed)
+            ch.consumed = 0
+        if ch.closing and not ch.incoming:
+            self._drop(ch)
+
+    def _read_remote(self):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.closed = True
+            return
+        self.stream.put_bytes(data)
+        while self.stream.can_read():
+            msg = bytes(self.stream.readline())
+            type, id, data = msg[:1], int(msg[1:9], 16), msg[9:]
+            ch = self.channels.get(id, None)
+            if type == OPEN:
+                sock = self.on_open(id) if self.on_open else None
+                if sock is None: self._frame(CLOSE, id)
+                else: self.channels[id] = _Channel(id, sock, self.window)
+            elif ch is None:
+                continue # closed by this side.
+            elif type == DATA:
+                ch.incoming += data
+            elif type == WINDOW:
+                ch.send_window += int(data)
+            elif type == CLOSE:
+                ch.closing = True
+                if not ch.incoming: self._drop(ch)
+
+    def _write_remote(self):
+        # refill one chunk at a time, control frames are never queued behind much data.
+        while len(self.out) < self.chunk and self.ready:
+            ch = self.ready.popleft()
+            if ch.id in self.channels and ch.pending is not None:
+                self._frame(DATA, ch.id, ch.pending)
+            ch.pending = None
+        if not self.out:
+            return
+        try:
+            n = self.sock.send(self.out)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.closed = True
+            return
+        del self.out[:n]
+
+    def poll(self, listen=None, timeout=3.0):
+        """ one round of the loop, a local connection accepted from listen opens a channel.
+        """
+        rs = [self.sock]
+        ws = [self.sock] if self.out or self.ready else []
+        if listen is not None: rs.append(listen)
+        for ch in self.channels.values():
+            if ch.pending is None and ch.send_window > 0 and not ch.closing: rs.append(ch.sock)
+            if ch.incoming: ws.append(ch.sock)
+        rs, ws, _ = select.select(rs, ws, [], timeout)
+        if self.sock in rs:
+            self._read_remote()
+        if listen is not None and listen in rs:
+            conn, _ = listen.accept()
+            self.open(conn)
+        for ch in list(self.channels.values()):
+            if ch.sock in ws and ch.id in self.channels: self._write_local(ch)
+            if ch.sock in rs and ch.id in self.channels: self._read_local(ch)
+        self._write_remote()
+
+    def close(self):
+        for ch in list(self.channels.values()):
+            self._drop(ch)
+        self.sock.close()
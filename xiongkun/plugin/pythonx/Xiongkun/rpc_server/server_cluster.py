@@ -4,68 +4,128 @@ import socket
 import sys
 import threading
 from threading import Thread
-from vimrpc.fuzzy_list import FuzzyList
-from vimrpc.file_finder import FileFinder
+import traceback
+import time
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
 from vimrpc.decorator import InQueue, Service, AsyncServer
-from vimrpc.remote_fs import RemoteFS
-from vimrpc.yiyan_server import Yiyan
-from vimrpc.grep_search import GrepSearcher
-from vimrpc.hoogle import HoogleSearcher
-from vimrpc.configure import ProjectConfigure
+from vimrpc.worker_pool import WorkerPool, ResultChannel, ThreadTask, Cancelled, bind_task, NORMAL, BACKGROUND
+from vimrpc.candidate_store import CandidateStore
 import multiprocessing as mp
 from log import log
-
-class ProcessManager:
-    def __init__(self):
-        self.pools = {}
-
-    def terminal_all(self): 
-        for p in self.pools.values():
-            p.terminate()
-            p.join()
-        self.pools.clear()
-
-    def terminal(self, server, func_name):
-        hashid = hash((id(server), func_name))
-        if hashid in self.pools:
-            self.pools[hashid].terminate()
-            self.pools[hashid].join()
-            del self.pools[hashid]
-
-    def start_process(self, server, func_name, target, args):
-        hashid = hash((id(server), func_name))
-        p = mp.Process(target=target, args=args)
-        p.start()
-        self.pools[hashid] = p
-        return p
+from message_codec import MessageCodec
+from stream_coalescer import StreamCoalescer
+from metrics import Metrics
 
 class ServerCluster: 
-    def __init__(self, mp_manager):
-        self.process_manager = ProcessManager()
-        self.queue = mp_manager.Queue()
+    # max running calls of each service, the stateful services keep 1 so 
+    # their calls are executed in the received order.
+    concurrency = {
+        'remotefs': 4,
+        'config': 2,
+        'hoogle': 2,
+    }
+
+    def __init__(self, options=()):
+        self.worker_pool = WorkerPool()
+        self.queue = self.create_queue()
+        self.codec = MessageCodec(options)
+        self.coalescer = StreamCoalescer(options)
+        self.metrics = Metrics()
+        self.calls = {} # id -> [name, received, started] of the service calls not answered.
+        self.executors = {}
+        self.tasks = {} # id -> ThreadTask of the calls in the thread pools.
+        self.priorities = {} # id -> priority of the calls whose results are in the queue.
+        self.pending = {} # service -> heap of (priority, seq, job) waiting for its thread pool, FIFO at concurrency 1.
+        self.pending_lock = threading.Lock()
+        self.seq = itertools.count()
+        self.lazy_services = {} # name -> (module, class, args) not created yet.
+        self.load_lock = threading.RLock()
         self._init_server()
+        self._register_services("", self)
+        if any(isinstance(s, AsyncServer) for s in self.worker_pool.services.values()):
+            self.worker_pool.start(self.queue)
         def keeplive(*a, **kw): 
             return [-1, True, 'ok']
         self.keeplive = keeplive
         self._stop = False
 
+    def create_queue(self):
+        return ResultChannel()
+
     def _init_server(self):
-        self.filefinder = FileFinder(self.queue, self.process_manager)
-        self.remotefs = RemoteFS()
-        self.fuzzyfinder = FuzzyList(self.queue, self.process_manager)
-        self.grepfinder = GrepSearcher(self.queue, self.process_manager)
-        self.hoogle = HoogleSearcher(self.queue)
-        self.config = ProjectConfigure(self.queue)
+        # the AsyncServers are created now, the warm workers are forked with them.
+        self.add_service("filefinder", "vimrpc.file_finder", "FileFinder", self.queue, self.worker_pool, lazy=False)
+        self.add_service("fuzzyfinder", "vimrpc.fuzzy_list", "FuzzyList", self.queue, self.worker_pool, lazy=False)
+        self.add_service("grepfinder", "vimrpc.grep_search", "GrepSearcher", self.queue, self.worker_pool, lazy=False)
+        self.add_service("remotefs", "vimrpc.remote_fs", "RemoteFS")
+        self.add_service("hoogle", "vimrpc.hoogle", "HoogleSearcher", self.queue)
+        self.add_service("config", "vimrpc.configure", "ProjectConfigure", self.queue)
+
+    def add_service(self, name, module, cls, *args, lazy=True):
+        """ register the service `name`, a lazy one is imported and created 
+            by its first call, so a session only pays for what it uses.
+        """
+        self.lazy_services[name] = (module, cls, args)
+        if not lazy: 
+            self._load_service(name)
+
+    def _load_service(self, name):
+        with self.load_lock:
+            if name not in self.lazy_services: # loaded by another thread.
+                return getattr(self, name)
+            module, cls, args = self.lazy_services[name]
+            service = getattr(import_module(module), cls)(*args)
+            setattr(self, name, service)
+            self.lazy_services.pop(name)
+            if hasattr(self, "_stop"): # created after __init__.
+                self._register_services("", self)
+            return service
+
+    def __getattr__(self, name):
+        # only called when the attribute is not found, e.g. a lazy service.
+        if name in self.__dict__.get("lazy_services", {}): 
+            return self._load_service(name)
+        raise AttributeError(name)
+
+    def _register_services(self, prefix, obj):
+        """ give every service a path, e.g. `filefinder.fuzzy`, the workers find them by it.
+        """
+        for name, attr in vars(obj).items():
+            if isinstance(attr, (Service, AsyncServer)) and id(attr) not in self.worker_pool.paths:
+                self.worker_pool.register(prefix + name, attr)
+                self._register_services(prefix + name + ".", attr)
 
     def _QueueLoop(self, process_fn):
         #log("[Server]: Start queue loop.")
         while not self._stop:
-            try:
-                output = self.queue.get(timeout=1)
-                #log(f"[Server]: Queue Get! {output}")
-                process_fn(output)
-            except Exception as e:
-                continue
+            self.queue.poll(self.coalescer.timeout(1.0))
+            self.drain_queue(process_fn)
+
+    def drain_queue(self, process_fn):
+        """ send all the ready results, vim_rpc_loop calls it when the queue is readable
+            or a batch of the coalescer is due.
+            the results read together are sent by priority, an interactive 
+            result doesn't wait behind the big grep chunks. the partial results 
+            of a stream are batched by the coalescer.
+        """
+        ready = [] # heap of (priority, seq, output), seq keeps the order of a stream.
+        def pull():
+            while self.queue.poll():
+                output = self.queue.get()
+                heapq.heappush(ready, (self.priorities.get(output[0], NORMAL), next(self.seq), output))
+        pull()
+        while ready:
+            priority, _, output = heapq.heappop(ready)
+            #log(f"[Server]: Queue Get! {output}")
+            if output[1]: 
+                self.priorities.pop(output[0], None)
+                self._observe(output[0], 'execute')
+            self.coalescer.put(output, process_fn)
+            if priority == BACKGROUND: pull() # arrived while sending a big chunk.
+        self.coalescer.flush_due(process_fn)
 
     def get_server_fn(self, name):
         name = name.strip()
@@ -85,19 +145,148 @@ class ServerCluster:
         log("[Server]: don't found ", name, ", skip it.")
         return None
 
+    def _observe(self, id, stage):
+        # execute is from started, the others from received.
+        call = self.calls.get(id, None)
+        if call is not None and call[2] is not None: 
+            self.metrics.observe(call[0], stage, time.time() - call[2 if stage == 'execute' else 1])
+
+    def _finish_call(self, id, key):
+        # the call id ends without output, key is 'errors' or 'cancelled'.
+        call = self.calls.pop(id, None)
+        if call is not None: 
+            self.metrics.count(call[0], key)
+
+    def dispatch(self, id, name, args, sender, priority=NORMAL, size=0):
+        """ call the server function `name` and send the output. 
+            functions of a service run in the thread pool of the service, 
+            so a slow call don't block the socket loop and the other services, 
+            the outputs are sent out of order and tagged by id.
+            the builtin functions (without `.`) are called in place.
+            the queued calls of a service start by priority (INTERACTIVE first) 
+            when it runs several at once, a service of concurrency 1 keeps the 
+            received order, a BACKGROUND call runs in the niced background workers.
+            size is the bytes of the request, for the metrics.
+        """
+        func = self.get_server_fn(name)
+        if not func:
+            return
+        name = name.strip()
+        service = name.split('.')[0]
+        if service != name: 
+            self.calls[id] = [name, time.time(), None]
+            self.metrics.count(name, 'calls')
+            self.metrics.count(name, 'bytes_in', size)
+        task = ThreadTask(id, priority)
+        def job():
+            if task.poll(): # cancelled before started.
+                self._finish_call(id, 'cancelled')
+                return
+            if id in self.calls: 
+                self.calls[id][2] = time.time()
+                self._observe(id, 'queue')
+            bind_task(task)
+            self.priorities[id] = priority
+            output = None
+            try:
+                output = func(id, *args)
+            except Cancelled:
+                log(f"[Server] {name} ({id}) is cancelled.")
+                self._finish_call(id, 'cancelled')
+                return
+            except Exception as e:
+                print (f"[Server] {name} raise exception: {e}")
+                traceback.print_exc()
+                self._finish_call(id, 'errors')
+                return
+            finally:
+                bind_task(None)
+                self.tasks.pop(id, None)
+                if not isinstance(output, InQueue): 
+                    self.priorities.pop(id, None)
+            if isinstance(output, InQueue): 
+                return
+            if task.poll(): 
+                self._finish_call(id, 'cancelled')
+                return
+            self._observe(id, 'execute')
+            sender(output)
+        if service == name: 
+            return job()
+        if service not in self.executors: 
+            self.executors[service] = ThreadPoolExecutor(
+                max_workers=self.concurrency.get(service, 1), 
+                thread_name_prefix=service)
+            self.pending[service] = []
+        self.tasks[id] = task
+        # a search must not pass the set_items before it in a stateful service.
+        rank = priority if self.concurrency.get(service, 1) > 1 else NORMAL
+        with self.pending_lock:
+            heapq.heappush(self.pending[service], (rank, next(self.seq), job))
+        self.executors[service].submit(self._run_next, service)
+
+    def _run_next(self, service):
+        # every submit runs one job, the best one waiting when a thread is free.
+        with self.pending_lock:
+            _, _, job = heapq.heappop(self.pending[service])
+        job()
+
+    def encode(self, obj):
+        start = time.time()
+        payload = self.codec.encode(obj)
+        call = self.calls.get(obj[0], None)
+        if call is not None: 
+            self.metrics.observe(call[0], 'serialize', time.time() - start)
+            self.metrics.count(call[0], 'bytes_out', len(payload))
+            if obj[1]: 
+                self._observe(obj[0], 'total')
+                self.calls.pop(obj[0], None)
+        return payload
+
+    def cancel(self, id, target):
+        """ builtin: `[id, "cancel", [target]]` stops the call `target`. 
+            a queued call is dropped, a running one sees is_cancelled() in 
+            the thread pool or in the warm workers, its output is not sent.
+        """
+        task = self.tasks.pop(target, None)
+        if task is not None: 
+            task.cancelled.set()
+        self.priorities.pop(target, None)
+        self.coalescer.drop(target)
+        self._finish_call(target, 'cancelled')
+        found = self.worker_pool.cancel(target)
+        return [id, True, task is not None or found]
+
+    def stats(self, id):
+        """ builtin: the codec, the coalescer, the metrics of every method (`methods`)
+            and the memory of the candidate lists (`lists`).
+        """
+        return [id, True, {**self.codec.stats(), **self.coalescer.stats(), 'methods': self.metrics.snapshot(), 'lists': self.list_stats()}]
+
+    def list_stats(self):
+        """ path of the FuzzyList (e.g. `filefinder.fuzzy`) -> CandidateStore.stats().
+        """
+        return { path: service.lists.stats() for path, service in list(self.worker_pool.services.items())
+                 if isinstance(getattr(service, "lists", None), CandidateStore) }
+
     def start_queue(self, sender):
+        """ drain the queue in a thread, for the loops which can't select on it.
+        """
         self.queue_thread = Thread(target=self._QueueLoop, args=[sender], daemon=True)
         self.queue_thread.start()
 
     def stop(self):
         print ("[ServerCluster] Stop All Processes and Queue.")
         self._stop = True
-        self.process_manager.terminal_all()
-        self.queue_thread.join()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.worker_pool.terminal_all()
+        if hasattr(self, "queue_thread"):
+            self.queue_thread.join()
 
 def printer_process_fn(output):
     print (output)
 
 class YiyanServerCluster(ServerCluster):
     def _init_server(self):
-        self.yiyan = Yiyan(self.queue)
+        self.add_service("yiyan", "vimrpc.yiyan_server", "Yiyan", self.queue)
@@ -6,8 +6,8 @@ import subprocess
 import socket
 import json
 import time
-import requests  
 from socket_stream import SockStream
+from traffic_recorder import TrafficRecorder
 from collections import namedtuple
 import traceback
 import os
@@ -77,11 +77,19 @@ class FileRequestQueue:
             else: 
                 if 'id' in req: 
                     print("[skip request]", req)
+                    self.server.requests.pop(req['id'], None)
                     send_to_vim(self.handle, Protocal.CreateDummyResult(req['id']))
                 else: 
                     print("[skip notification]", req)
         return ret
 
+    def drop(self, filepath, id):
+        # remove the request which is not sent yet, return True if found.
+        reqs = self.file2queue.get(filepath, [])
+        remain = [ req for req in reqs if req.get("id", None) != id ]
+        self.file2queue[filepath] = remain
+        return len(remain) != len(reqs)
+
     def pend_request(self, filepath, req): 
         if filepath not in self.file2queue: 
             self.file2queue[filepath] = []
@@ -108,6 +116,7 @@ class LSPProxy:
         self.rootUri = ""
         self.is_init = False
         self.queue = queue
+        self.requests = {} # id -> filepath of the requests not responded.
 
     def getFds(self):
         ret = []
@@ -159,7 +168,14 @@ class LSPProxy:
         self.disable_filetype.append(suffix)
 
     # @interface
-    def cancel(self, id, filepath, to_cancel):
+    def cancel(self, id, to_cancel, filepath=None):
+        """ the generic `cancel(id)` of the rpc protocol, mapped to `$/cancelRequest`.
+        """
+        filepath = self.requests.pop(to_cancel, filepath)
+        if filepath is None: 
+            return # responded or unknown.
+        if self.queue.drop(filepath, to_cancel):
+            return # not sent to the server yet.
         json = {
             "jsonrpc": "2.0",
             "method": "$/cancelRequest",
@@ -313,8 +329,14 @@ class LSPProxy:
         server.stdout.flush()
 
     def pending(self, filepath, json):
+        if "id" in json: 
+            self.requests[json["id"]] = filepath
         self.queue.pend_request(filepath, json)
 
+    def responded(self, package):
+        if is_response(package):
+            self.requests.pop(package["id"], None)
+
     def dealing(self, filepath=None, json=None):
         if filepath is not None and json is not None: 
             self.pending(filepath, json)
@@ -600,7 +622,7 @@ def handle_input(handle, lsp, req):
     try:
         id = req[0]
         func = getattr(lsp, req[1])
-        if req[1] != "init" and not lsp.is_init: 
+        if req[1] not in ["init", "cancel"] and not lsp.is_init: 
             raise RuntimeError("Please call lsp init first.")
         func(id, *req[2])
     except DisableException as e: 
@@ -628,25 +650,26 @@ def is_response(package):
     return "id" in package
 
 def send_to_vim(handle, package):
-    if is_response(package):
-        id = int(package["id"])
-        handle.wfile.write(json.dumps([id, True, package]).encode('utf-8') + b"\n")
-    else: 
-        handle.wfile.write(json.dumps([-1, True, package]).encode('utf-8') + b"\n")
+    id = int(package["id"]) if is_response(package) else -1
+    output = json.dumps([id, True, package]).encode('utf-8') + b"\n"
+    handle.wfile.write(output)
+    if handle.recorder is not None: 
+        handle.recorder.response(id, True, len(output))
     print(f"[SendVim] {package}")
 
-def handle_lsp_output(r, handle):
+def handle_lsp_output(r, handle, lsp_proxy):
     package = receive_package(r)
+    lsp_proxy.responded(package)
     send_to_vim(handle, package)
 
 def handle_idle(handle, lsp_proxy):
     lsp_proxy.dealing()
 
-def lsp_server(socket, mp_manager):
-    Handle = namedtuple("Handle", ['wfile', 'rfile', 'request'])
+def lsp_server(socket):
+    Handle = namedtuple("Handle", ['wfile', 'rfile', 'request', 'recorder'])
     rfile = socket.makefile('rb', 10240)
     wfile = socket.makefile('wb', 0)
-    handle = Handle(wfile, rfile, socket)
+    handle = Handle(wfile, rfile, socket, TrafficRecorder.open("lsp"))
     queue = FileRequestQueue() # for speed up.
     lsp_proxy = LSPProxy(queue)
     queue.set_server_and_handle(lsp_proxy, handle)
@@ -674,17 +697,21 @@ def lsp_server(socket, mp_manager):
 
                 stream.put_bytes(bytes)
                 while stream.can_read():
-                    data = stream.readline().decode('utf-8')
+                    data = str(stream.readline(), 'utf-8')
                     print("[FromVim] received: {0}".format(data))
                     try:
                         req = json.loads(data)
                     except ValueError:
                         print("json decoding failed")
                         req = [-1, '']
+                    if handle.recorder is not None: 
+                        handle.recorder.request(req)
                     handle_input(handle, lsp_proxy, req)
             else:
-                handle_lsp_output(r, handle)
+                handle_lsp_output(r, handle, lsp_proxy)
     lsp_proxy.close()
+    if handle.recorder is not None: 
+        handle.recorder.close()
     socket.close()
 
     # exit bash or killed.
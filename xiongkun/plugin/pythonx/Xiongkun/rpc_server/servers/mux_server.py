@@ -0,0 +1,25 @@
+import sys
+import socket
+from mux_session import MuxSession
+
+def mux_server(sock, address):
+    """ the `mux` mode: every channel of the session is a loopback connection
+        to this server, so the channels are served by the usual modes.
+        address is (family, address) of the listener.
+    """
+    family, address = address
+    def on_open(id):
+        try:
+            conn = socket.socket(family, socket.SOCK_STREAM)
+            conn.connect(address)
+            return conn
+        except OSError as e:
+            print (f"[Mux] can't open channel {id}: {e}")
+            return None
+    print ("===== start a mux session ======")
+    session = MuxSession(sock, on_open)
+    while not session.closed:
+        session.poll()
+        sys.stdout.flush()
+    session.close()
+    print ("===== stop a mux session ======")
@@ -0,0 +1,294 @@
+import os
+import socket
+import select
+import itertools
+from threading import Thread, Lock
+from collections import deque
+from functools import partial
+import multiprocessing as mp
+from multiprocessing import reduction
+from server_cluster import ServerCluster
+from vimrpc.decorator import Service
+from vimrpc.worker_pool import WorkerPool, ResultChannel
+from vimrpc.fuzzy_list import FuzzyList
+from vimrpc.grep_search import GrepSearcher
+from vimrpc.file_watcher import FileWatcher
+from log import log
+
+class SessionQueue:
+    """
+    The results of one session, routed by the host. same interface as
+    ResultChannel for vim_rpc_loop, but put never blocks: a slow session
+    can't stop the router and the other sessions.
+    """
+    def __init__(self):
+        self.items = deque()
+        self.lock = Lock()
+        self.reader, self.writer = os.pipe() # holds one byte when items is not empty.
+
+    def put(self, item):
+        with self.lock:
+            self.items.append(item)
+            if len(self.items) == 1: os.write(self.writer, b'x')
+
+    def get(self):
+        with self.lock:
+            item = self.items.popleft()
+            if not self.items: os.read(self.reader, 1)
+        return item
+
+    def poll(self, timeout=0.0):
+        if not self.items and timeout:
+            select.select([self.reader], [], [], timeout)
+        return len(self.items) > 0
+
+    def fileno(self):
+        return self.reader
+
+    def close(self):
+        os.close(self.reader)
+        os.close(self.writer)
+
+class ProjectIndex:
+    def __init__(self, root):
+        self.root = root
+        self.key = ("root", root) # the name of the files in the shared FuzzyList.
+        self.watcher = None
+        self.refs = 0
+        self.lock = Lock()
+
+    def build(self, fuzzy):
+        log(f"[SharedHost] build the index of {self.root}")
+        self.stop()
+        self.watcher = FileWatcher(self.root, fuzzy, self.key)
+        self.watcher.start()
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = None
+
+class ProjectRegistry:
+    """
+    root -> ProjectIndex shared by the sessions, built by the first session
+    of the root and dropped with the last one.
+    """
+    def __init__(self, fuzzy):
+        self.fuzzy = fuzzy
+        self.indexes = {}
+        self.lock = Lock()
+
+    def acquire(self, root, force=False):
+        with self.lock:
+            if root not in self.indexes:
+                self.indexes[root] = ProjectIndex(root)
+            index = self.indexes[root]
+            index.refs += 1
+        with index.lock: # the other sessions of root wait for the same build.
+            if index.watcher is None or force:
+                index.build(self.fuzzy)
+        return index
+
+    def release(self, index):
+        with self.lock:
+            index.refs -= 1
+            if index.refs > 0: return
+            del self.indexes[index.root]
+        log(f"[SharedHost] drop the index of {index.root}")
+        with index.lock:
+            index.stop()
+        self.fuzzy.drop_items(-1, index.key)
+
+class SessionFileFinder(Service):
+    def __init__(self, session):
+        self.session = session
+        self.index = None
+
+    def set_root(self, id, rootpath, force=False):
+        if self.index is not None and self.index.root == rootpath and not force:
+            return (id, True, self.index.watcher.head(17))
+        index = self.session.host.projects.acquire(rootpath, force)
+        self.release()
+        self.index = index
+        return (id, True, index.watcher.head(17))
+
+    def search(self, id, name, search_text):
+        if self.index is None:
+            return (id, True, ([], None))
+        return self.session.host.fuzzy.get_service("search")(self.session.pool_id(id), self.index.key, search_text)
+
+    def release(self):
+        if self.index is not None:
+            self.session.host.projects.release(self.index)
+        self.index = None
+
+class SessionFuzzyList(Service):
+    """ the lists of a session are (session, name) in the shared FuzzyList.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.names = set()
+
+    def set_items(self, id, name, items):
+        self.names.add(name)
+        return self.session.host.fuzzy.set_items(id, (self.session.sid, name), items)
+
+    def is_init(self, id, name, hashid):
+        return self.session.host.fuzzy.is_init(id, (self.session.sid, name), hashid)
+
+    def sync_items(self, id, name, digest, base=None, delta=None):
+        self.names.add(name)
+        return self.session.host.fuzzy.sync_items(id, (self.session.sid, name), digest, base, delta)
+
+    def search(self, id, name, search_text):
+        return self.session.host.fuzzy.get_service("search")(self.session.pool_id(id), (self.session.sid, name), search_text)
+
+    def release(self):
+        for name in self.names:
+            self.session.host.fuzzy.drop_items(-1, (self.session.sid, name))
+        self.names.clear()
+
+class SessionGrepSearcher(Service):
+    def __init__(self, session):
+        self.session = session
+
+    def _call(self, funcname, id, *args):
+        return self.session.host.grep.get_service(funcname)(self.session.pool_id(id), *args)
+
+    def search(self, id, directory, search_text):
+        return self._call("search", id, directory, search_text)
+
+    def sema_filter(self, id, items, search_text):
+        return self._call("sema_filter", id, items, search_text)
+
+    def context_filter(self, id, items, search_text):
+        return self._call("context_filter", id, items, search_text)
+
+    def cancel_search(self, id):
+        self.session.host.worker_pool.terminal(self.session.host.grep, "search", self.session.sid)
+        return (id, True, None)
+
+class SessionCluster(ServerCluster):
+    """
+    One vim session of the shared host. the file list of a root and the
+    warm workers are shared, the rest (lists of FuzzyList, thread pools,
+    lazy services, codec) belongs to the session.
+    """
+    def __init__(self, host, options=()):
+        self.host = host
+        self.sid = host.open_session(self)
+        super().__init__(options)
+
+    def create_queue(self):
+        return SessionQueue()
+
+    def _init_server(self):
+        self.filefinder = SessionFileFinder(self)
+        self.fuzzyfinder = SessionFuzzyList(self)
+        self.grepfinder = SessionGrepSearcher(self)
+        self.add_service("remotefs", "vimrpc.remote_fs", "RemoteFS")
+        self.add_service("hoogle", "vimrpc.hoogle", "HoogleSearcher", self.queue)
+        self.add_service("config", "vimrpc.configure", "ProjectConfigure", self.queue)
+
+    def pool_id(self, id):
+        return (self.sid, id)
+
+    def list_stats(self):
+        # the lists of all the sessions, they share the budget of the host.
+        return { "fuzzyfinder (shared)": self.host.fuzzy.lists.stats() }
+
+    def cancel(self, id, target):
+        task = self.tasks.pop(target, None)
+        if task is not None:
+            task.cancelled.set()
+        self.priorities.pop(target, None)
+        self.coalescer.drop(target)
+        self._finish_call(target, 'cancelled')
+        found = self.host.worker_pool.cancel(self.pool_id(target))
+        return [id, True, task is not None or found]
+
+    def stop(self):
+        self.host.close_session(self.sid)
+        super().stop()
+        self.filefinder.release()
+        self.fuzzyfinder.release()
+        self.queue.close()
+
+class SharedHost:
+    """
+    `tcp_server.py --shared`: the vimrpc sessions are threads of this
+    process instead of a process per connection, so the users of a build
+    box share the file list of a repo (crawled once) and one WorkerPool.
+
+    the ids sent to the shared workers are (session, id), the router puts
+    the results back into the queue of the session with the id of vim.
+    """
+    def __init__(self):
+        self.worker_pool = WorkerPool()
+        self.queue = ResultChannel()
+        self.fuzzy = FuzzyList(self.queue, self.worker_pool)
+        self.grep = GrepSearcher(self.queue, self.worker_pool)
+        self.worker_pool.register("fuzzyfinder", self.fuzzy)
+        self.worker_pool.register("grepfinder", self.grep)
+        self.worker_pool.start(self.queue)
+        self.projects = ProjectRegistry(self.fuzzy)
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.lock = Lock()
+        self.router = Thread(target=self._route, daemon=True)
+        self.router.start()
+
+    def open_session(self, session):
+        with self.lock:
+            sid = next(self.ids)
+            self.sessions[sid] = session
+        return sid
+
+    def close_session(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def _route(self):
+        while True:
+            if not self.queue.poll(1.0):
+                continue
+            (sid, id), is_finished, output = self.queue.get()
+            session = self.sessions.get(sid, None)
+            if session is None: # closed.
+                continue
+            try:
+                session.queue.put((id, is_finished, output))
+            except OSError: # closed while routing.
+                pass
+
+    def serve(self, conn, loop_fn):
+        """ receive the connections from the tcp server, loop_fn(sock, cluster_cls, framed, options) serves one.
+        """
+        while True:
+            try:
+                framed, options = conn.recv()
+                fd = reduction.recv_handle(conn)
+            except EOFError:
+                break
+            sock = socket.socket(fileno=fd)
+            Thread(target=loop_fn, args=(sock, partial(SessionCluster, self), framed, options), daemon=True).start()
+        self.worker_pool.terminal_all()
+
+def shared_host_main(conn, loop_fn):
+    SharedHost().serve(conn, loop_fn)
+
+class SharedHostHandle:
+    """ the tcp server side, hand the accepted vimrpc connections to the host process.
+    """
+    def __init__(self, loop_fn):
+        self.conn, child_conn = mp.Pipe()
+        self.proc = mp.Process(target=shared_host_main, args=(child_conn, loop_fn), daemon=False)
+        self.proc.start()
+        child_conn.close()
+
+    def attach(self, sock, framed, options):
+        try:
+            self.conn.send((framed, options))
+            reduction.send_handle(self.conn, sock.fileno(), self.proc.pid)
+        except (BrokenPipeError, OSError) as e:
+            log(f"[SharedHost] the host is dead: {e}")
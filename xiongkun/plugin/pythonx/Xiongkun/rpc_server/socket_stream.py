@@ -1,7 +1,105 @@
 import sys
 import select
 
-class SockStream: 
+class SockStream:
+    """
+    Line framing buffer for the socket loops.
+
+    bytes are appended into one bytearray, `scan` remembers where the last
+    search for b'\n' stopped and `start` is the begin of the unread data, so
+    every byte is scanned only once. readline returns a memoryview slice of
+    the buffer (no copy), it is valid until the next put_bytes.
+    consumed bytes are dropped only when they are more than half of the
+    buffer, so compaction is amortized O(1) per byte.
+    """
+    compact_threshold = 64 * 1024
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = 0
+        self.scan = 0
+
+    def put_bytes(self, bytes):
+        self._compact()
+        try:
+            self.buffer += bytes
+        except BufferError:
+            # a returned line is still alive and pins the buffer, copy out.
+            self.buffer = self.buffer[self.start:] + bytes
+            self.scan -= self.start
+            self.start = 0
+
+    def _compact(self):
+        if self.start == 0:
+            return
+        if self.start == len(self.buffer) or \
+                (self.start >= self.compact_threshold and self.start * 2 >= len(self.buffer)):
+            try:
+                del self.buffer[:self.start]
+            except BufferError:
+                self.buffer = self.buffer[self.start:]
+            self.scan -= self.start
+            self.start = 0
+
+    def readline(self):
+        if not self.can_read():
+            return None
+        end = self.scan
+        out = memoryview(self.buffer)[self.start:end]
+        self.start = end + 1
+        self.scan = self.start
+        return out
+
+    def can_read(self):
+        if self.scan < len(self.buffer) and self.buffer[self.scan] == 10:
+            return True
+        pos = self.buffer.find(b'\n', self.scan)
+        if pos == -1:
+            self.scan = len(self.buffer)
+            return False
+        self.scan = pos
+        return True
+
+    def pack(self, payload):
+        return payload + b'\n'
+
+class FrameStream(SockStream):
+    """
+    Length prefixed framing used by the `vimrpc2` mode.
+
+    frame := 8 hex digits of payload length + payload
+    the header is ascii so frames can pass through vim strings, and the
+    payload is never scanned for b'\n'. readline returns the next payload.
+    """
+    header_size = 8
+
+    def readline(self):
+        if not self.can_read():
+            return None
+        end = self.scan
+        out = memoryview(self.buffer)[self.start+self.header_size:end]
+        self.start = end
+        self.scan = end
+        return out
+
+    def can_read(self):
+        if self.scan > self.start:
+            return True
+        if len(self.buffer) - self.start < self.header_size:
+            return False
+        length = int(self.buffer[self.start:self.start+self.header_size], 16)
+        end = self.start + self.header_size + length
+        if end > len(self.buffer):
+            return False
+        self.scan = end
+        return True
+
+    def pack(self, payload):
+        return b"%08x" % len(payload) + payload
+
+class OldSockStream:
+    """ the bytes += version, only kept for the benchmark below.
+    """
     def __init__(self):
         self.buffer = b''
 
@@ -9,17 +107,38 @@ class SockStream:
         self.buffer += bytes
 
     def readline(self):
-        if not self.can_read(): 
+        if not self.can_read():
             return None
         out, remain = self.buffer.split(b'\n', 1)
         self.buffer = remain
         return out
-        
+
     def can_read(self):
-        if b'\n' in self.buffer: 
+        if b'\n' in self.buffer:
             return True
         return False
 
+    def pack(self, payload):
+        return payload + b'\n'
+
+def benchmark(stream_cls, message_size, chunk=10240, repeat=2):
+    import time
+    stream = stream_cls()
+    message = stream.pack(b'x' * (message_size - 1))
+    chunks = [message[i:i+chunk] for i in range(0, len(message), chunk)]
+    start = time.time()
+    lines = 0
+    for _ in range(repeat):
+        for c in chunks:
+            stream.put_bytes(c)
+            while stream.can_read():
+                line = stream.readline()
+                lines += 1
+                del line
+    cost = time.time() - start
+    assert lines == repeat
+    return message_size * repeat / cost / 1024 / 1024
+
 if __name__ == "__main__":
     stream = SockStream()
     stream.put_bytes(b"sdfsdfsdf")
@@ -28,4 +147,32 @@ if __name__ == "__main__":
     assert stream.readline() == b'sdfsdfsdfxxx'
     stream.put_bytes(b"\n")
     assert stream.readline() == b'sss'
+    stream.put_bytes(b"a\nb\n\nc")
+    line = stream.readline()
+    stream.put_bytes(b"\n")
+    assert line == b'a'
+    assert stream.readline() == b'b'
+    assert stream.readline() == b''
+    assert str(stream.readline(), 'utf-8') == 'c'
+    assert stream.readline() == None
+
+    stream = FrameStream()
+    frame = stream.pack(b'[1, "a\\nb"]') + stream.pack(b'')
+    stream.put_bytes(frame[:5])
+    assert stream.readline() == None
+    stream.put_bytes(frame[5:12])
+    assert stream.readline() == None
+    stream.put_bytes(frame[12:])
+    assert stream.readline() == b'[1, "a\\nb"]'
+    assert stream.readline() == b''
+    assert stream.readline() == None
 
+    # the old version needs minutes for 50 MB, run `socket_stream.py full` to include it.
+    full = len(sys.argv) > 1 and sys.argv[1] == "full"
+    for size in [1024 * 1024, 50 * 1024 * 1024]:
+        new = benchmark(SockStream, size)
+        old = benchmark(OldSockStream, size, repeat=1) if full or size <= 1024 * 1024 else None
+        frame = benchmark(FrameStream, size)
+        print (f"message {size // 1024 // 1024} MB: SockStream {new:.1f} MB/s, FrameStream {frame:.1f} MB/s", end="")
+        if old is not None: print (f", bytes += version {old:.1f} MB/s", end="")
+        print ("")
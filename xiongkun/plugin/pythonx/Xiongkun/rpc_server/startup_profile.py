@@ -0,0 +1,45 @@
+import sys
+import time
+import builtins
+
+class ImportProfiler:
+    """
+    Time the imports of the server, `tcp_server.py --profile-startup`.
+
+    like `python -X importtime` but summarized: the imports of the module
+    being profiled with their cumulative cost, and the slowest ones of any
+    depth. a module already in sys.modules is not counted.
+    """
+    def __init__(self):
+        self.origin = builtins.__import__
+        self.records = [] # (depth, name, seconds)
+        self.depth = 0
+        self.start = time.perf_counter()
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self.origin(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            return self.origin(name, globals, locals, fromlist, level)
+        finally:
+            self.depth -= 1
+            self.records.append((self.depth, "." * level + name, time.perf_counter() - start))
+
+    def install(self):
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self):
+        builtins.__import__ = self.origin
+
+    def report(self, top=10):
+        total = time.perf_counter() - self.start
+        print (f"[Startup] imports take {total * 1000:.1f} ms:")
+        for depth, name, cost in sorted(filter(lambda r: r[0] == 0, self.records), key=lambda r: -r[2]):
+            print (f"    {cost * 1000:8.1f} ms  {name}")
+        print (f"[Startup] slowest {top} imports of any depth:")
+        for depth, name, cost in sorted(self.records, key=lambda r: -r[2])[:top]:
+            print (f"    {cost * 1000:8.1f} ms  {'  ' * depth}{name}")
+        sys.stdout.flush()
@@ -0,0 +1,101 @@
+import time
+
+class StreamCoalescer:
+    """
+    Batch the partial results of the streams of one vimrpc session.
+
+    a stream (grepfinder.search) puts one (id, False, list) per directory,
+    and every message is a re-sort and redraw in vim. the lists of an id
+    are merged and flushed every `interval` seconds or `max_items` items.
+    the first non empty chunk of an id is sent at once (first_chunk), so
+    the first results still show up right away. an empty chunk is dropped,
+    the final (id, True, ...) flushes the batch of its id first.
+
+    configured by the mode line, e.g. `vimrpc2 coalesce=100` (ms),
+    `coalesce=0` to disable, `coalesce_items=5000`, `first_chunk=0`.
+    """
+    interval = 0.05
+    max_items = 2000
+    first_chunk = True
+
+    def __init__(self, options=()):
+        for option in options:
+            key, _, value = option.partition("=")
+            if key == "coalesce":
+                self.interval = int(value) / 1000
+            elif key == "coalesce_items":
+                self.max_items = int(value)
+            elif key == "first_chunk":
+                self.first_chunk = value != "0"
+        self.batches = {} # id -> [deadline, items]
+        self.started = set() # ids whose first chunk is sent.
+        self.chunks = 0
+        self.sent_chunks = 0
+
+    def put(self, output, send):
+        id, is_finished, items = output
+        if is_finished:
+            self.drop(id, send)
+            send(output)
+            return
+        if not self.interval or not isinstance(items, list):
+            send(output)
+            return
+        self.chunks += 1
+        if not items:
+            return
+        if self.first_chunk and id not in self.started:
+            self.started.add(id)
+            self._send(output, send)
+            return
+        self.started.add(id)
+        if id not in self.batches:
+            self.batches[id] = [time.time() + self.interval, []]
+        self.batches[id][1].extend(items)
+        if len(self.batches[id][1]) >= self.max_items:
+            self._flush(id, send)
+
+    def _send(self, output, send):
+        self.sent_chunks += 1
+        send(output)
+
+    def _flush(self, id, send):
+        batch = self.batches.pop(id, None)
+        if batch is not None:
+            self._send((id, False, batch[1]), send)
+
+    def flush_due(self, send):
+        now = time.time()
+        for id, (deadline, items) in list(self.batches.items()):
+            if deadline <= now: self._flush(id, send)
+
+    def timeout(self, default):
+        """ seconds the send loop can wait before a batch is due.
+        """
+        if not self.batches:
+            return default
+        deadline = min(deadline for deadline, items in list(self.batches.values()))
+        return max(0.0, min(default, deadline - time.time()))
+
+    def drop(self, id, send=None):
+        """ forget the stream id, its batch is sent first if send is given.
+        """
+        if send is not None: self._flush(id, send)
+        else: self.batches.pop(id, None)
+        self.started.discard(id)
+
+    def stats(self):
+        return {
+            'coalesce_ms': self.interval * 1000,
+            'stream_chunks': self.chunks,
+            'sent_stream_chunks': self.sent_chunks,
+        }
+
+if __name__ == "__main__":
+    coalescer = StreamCoalescer(["coalesce=20"])
+    for i in range(200):
+        coalescer.put((1, False, [f"dir_{i}"] if i % 3 == 0 else []), print)
+        time.sleep(0.001)
+        coalescer.flush_due(print)
+    coalescer.put((1, True, []), print)
+    print (coalescer.stats())
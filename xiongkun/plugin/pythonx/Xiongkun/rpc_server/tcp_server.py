@@ -18,18 +18,27 @@
 # This requires Python 3.8 or later.
 
 from __future__ import print_function
+import sys
+import time
+startup_time = time.time()
+import_profiler = None
+if "--profile-startup" in sys.argv:
+    from startup_profile import ImportProfiler
+    import_profiler = ImportProfiler().install()
 import json
 import socket
-import sys
 import threading
 from threading import Thread
 from server_cluster import ServerCluster, YiyanServerCluster
-from vimrpc.decorator import InQueue
 from servers.bash_server import bash_server
 from servers.bash_server_pool import reconnect_bash, NamedBashPool
 from servers.lsp_server import lsp_server
+from servers.mux_server import mux_server
 import select
-from socket_stream import SockStream
+from socket_stream import SockStream, FrameStream
+from traffic_recorder import TrafficRecorder
+from vimrpc.candidate_store import CandidateStore
+from vimrpc.file_watcher import FileWatcher
 from log import log
 import platform
 import multiprocessing as mp
@@ -43,6 +52,9 @@ except ImportError:
     # Python 2
     import SocketServer as socketserver
 
+if import_profiler is not None: 
+    import_profiler.uninstall()
+
 def bash_manager(socket, bash_pool):
     # 3 command to execute: 
     # connect name
@@ -78,23 +90,38 @@ def bash_manager(socket, bash_pool):
         name = command.split(b" ")[1]
         bash_pool.delete(name)
 
-def vim_rpc_loop(sock, services_cluster_cls, queue):
+def vim_rpc_loop(sock, services_cluster_cls, framed=False, options=(), mode=None):
+    """ framed=True is the `vimrpc2` mode: length prefixed frames instead of json lines.
+        options are the rest words of the mode line, e.g. `zlib` to compress large responses, 
+        `coalesce=100` to batch the stream results for 100 ms, `priority` as the client 
+        sends the priority of a request.
+        mode is the mode line for the recording of --record, default vimrpc / vimrpc2.
+    """
     print ("===== start a vim rpc server ======")
     rfile = sock.makefile('rb', 10240)
     wfile = sock.makefile('wb', 10240)
+    stream = FrameStream() if framed else SockStream()
+    start = time.time()
+    servers = services_cluster_cls(options)
+    print (f"[Startup] services are created in {(time.time() - start) * 1000:.1f} ms.")
+    recorder = TrafficRecorder.open(mode or ("vimrpc2" if framed else "vimrpc"), options)
+    send_lock = threading.Lock()
     def send(obj):
-        encoded = json.dumps(obj) + "\n"
-        wfile.write(encoded.encode('utf-8'))
-        wfile.flush()
+        # called by the queue thread and the dispatch threads.
+        with send_lock:
+            package = stream.pack(servers.encode(obj))
+            wfile.write(package)
+            wfile.flush()
+        if recorder is not None: 
+            recorder.response(obj[0], obj[1], len(package))
 
-    servers = services_cluster_cls(queue)
-    servers.start_queue(send)
-    stream = SockStream()
 
     while True:
-        rs, ws, es = select.select([rfile.fileno()], [], [], 3.0)
+        rs, ws, es = select.select([rfile.fileno(), servers.queue.fileno()], [], [], servers.coalescer.timeout(3.0))
         sys.stdout.flush()
         sys.stderr.flush()
+        if servers.queue.fileno() in rs or servers.coalescer.batches:
+            servers.drain_queue(send)
         if rfile.fileno() in rs:
             try:
                 bytes = sock.recv(10240)
@@ -106,8 +133,8 @@ def vim_rpc_loop(sock, services_cluster_cls, queue):
                 break
             stream.put_bytes(bytes)
             while stream.can_read():
-                data = stream.readline().decode('utf-8')
-                print("received: {0}".format(data))
+                raw = stream.readline()
+                data = str(raw, 'utf-8')
                 try:
                     req = json.loads(data)
                 except ValueError:
@@ -117,20 +144,15 @@ def vim_rpc_loop(sock, services_cluster_cls, queue):
                 # Send a response if the sequence number is positive.
                 # Negative numbers are used for "eval" responses.
                 if req[0] >= 0:
-                    print (req)
-                    id, name, args = req
+                    id, name, args, *priority = req # [id, name, args, priority], the 4th item with `priority`.
                     print("[Server] receive: ", id, name)
-                    func = servers.get_server_fn(name)
-                    if not func:
-                        continue
-                    output = func(id, *args)
-                    if isinstance(output, InQueue): 
-                        print("[Server]: process function.")
-                    else: 
-                        print("[Server]: normal function.")
-                        send(output)
+                    if recorder is not None: 
+                        recorder.request(req)
+                    servers.dispatch(id, name, args, send, *priority, size=len(raw))
     print ("stop handle, closing...")
     servers.stop()
+    if recorder is not None: 
+        recorder.close()
     sock.close()
     print ("===== stop a vim rpc server ======")
 
@@ -157,8 +179,10 @@ def read_line(socket, timeout=1):
         c = read_single_char(socket, timeout)
     return received
 
-def server_wrapper(listen_s, func, *args, **kwargs):
-    listen_s.close()
+def server_wrapper(listeners, func, *args, **kwargs):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for listen_s in listeners: 
+        listen_s.close()
     func(*args, **kwargs)
 
 def safe_read_line(socket):
@@ -176,23 +200,44 @@ def safe_read_line(socket):
         return None
     
 
-def connection_handle(listen_s, socket, mp_manager, bash_pool):
+def loopback_address(listen_s):
+    """ (family, address) to connect the listen_s from this machine.
+    """
+    if listen_s.family == socket.AF_UNIX: 
+        return listen_s.family, listen_s.getsockname()
+    host, port = listen_s.getsockname()[:2]
+    if host in ["0.0.0.0", ""]: 
+        host = "127.0.0.1"
+    return listen_s.family, (host, port)
+
+def connection_handle(listen_s, socket, bash_pool, listeners=None, shared_host=None):
+    """ listeners are closed in the forked handlers, default [listen_s].
+        with shared_host, the vimrpc sessions are served by the shared host process.
+    """
+    listeners = listeners or [listen_s]
     # override the main process signal handler.
     print("=== socket opened ===")
     mode = safe_read_line(socket)
     if mode is None:
         return
     print ("[TCPServer] receive: ", mode)
-    mode = mode.strip()
+    mode, *options = mode.strip().split(b" ")
+    options = [ o.decode('utf-8') for o in options if o ]
     proc = None
-    if mode == b"bash": 
+    if shared_host is not None and mode in [b"vimrpc", b"vimrpc2"]: 
+        shared_host.attach(socket, mode == b"vimrpc2", options)
+    elif mode == b"bash": 
         proc = bash_manager(socket, bash_pool)
     elif mode == b"vimrpc":
-        proc = mp.Process(target=server_wrapper, args=(listen_s, vim_rpc_loop, socket, ServerCluster, mp_manager))
+        proc = mp.Process(target=server_wrapper, args=(listeners, vim_rpc_loop, socket, ServerCluster, False, options))
+    elif mode == b"vimrpc2":
+        proc = mp.Process(target=server_wrapper, args=(listeners, vim_rpc_loop, socket, ServerCluster, True, options))
     elif mode == b"yiyan":
-        proc = mp.Process(target=server_wrapper, args=(listen_s, vim_rpc_loop, socket, YiyanServerCluster, mp_manager))
+        proc = mp.Process(target=server_wrapper, args=(listeners, vim_rpc_loop, socket, YiyanServerCluster, False, options, "yiyan"))
     elif mode == b"lsp":
-        proc = mp.Process(target=server_wrapper, args=(listen_s, lsp_server, socket, mp_manager))
+        proc = mp.Process(target=server_wrapper, args=(listeners, lsp_server, socket))
+    elif mode == b"mux":
+        proc = mp.Process(target=server_wrapper, args=(listeners, mux_server, socket, loopback_address(listen_s)))
     else: 
         print (f"Unknow command. {mode}")
     sys.stdout.flush()
@@ -201,25 +246,50 @@ def connection_handle(listen_s, socket, mp_manager, bash_pool):
         proc.start()
     return proc
 
-def server_tcp_main(HOST, PORT):
-    mp_manager = mp.Manager()
+def server_tcp_main(HOST, PORT, unix_path=None, shared=False):
+    """ listen on HOST:PORT and / or the unix socket unix_path, the local 
+        server of vim only uses the unix socket.
+        shared=True serves all the vimrpc sessions in one process, see SharedHost.
+    """
     bash_pool = NamedBashPool()
     child_pid = []
-    listen_s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    listen_s.bind((HOST, PORT))
-    listen_s.listen(20)
-    print ("开始监听: ", (HOST, PORT))
+    shared_host = None
+    if shared: 
+        from shared_host import SharedHostHandle
+        shared_host = SharedHostHandle(vim_rpc_loop)
+        child_pid.append(shared_host.proc)
+    listeners = []
+    if PORT is not None: 
+        listen_s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_s.bind((HOST, PORT))
+        listen_s.listen(20)
+        listeners.append(listen_s)
+        print ("开始监听: ", (HOST, PORT))
+    if unix_path is not None: 
+        if os.path.exists(unix_path): 
+            os.unlink(unix_path) # left by a killed server.
+        listen_s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listen_s.bind(unix_path)
+        listen_s.listen(20)
+        listeners.append(listen_s)
+        print ("开始监听: ", unix_path)
+    if import_profiler is not None: 
+        import_profiler.report()
+        print (f"[Startup] listening after {(time.time() - startup_time) * 1000:.1f} ms.")
+        sys.stdout.flush()
     try:
-        while True: 
-            r, w, e = select.select([listen_s], [], [], 10.0)
-            if listen_s in r:
+        closed = False
+        while not closed: 
+            r, w, e = select.select(listeners, [], [], 10.0)
+            for listen_s in r:
                 try:
                     cnn, addr = listen_s.accept()
-                    worker = connection_handle(listen_s, cnn, mp_manager, bash_pool)
+                    worker = connection_handle(listen_s, cnn, bash_pool, listeners, shared_host)
                     cnn.close() # close in this process.
                     if worker is not None: 
                         child_pid.append(worker)
                 except ConnectionResetError:
+                    closed = True
                     break
                 finally:
                     cnn.close() # close in this process.
@@ -234,6 +304,8 @@ def server_tcp_main(HOST, PORT):
         for proc in child_pid:
             proc.terminate()
             proc.join()
+        if unix_path is not None and os.path.exists(unix_path): 
+            os.unlink(unix_path)
         print ("Exit succesfully.")
 
 def parameter_parser():
@@ -241,10 +313,28 @@ def parameter_parser():
     parser = argparse.ArgumentParser(description="Support Args:")
 
     parser.add_argument("--host",                      type=str,   help="127.0.0.1")
-    parser.add_argument("--port",                      type=str,   help="8080")
+    parser.add_argument("--port",                      type=str,   default=None, help="8080")
+    parser.add_argument("--unix",                      type=str,   default=None, help="path of the unix socket to listen, e.g. $XDG_RUNTIME_DIR/xkvim/rpc.sock")
+    parser.add_argument("--shared",                    action="store_true", help="one process serves all the vim sessions, they share the index of a repo.")
+    parser.add_argument("--profile-startup",           action="store_true", help="print the import time and the time to listen.")
+    parser.add_argument("--record",                    type=str,   default=None, help="record the traffic of the vimrpc / lsp sessions into the directory, see benchmark/replay.py")
+    parser.add_argument("--concurrency",               type=str,   default="", help="max running calls of services: remotefs=4,hoogle=2")
+    parser.add_argument("--list-budget",               type=int,   default=None, help="MB of the candidate lists of fuzzyfinder, the least recently used are evicted.")
+    parser.add_argument("--poll-files",                type=float, default=None, help="check the directories of filefinder every N seconds instead of inotify, for a network fs.")
     return parser.parse_args()
 
 if __name__ == "__main__":
     mp.set_start_method("fork")
     args = parameter_parser()
-    server_tcp_main(args.host, int(args.port))
+    for item in filter(None, args.concurrency.split(",")):
+        service, limit = item.split("=")
+        ServerCluster.concurrency[service.strip()] = int(limit)
+    TrafficRecorder.directory = args.record
+    if args.list_budget is not None: 
+        CandidateStore.budget = args.list_budget * 1024 * 1024
+    if args.poll_files is not None: 
+        FileWatcher.use_inotify = False
+        FileWatcher.interval = args.poll_files
+    # exit by the finally of server_tcp_main, it removes the unix socket.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    server_tcp_main(args.host, int(args.port) if args.port else None, args.unix, args.shared)
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import itertools
+from threading import Lock
+
+class TrafficRecorder:
+    """
+    Record the traffic of a session to replay it: `tcp_server.py --record DIR`
+    (or XKVIM_RPC_RECORD=DIR in the environment of vim) writes one json line
+    file per vimrpc / lsp session into DIR, replayed by benchmark/replay.py.
+
+        {"mode": "vimrpc", "options": [...], "start": time}   the mode line.
+        {"t": 0.012, "req": [id, name, args, priority?]}     a request.
+        {"t": 0.020, "id": id, "done": false, "size": 123}   a response, size is the bytes sent.
+
+    t is seconds from the mode line. the contents of the responses are not
+    recorded, only their sizes.
+    """
+    directory = None
+    ids = itertools.count(1)
+
+    def __init__(self, path, mode, options=()):
+        self.file = open(path, "w")
+        self.path = path
+        self.start = time.time()
+        self.lock = Lock() # the send loop and the dispatch threads.
+        self._write({"mode": mode, "options": list(options), "start": self.start})
+
+    @classmethod
+    def open(cls, mode, options=()):
+        """ the recorder of a new session, None if the server doesn't record.
+        """
+        if cls.directory is None:
+            return None
+        os.makedirs(cls.directory, exist_ok=True)
+        path = os.path.join(cls.directory, f"{mode}-{os.getpid()}-{next(cls.ids)}-{int(time.time())}.jsonl")
+        return cls(path, mode, options)
+
+    def _write(self, record):
+        with self.lock:
+            if self.file.closed: return
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def request(self, req):
+        self._write({"t": time.time() - self.start, "req": req})
+
+    def response(self, id, is_finished, size):
+        self._write({"t": time.time() - self.start, "id": id, "done": bool(is_finished), "size": size})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def load_recording(path):
+    """ (header, requests, responses) of a recorded session.
+    """
+    header, requests, responses = None, [], []
+    with open(path) as fp:
+        for line in fp:
+            if not line.strip(): continue
+            record = json.loads(line)
+            if header is None: header = record
+            elif "req" in record: requests.append(record)
+            else: responses.append(record)
+    return header, requests, responses
@@ -0,0 +1,230 @@
+import sys
+import time
+import hashlib
+import difflib
+import itertools
+from operator import sub
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+class CandidateList:
+    """
+    A read-only list of str kept as one utf-8 blob and the offsets of the
+    items: len(utf-8) + 4 bytes an item, a str in a list is ~57 + len.
+    supports len, [idx], [a:b] (a CandidateList, shards of the workers)
+    and iteration. it is pickled as the blob and the offsets, so sending a
+    shard to a worker doesn't pickle every string.
+
+    lone surrogates (os.fsdecode of a bad file name) are kept by surrogatepass.
+    """
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, items=(), blob=None, offsets=None):
+        if blob is None:
+            encoded = [ item.encode("utf-8", "surrogatepass") for item in items ]
+            blob = b"".join(encoded)
+            offsets = itertools.accumulate(map(len, encoded), initial=0)
+        self.blob = blob
+        self.offsets = offsets if isinstance(offsets, array) else array("I" if len(blob) < 1 << 32 else "Q", offsets)
+
+    @classmethod
+    def of(cls, items):
+        """ items as a CandidateList, not copied if it is one.
+        """
+        return items if isinstance(items, cls) else cls(items)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return CandidateList([ self[i] for i in range(start, stop, step) ])
+            stop = max(start, stop)
+            first = self.offsets[start]
+            return CandidateList(blob=self.blob[first:self.offsets[stop]],
+                                 offsets=array(self.offsets.typecode, map(sub, self.offsets[start:stop+1], itertools.repeat(first))))
+        if idx < 0: idx += len(self)
+        if not 0 <= idx < len(self): raise IndexError("CandidateList index out of range")
+        return self.blob[self.offsets[idx]:self.offsets[idx+1]].decode("utf-8", "surrogatepass")
+
+    def __iter__(self):
+        offsets = self.offsets
+        if self.blob.isascii(): # a char is a byte, slice the decoded text.
+            text = self.blob.decode("ascii")
+            for idx in range(len(offsets) - 1):
+                yield text[offsets[idx]:offsets[idx+1]]
+        else:
+            blob = self.blob
+            for idx in range(len(offsets) - 1):
+                yield blob[offsets[idx]:offsets[idx+1]].decode("utf-8", "surrogatepass")
+
+    def __reduce__(self):
+        return (CandidateList, ((), self.blob, self.offsets))
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+def items_digest(items):
+    """ the content hash of a list of str, the same in vim and the server
+        (hash() of a str is salted per process). items have no NUL, vim 
+        strings can't hold it.
+    """
+    digest = hashlib.blake2b(b"%d\0" % len(items), digest_size=16)
+    digest.update("\0".join(items).encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+def items_delta(old, new, max_diff=4096):
+    """ [[start, end, items], ...] that turn old into new by apply_items_delta,
+        start / end are indexes of old. None if it is not much smaller than new.
+
+        the common head and tail are cut first, difflib only sees the changed
+        middle (a buffer opened or closed), up to max_diff items.
+    """
+    size = min(len(old), len(new))
+    head = 0
+    while head < size and old[head] == new[head]: head += 1
+    tail = 0
+    while tail < size - head and old[-1-tail] == new[-1-tail]: tail += 1
+    a, b = old[head:len(old)-tail], new[head:len(new)-tail]
+    if len(a) + len(b) <= max_diff:
+        opcodes = difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        delta = [ [head+i1, head+i2, b[j1:j2]] for tag, i1, i2, j1, j2 in opcodes if tag != "equal" ]
+    else:
+        delta = [[head, len(old)-tail, b]]
+    if sum(len(items) + 1 for start, end, items in delta) > len(new) // 2:
+        return None
+    return delta
+
+def apply_items_delta(items, delta):
+    """ new list of items_delta(items, new).
+    """
+    items = list(items)
+    for start, end, new in reversed(delta):
+        items[start:end] = new
+    return items
+
+class CandidateStore:
+    """
+    name -> CandidateList of a FuzzyList, in the order of use (set_items,
+    sync_items, search). when the lists are over `budget` bytes the least
+    recently used are evicted, put() returns their names to drop the
+    shards of the workers, and sync_items of the client is False again so
+    it sends the list with the next open. the list just put and the pinned
+    ones (the files crawled by the server) are never evicted.
+    """
+    budget = 256 * 1024 * 1024 # tcp_server.py --list-budget (MB)
+
+    def __init__(self, budget=None):
+        if budget is not None: self.budget = budget
+        self.lists = OrderedDict() # name -> CandidateList, least recently used first.
+        self.pinned = set()
+        self.used = {} # name -> time of the last use.
+        self.digests = {} # name -> items_digest, computed by the first digest().
+        self.evicted = 0
+        self.lock = Lock()
+
+    def put(self, name, items, pinned=False):
+        """ keep items as name, return the names evicted for it.
+        """
+        items = CandidateList.of(items)
+        evicted = []
+        with self.lock:
+            self.lists[name] = items
+            self.lists.move_to_end(name)
+            self.digests.pop(name, None)
+            self.used[name] = time.time()
+            if pinned: self.pinned.add(name)
+            else: self.pinned.discard(name)
+            total = self.nbytes
+            for old in list(self.lists):
+                if total <= self.budget: break
+                if old == name or old in self.pinned: continue
+                total -= self.lists[old].nbytes
+                self._remove(old)
+                evicted.append(old)
+            self.evicted += len(evicted)
+        return evicted
+
+    def get(self, name):
+        """ the list of name (marked as used), None if it is not kept.
+        """
+        with self.lock:
+            if name not in self.lists: return None
+            self.lists.move_to_end(name)
+            self.used[name] = time.time()
+            return self.lists[name]
+
+    def touch(self, name):
+        self.get(name)
+
+    def digest(self, name):
+        """ items_digest of the list of name, None if it is not kept.
+        """
+        items = self.get(name)
+        if items is None: return None
+        if name not in self.digests:
+            digest = items_digest(list(items))
+            with self.lock:
+                if self.lists.get(name, None) is items: self.digests[name] = digest
+            return digest
+        return self.digests[name]
+
+    def pop(self, name):
+        with self.lock:
+            if name in self.lists: self._remove(name)
+
+    def _remove(self, name):
+        del self.lists[name]
+        self.used.pop(name, None)
+        self.digests.pop(name, None)
+        self.pinned.discard(name)
+
+    def __contains__(self, name):
+        return name in self.lists
+
+    @property
+    def nbytes(self):
+        return sum(items.nbytes for items in self.lists.values())
+
+    def stats(self):
+        """ the memory of every list for :RPCStats, names are str for json.
+        """
+        now = time.time()
+        with self.lock:
+            return {
+                'budget_kb': self.budget / 1024,
+                'used_kb': self.nbytes / 1024,
+                'evicted': self.evicted,
+                'lists': { str(name): {
+                    'items': len(items),
+                    'kb': items.nbytes / 1024,
+                    'idle_s': now - self.used[name],
+                    'pinned': name in self.pinned,
+                } for name, items in reversed(self.lists.items()) },
+            }
+
+if __name__ == "__main__":
+    import pickle
+    items = ["paddle/fluid/a.cc", "中文/b.h", "", "bad\udcff.py", "x" * 100]
+    lst = CandidateList(items)
+    assert list(lst) == items and len(lst) == 5 and lst[-1] == items[-1]
+    assert list(lst[1:4]) == items[1:4] and list(lst[::2]) == items[::2] and list(lst[4:1]) == []
+    assert list(pickle.loads(pickle.dumps(lst[1:]))) == items[1:]
+    store = CandidateStore(budget=lst.nbytes * 2 + 10)
+    assert store.put("a", items) == [] and store.put("files", items, pinned=True) == []
+    assert store.put("b", items) == ["a"] and "a" not in store and store.get("b") is not None
+    assert store.put("c", items) == ["b"] # files is pinned.
+    assert store.digest("c") == items_digest(items) != items_digest(items[1:]) != items_digest([])
+    assert items_digest([]) != items_digest([""])
+    buffers = [ f"src/file_{i}.cc" for i in range(200) ]
+    for new in [ buffers + ["new.h"], buffers[:50] + buffers[51:], ["new.h"] + buffers[:120] + buffers[121:] ]:
+        delta = items_delta(buffers, new)
+        assert delta is not None and sum(len(items) for _, _, items in delta) <= 1, delta
+        assert apply_items_delta(buffers, delta) == new
+    assert items_delta(buffers, buffers[::-1]) is None
+    assert apply_items_delta(buffers, items_delta(buffers, buffers[:5] + ["x"] * 10 + buffers[5:])) == buffers[:5] + ["x"] * 10 + buffers[5:]
+    print (store.stats())
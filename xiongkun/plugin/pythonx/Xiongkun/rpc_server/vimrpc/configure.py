@@ -7,7 +7,6 @@ from .functions import KillablePool
 from .utils import GetSearchGrepArgs, GetSearchConfig, escape, GetConfigByKey, AddAbbreviate
 import os.path as osp
 import subprocess
-from .sema.sema import SemaPool, LinePos
 
 class ProjectConfigure(Service):
     def __init__(self, queue):
@@ -27,8 +26,7 @@ class ProjectConfigure(Service):
         
 def test_main():
     from server_cluster import ServerCluster, printer_process_fn
-    mp_manager = mp.Manager()
-    servers = ServerCluster(mp_manager)
+    servers = ServerCluster()
     servers.start_queue(printer_process_fn)
     #servers.grepfinder = GrepSearcher(servers.queue)
     fn1 = servers.get_server_fn("config.set_config_by_key")
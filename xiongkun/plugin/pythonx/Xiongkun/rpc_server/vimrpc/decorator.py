@@ -27,6 +27,9 @@ class AsyncServer:
         elif hasattr(attr, "__stream__") and attr.__stream__ is True: 
             new_attr = stream_decorator(self, key, attr)
             setattr(self, key, new_attr)
+        elif hasattr(attr, "__scatter__"): 
+            new_attr = scatter_decorator(self, key, attr)
+            setattr(self, key, new_attr)
         attr = getattr(self, key)
         return attr
 
@@ -41,28 +44,38 @@ def stream_function(func):
     setattr(func, "__stream__", True)
     return func
 
+def scatter_function(reduce_fn):
+    """ the function runs in every scatter worker of the WorkerPool on its shard,
+        reduce_fn(outputs, *args) gather the outputs.
+    """
+    def decorator(func):
+        setattr(func, "__scatter__", reduce_fn)
+        return func
+    return decorator
+
 def process_function(this, funcname, func):
     """ process function is a decorator:
-        @process_function(func) will make func a non-block callable
+        @process_function(func) will make func a non-block callable, 
+        it runs in a warm worker of this.ppool and cancels the last call.
     """
     def wrapper(*args):
         id = args[0]
         args = args[1:]
-        def worker(*args):
-            output = func(*args)
-            this.queue.put((id, True, output))
-        this.ppool.terminal(this, funcname)
-        this.ppool.start_process(this, funcname, target=worker, args=args)
+        this.ppool.submit(this, funcname, id, args)
         return InQueue()
     return wrapper
 
 def stream_decorator(this, funcname, func):
     def wrapper(*args):
-        def worker(*args):
-            output = func(*args)
-            this.queue.put((args[0], True, output))
-        this.ppool.terminal(this, funcname)
-        this.ppool.start_process(this, funcname, target=worker, args=args)
+        this.ppool.submit(this, funcname, args[0], args)
+        return InQueue()
+    return wrapper
+
+def scatter_decorator(this, funcname, func):
+    def wrapper(*args):
+        id = args[0]
+        args = args[1:]
+        this.ppool.scatter(this, funcname, id, args, func.__scatter__)
         return InQueue()
     return wrapper
 
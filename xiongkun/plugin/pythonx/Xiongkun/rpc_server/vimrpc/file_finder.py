@@ -5,25 +5,27 @@ import time
 from .decorator import *
 from .functions import KillablePool
 from .fuzzy_list import FuzzyList
-from .utils import GetSearchFiles
+from .file_watcher import FileWatcher
 
 class FileFinder(Service):
     def __init__(self, queue, ppool):
         self.queue = queue
         self.ppool = ppool
         self.root = None
+        self.watcher = None
         self.fuzzy = FuzzyList(self.queue, ppool)
 
     @server_function
     def set_root(self, rootpath, force=False):
         if not force and self.root == rootpath: 
-            return self.files[:17]
+            return self.watcher.head(17) # with the changes since the walk.
         self.root = rootpath
-        self.files = GetSearchFiles(self.root)
-        self.files = [ file[len(self.root)+1:] for file in self.files ] # remove directory
-        # TODO: find files and reset it.
-        self.fuzzy.set_items(-1, "filefinder", self.files)
-        return self.files[:17]
+        if self.watcher is not None: 
+            self.watcher.stop()
+        # the files are walked once, then the changes are patched (inotify).
+        self.watcher = FileWatcher(self.root, self.fuzzy, "filefinder")
+        self.watcher.start()
+        return self.watcher.head(17)
 
     # transfer only
     def search(self, id, name, search_text):
@@ -31,9 +33,7 @@ class FileFinder(Service):
 
 def test_main():
     from server_cluster import ServerCluster, printer_process_fn
-    import multiprocessing as mp
-    mp_manager = mp.Manager()
-    servers = ServerCluster(mp_manager)
+    servers = ServerCluster()
     servers.start_queue(printer_process_fn)
     #servers.grepfinder = GrepSearcher(servers.queue)
     fn = servers.get_server_fn("filefinder.set_root")
@@ -0,0 +1,114 @@
+import os
+import re
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from .candidate_store import CandidateList
+
+class FileWalker:
+    """
+    The files of a directory with the excludes of `.vim_config.yaml`, the
+    same list in the same order as
+
+        find DIR -not -path "*{dir}" ... -not -name "*{file}" ... | os.path.isfile
+
+    without the `find` process and the stat per line of isfile:
+
+        files   : DirEntry.is_file(), the type of readdir (a stat only for
+                  the symlinks), directories are not followed like find.
+        prune   : a `-path` ending with `*` (e.g. `/build/*`) matches all
+                  the paths under a directory whose path or path + "/"
+                  matches the rest, the directory is not read at all. the
+                  ones not ending with `/*` are matched with every file too.
+        threads : the top directories are read until there are `tasks`
+                  subtrees, they are walked in a thread pool (readdir and
+                  stat release the GIL, a network fs waits in parallel)
+                  and joined in the order of find.
+        visit   : visit(path, rel) is called before a directory is read, in
+                  the threads of the pool (FileWatcher watches it).
+    """
+    threads = 8
+    tasks = 64 # subtrees of the thread pool, more than threads to balance them.
+
+    def __init__(self, excludes, visit=None):
+        self.visit = visit
+        dirs, files = excludes
+        patterns = [ "*" + exclude for exclude in dirs ] # as GetSearchFindArgs.
+        self.prune = self._compile([ fnmatch.translate(p[:-1]) for p in patterns if p.endswith("*") ])
+        self.paths = self._compile([ fnmatch.translate(p) for p in patterns if not p.endswith("/*") ])
+        self.names = self._compile([ fnmatch.translate("*" + exclude) for exclude in files ])
+
+    @staticmethod
+    def _compile(patterns):
+        return re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+    def excluded(self, path, name):
+        """ a file excluded by -path / -name.
+        """
+        return (self.names is not None and self.names.match(name) is not None or 
+                self.paths is not None and self.paths.match(path) is not None)
+
+    def pruned(self, path):
+        return self.prune is not None and (self.prune.match(path + "/") or self.prune.match(path)) is not None
+
+    def scan(self, top, rel, relative):
+        """ the entries of one directory in the order of readdir: a str for a
+            file, (path, rel) for a directory to walk.
+        """
+        items = []
+        paths, names = self.paths, self.names
+        if self.visit is not None: self.visit(top, rel)
+        try:
+            with os.scandir(top) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.pruned(entry.path):
+                                items.append((entry.path, rel + entry.name + "/"))
+                        elif entry.is_file(): # follows a symlink, as isfile.
+                            if names is not None and names.match(entry.name): continue
+                            if paths is not None and paths.match(entry.path): continue
+                            items.append(rel + entry.name if relative else entry.path)
+                    except OSError: # removed or no permission, find skips it too.
+                        continue
+        except OSError:
+            pass
+        return items
+
+    def subtree(self, top, rel, relative):
+        """ the files of a subtree in the order of find, a stack instead of
+            the recursion for the deep trees.
+        """
+        files = []
+        stack = [iter(self.scan(top, rel, relative))]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, str):
+                    files.append(item)
+                else:
+                    stack.append(iter(self.scan(*item, relative)))
+                    break
+            else:
+                stack.pop()
+        return files
+
+    def walk(self, directory, relative=False, initializer=None):
+        """ CandidateList of the files, relative to directory if relative.
+            initializer runs in every thread of the pool (to nice them).
+        """
+        root = directory
+        for idx, char in enumerate(root + "/"): # find matches the path of the root too.
+            if char == "/" and idx and self.pruned(root[:idx]):
+                return CandidateList()
+        with ThreadPoolExecutor(self.threads, initializer=initializer) as pool:
+            plan = [(root, "")]
+            while True: # read the top levels in place, it keeps the order.
+                dirs = [ item for item in plan if not isinstance(item, str) ]
+                if not dirs or len(dirs) >= self.tasks: break
+                scans = iter(pool.map(lambda item: self.scan(*item, relative), dirs))
+                plan = [ file for item in plan for file in ([item] if isinstance(item, str) else next(scans)) ]
+            walks = iter(pool.map(lambda item: self.subtree(*item, relative), dirs))
+            files = []
+            for item in plan:
+                if isinstance(item, str): files.append(item)
+                else: files.extend(next(walks))
+        return CandidateList(files)
@@ -0,0 +1,325 @@
+import os
+import time
+import errno
+import ctypes
+import select
+import struct
+import itertools
+import threading
+import traceback
+from threading import Thread, Event, Lock
+from .file_walker import FileWalker
+from .candidate_store import CandidateList
+from .worker_pool import lower_priority
+from .utils import GetSearchConfig, GetSearchFiles
+from log import log
+
+# inotify(7)
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_ADDED = IN_CREATE | IN_MOVED_TO
+IN_WATCH = IN_ADDED | IN_DELETE | IN_MOVED_FROM | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+_EVENT = struct.Struct("iIII") # wd, mask, cookie, len of the name.
+
+class Inotify:
+    """
+    the inotify calls of libc by ctypes, a nonblocking fd. open() is None
+    where there is no inotify (not linux).
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    @classmethod
+    def open(cls):
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            eno = ctypes.get_errno()
+            raise OSError(eno, os.strerror(eno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """ [(wd, mask, name)] of the queued events, name is '' for the directory itself.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, size = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos:pos+size].rstrip(b"\0"))
+                pos += size
+                events.append((wd, mask, name))
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+def parent(rel):
+    """ the directory (a rel of FileWalker, '' or ending with '/') of a file.
+    """
+    return rel[:rel.rfind("/", 0, len(rel) - 1) + 1]
+
+class FileWatcher:
+    """
+    The files of a root kept up to date for filefinder: GetSearchFiles walks
+    the tree once, then the changes of the tree are patched into the lists
+    of the FuzzyList workers (patch_items) instead of a rescan.
+
+        inotify : a watch per directory, added by the walk before the
+                  directory is read. the events of `latency` seconds are
+                  applied together, a new directory is walked.
+        poll    : without inotify (or out of fs.inotify.max_user_watches),
+                  the mtime of every directory is checked every `interval`
+                  seconds, as make does, and the changed ones are read again.
+        overflow: the kernel dropped events (IN_Q_OVERFLOW), the changed
+                  directories are found by their mtime as the poll does and
+                  only they are read again, the new ones walked.
+
+    the files are `base` (the list of the last set_items) without `dropped`
+    plus `added`. base is rebuilt and set again when the patches are more
+    than `max_patch`, the workers index the whole list again.
+    """
+    latency = 0.1
+    interval = 2.0
+    max_patch = 8192
+    use_inotify = True
+
+    def __init__(self, root, fuzzy, name):
+        self.root = root
+        self.fuzzy = fuzzy
+        self.name = name
+        self.dirs = {} # rel of a directory ('' is root) -> st_mtime_ns before it was read.
+        self.wds = {} # watch -> rel
+        self.watches = {} # rel -> watch
+        self.base = None
+        self.dropped = set() # items of base removed or added again.
+        self.added = {} # the items added since base, in order.
+        self.inotify = None
+        self.no_watch = False # out of watches, poll.
+        self.lock = Lock() # wds / watches of the walk threads, the files of head().
+        self.stopped = Event()
+        self.thread = None
+        self.patched = 0 # the changes applied, for the log.
+
+    def start(self):
+        """ walk the root, set the list and follow the changes, the list of the walk.
+        """
+        self.inotify = Inotify.open() if self.use_inotify else None
+        self.walker = FileWalker(GetSearchConfig(self.root), self._visit)
+        self.base = GetSearchFiles(self.root, True, self._visit)
+        self.fuzzy.set_items(-1, self.name, self.base, True)
+        if self.inotify is not None and self.no_watch:
+            self._poll_instead()
+        log(f"[FileWatcher] {self.root}: {len(self.base)} files, {len(self.dirs)} directories, " +
+            ("inotify" if self.inotify is not None else f"poll every {self.interval}s"))
+        self.thread = Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        return self.base
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def _visit(self, path, rel):
+        # in the threads of the walk, watch before the mtime and the read.
+        if self.inotify is not None and not self.no_watch:
+            try:
+                wd = self.inotify.add_watch(path, IN_WATCH)
+                with self.lock:
+                    self.wds[wd] = rel
+                    self.watches[rel] = wd
+            except OSError as e:
+                if e.errno == errno.ENOSPC: self.no_watch = True
+        try:
+            self.dirs[rel] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+
+    def _poll_instead(self):
+        log(f"[FileWatcher] out of inotify watches (fs.inotify.max_user_watches), poll {self.root}.")
+        self.inotify.close()
+        self.inotify = None
+        self.wds.clear()
+        self.watches.clear()
+
+    def _loop(self):
+        lower_priority(threading.get_native_id())
+        while not self.stopped.is_set():
+            try:
+                if self.inotify is None:
+                    if not self.stopped.wait(self.interval): self._sweep()
+                    continue
+                if not select.select([self.inotify], [], [], 1.0)[0]: continue
+                events = self.inotify.read()
+                deadline = time.time() + self.latency
+                while time.time() < deadline: # a burst (git checkout) is one patch.
+                    select.select([self.inotify], [], [], max(0.0, deadline - time.time()))
+                    events += self.inotify.read()
+                self._apply(events)
+                if self.no_watch: self._poll_instead()
+            except Exception:
+                traceback.print_exc()
+
+    def _apply(self, events):
+        """ the events of a window: the touched files are checked on the disk
+            (an event may be undone in the window), the removed directories
+            dropped, the new ones walked.
+        """
+        files, gone, new = {}, [], []
+        overflow = False
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            rel = self.wds.get(wd, None)
+            if rel is None: continue
+            if mask & IN_IGNORED: # the directory is removed, or rm_watch.
+                self._unwatch(rel, wd)
+                continue
+            if not name: continue
+            if mask & IN_ISDIR:
+                if mask & IN_ADDED: new.append(rel + name + "/")
+                else: gone.append(rel + name + "/")
+            else:
+                files[rel + name] = None
+        removed, added = self._remove_dirs(gone), []
+        for rel in new:
+            added += self._walk_dir(rel)
+        for rel in files:
+            path = os.path.join(self.root, rel)
+            if os.path.isfile(path) and not self.walker.excluded(path, rel[rel.rfind("/")+1:]):
+                added.append(rel)
+            else:
+                removed.append(rel)
+        self._patch(added, removed)
+        if overflow:
+            log(f"[FileWatcher] {self.root}: the inotify queue overflowed, read the changed directories.")
+            self._sweep()
+
+    def _sweep(self):
+        """ read again the directories whose mtime changed, the files of the
+            rest are the same (the entries of a directory set its mtime).
+        """
+        changed = []
+        for rel, mtime in list(self.dirs.items()):
+            try:
+                if os.stat(os.path.join(self.root, rel)).st_mtime_ns == mtime: continue
+            except OSError:
+                pass
+            changed.append(rel)
+        if not changed: return
+        changed = set(changed)
+        old = {}
+        for item in self._files():
+            if parent(item) in changed: old[item] = None
+        removed, added = [], []
+        for rel in sorted(changed):
+            if rel not in self.dirs: continue # under a removed one.
+            path = os.path.join(self.root, rel)
+            if not os.path.isdir(path):
+                removed += self._remove_dirs([rel])
+                continue
+            subdirs = set()
+            for item in self.walker.scan(path, rel, True): # visit sets the mtime.
+                if isinstance(item, str):
+                    if item in old: del old[item]
+                    else: added.append(item)
+                else:
+                    subdirs.add(item[1])
+                    if item[1] not in self.dirs: added += self._walk_dir(item[1])
+            removed += self._remove_dirs([ d for d in self.dirs if d != rel and parent(d) == rel and d not in subdirs ])
+        self._patch(added, removed + [ item for item in old if parent(item) in self.dirs ])
+
+    def _walk_dir(self, rel):
+        """ the files of a new directory, it is watched.
+        """
+        path = os.path.join(self.root, rel)
+        if self.walker.pruned(path.rstrip("/")) or not os.path.isdir(path):
+            return []
+        return self.walker.subtree(path, rel, True)
+
+    def _remove_dirs(self, rels):
+        """ forget the directories under rels, the files of them.
+        """
+        if not rels: return []
+        prefixes = tuple(rels)
+        for rel in [ rel for rel in self.dirs if rel.startswith(prefixes) ]:
+            del self.dirs[rel]
+            wd = self.watches.get(rel, None)
+            if wd is not None: # a moved directory is still watched.
+                self._unwatch(rel, wd)
+                self.inotify.rm_watch(wd)
+        return [ item for item in self._files() if item.startswith(prefixes) ]
+
+    def head(self, num):
+        """ the first num files now, the order the search sees them in.
+        """
+        with self.lock:
+            return list(itertools.islice(self._files(), num))
+
+    def _unwatch(self, rel, wd):
+        with self.lock:
+            if self.wds.get(wd, None) == rel: del self.wds[wd]
+            if self.watches.get(rel, None) == wd: del self.watches[rel]
+
+    def _files(self):
+        """ the files now, base without dropped plus added.
+        """
+        dropped = self.dropped
+        if dropped:
+            yield from (item for item in self.base if item not in dropped)
+        else:
+            yield from self.base
+        yield from self.added
+
+    def _patch(self, added, removed):
+        if not added and not removed: return
+        with self.lock:
+            for item in removed:
+                self.dropped.add(item)
+                self.added.pop(item, None)
+            for item in added:
+                self.dropped.add(item)
+                self.added[item] = None
+            self.patched += len(added) + len(removed)
+            rebase = len(self.dropped) + len(self.added) > self.max_patch
+            if rebase:
+                self.base = CandidateList(list(self._files()))
+                self.dropped, self.added = set(), {}
+        if rebase:
+            log(f"[FileWatcher] {self.root}: {self.patched} changes, set the list again.")
+            self.fuzzy.set_items(-1, self.name, self.base, True)
+        else:
+            self.fuzzy.patch_items(-1, self.name, added, removed)
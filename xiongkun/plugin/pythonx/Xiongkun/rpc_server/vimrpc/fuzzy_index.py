@@ -0,0 +1,401 @@
+import re
+import heapq
+import itertools
+from array import array
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+from .worker_pool import cancellable, check_cancel
+
+try:
+    import numpy as np
+except ImportError: # optional, CandidateIndex ranks in python without it.
+    np = None
+
+# bit of a character in the masks: a-z, 0-9 and the punctuation of paths
+# have their own bit, the other characters share the bits from 41 by ord.
+_BITS = { c: idx for idx, c in enumerate("abcdefghijklmnopqrstuvwxyz0123456789_./-+") }
+_SHARED_BITS = 23
+_bit_cache = {}
+
+def char_bit(c):
+    bit = _bit_cache.get(c, None)
+    if bit is None:
+        idx = _BITS.get(c, None)
+        bit = 1 << (idx if idx is not None else len(_BITS) + ord(c) % _SHARED_BITS)
+        _bit_cache[c] = bit
+    return bit
+
+def char_mask(text):
+    """ the bits of the characters in text (lowercased), a candidate
+        can contain text only if its mask has all of them.
+    """
+    return reduce(or_, map(char_bit, set(text)), 0)
+
+_REGEX_CHARS = set("\\^$.|?*+()[]{}")
+
+def is_literal(pattern):
+    return not any(c in _REGEX_CHARS for c in pattern)
+
+def shortest_match(text, candidate):
+    """ (length, start) of the shortest window of candidate that contains
+        the chars of text in order, the first one of the shortest, None if
+        there is none. it is the rank of fuzzyfinder (the shortest match of
+        its `(?=(a.*?b.*?c))`) without the regex, which is slow on long paths.
+    """
+    best = None
+    first, rest = text[0], text[1:]
+    start = candidate.find(first)
+    while start != -1:
+        pos = start + 1
+        for c in rest:
+            pos = candidate.find(c, pos) + 1
+            if pos == 0: return best # no match from start, so none from the later starts.
+        if best is None or pos - start < best[0]:
+            best = (pos - start, start)
+            if best[0] == len(text): break
+        start = candidate.find(first, start + 1)
+    return best
+
+def is_subsequence(text, candidate):
+    pos = 0
+    for c in text:
+        pos = candidate.find(c, pos) + 1
+        if pos == 0: return False
+    return True
+
+def regex_match(text, candidate):
+    """ shortest_match by the regex of fuzzyfinder, for the non ascii strings: 
+        its IGNORECASE is not lower(), e.g. `s` matches `ſ`.
+    """
+    pattern = "(?=({0}))".format(".*?".join(map(re.escape, text)))
+    matches = list(re.finditer(pattern, candidate, re.IGNORECASE))
+    if not matches: return None
+    best = min(matches, key=lambda x: len(x.group(1)))
+    return (len(best.group(1)), best.start())
+
+def parse_qualifier(qualifier):
+    """ (include, exclude, include_re, exclude_re) of the `+` / `-` qualifiers,
+        the literal ones are lowercased like the paths, the others compiled.
+    """
+    include, exclude, include_re, exclude_re = [], [], [], []
+    for qual in qualifier:
+        sign, pattern = qual[0], qual[1:]
+        if is_literal(pattern):
+            (include if sign == "+" else exclude).append(pattern.lower())
+        else:
+            (include_re if sign == "+" else exclude_re).append(re.compile(pattern))
+    return include, exclude, include_re, exclude_re
+
+def _contains(matrix, pattern):
+    """ columns of matrix (a string per column) that contain the bytes of pattern.
+    """
+    width, rows = matrix.shape
+    size = len(pattern)
+    if size > width: return np.zeros(rows, dtype=bool)
+    if size == 0: return np.ones(rows, dtype=bool)
+    hit = matrix[:width-size+1] == pattern[0]
+    for offset in range(1, size):
+        hit &= matrix[offset:width-size+1+offset] == pattern[offset]
+    return hit.any(axis=0)
+
+def _window(matrix, text):
+    """ shortest_match of text (bytes) for every column of matrix: (length, start),
+        length is `width + 1` for the columns without a match.
+
+        start[j] is 1 + the latest start of a match of the query prefix that 
+        ends at char j (0 for none), the next char can end at j only after
+        the latest start before j. a window of a fixed end is the shortest
+        with the latest start, the first of the shortest has the smallest 
+        end (a min, argmax along axis 0 is slow). the columns that miss a
+        prefix are dropped once they are the half, a long query touches 
+        only the few that match. the positions are uint8 for the (most)
+        strings shorter than 255, half the memory traffic of int16.
+    """
+    width, rows = matrix.shape
+    chars = np.arange(1, width + 1, dtype=np.uint8 if width < 255 else np.int16)[:, None]
+    alive = np.arange(rows)
+    start = (matrix == text[0]) * chars
+    before = np.zeros_like(start)
+    for c in text[1:]:
+        # a ufunc per row, 10x faster than np.maximum.accumulate along axis 0.
+        np.copyto(before[1], start[0])
+        for j in range(2, width):
+            np.maximum(before[j-1], start[j-1], out=before[j])
+        found = np.nonzero((before[-1] > 0) | (start[-1] > 0))[0]
+        if len(found) * 2 <= len(alive):
+            alive, matrix, before = alive[found], matrix[:, found], before[:, found]
+            start = np.empty_like(before)
+        np.multiply(matrix == c, before, out=start)
+    none = chars.dtype.type(width + 1)
+    length = np.where(start > 0, chars + 1 - start, none)
+    shortest = length.min(axis=0)
+    end = np.where(length == shortest, chars - 1, none).min(axis=0)
+    lengths, starts = np.full(rows, width + 1, dtype=np.int64), np.zeros(rows, dtype=np.int64)
+    lengths[alive] = shortest
+    starts[alive] = end.astype(np.int64) - shortest + 1
+    return lengths, starts
+
+class PackedCandidates:
+    """
+    The ascii candidates of a CandidateIndex for the NumPy ranking. the
+    lowered strings are padded with 0 to a multiple of `step`, one uint8 
+    matrix per width with a string per column (char i of all the strings
+    is a contiguous row, the passes below are elementwise), and a query is
+    ranked for a chunk of strings at once instead of a python loop per
+    candidate:
+
+        mask    : (masks & need) == need, as CandidateIndex.
+        contains: a literal qualifier, AND of the shifted char rows.
+        window  : shortest_match of every string, a pass per query char.
+
+    the top `limit` are picked by np.partition of (length, start), only the
+    ties of the last one are compared by the string (as fuzzyfinder).
+    row r is the id `ids[r]` of the index, rows are sorted by width.
+    """
+    step = 16
+    max_width = 4096 # longer strings stay in python, positions are int16.
+    chunk_cells = 1 << 18 # cells of the matrix of a chunk, bounds the temporaries.
+
+    def __init__(self, lowered, masks, ids):
+        width_of = lambda idx: max(self.step, (len(lowered[idx]) + self.step - 1) // self.step * self.step)
+        ids = sorted(ids, key=width_of)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.masks = np.array([ masks[idx] for idx in ids ], dtype=np.uint64)
+        self.widths, self.firsts, self.matrices = [], [], []
+        first = 0
+        for width, group in itertools.groupby(ids, key=width_of):
+            group = list(group)
+            blob = b"".join(lowered[idx].encode("ascii").ljust(width, b"\0") for idx in group)
+            self.widths.append(width)
+            self.firsts.append(first)
+            self.matrices.append(np.ascontiguousarray(np.frombuffer(blob, dtype=np.uint8).reshape(len(group), width).T))
+            first += len(group)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _chunks(self, rows):
+        """ (rows, their matrix) by width, at most chunk_cells each. rows are sorted.
+        """
+        contiguous = len(rows) == 0 or rows[-1] - rows[0] + 1 == len(rows)
+        cuts = np.searchsorted(rows, self.firsts + [len(self.ids)])
+        for m, width in enumerate(self.widths):
+            size = max(1, self.chunk_cells // width)
+            for begin in range(cuts[m], cuts[m+1], size):
+                check_cancel()
+                part = rows[begin:min(cuts[m+1], begin + size)]
+                if contiguous: # a scan of all the rows, no copy.
+                    yield part, self.matrices[m][:, part[0]-self.firsts[m]:part[-1]-self.firsts[m]+1]
+                else:
+                    yield part, self.matrices[m][:, part - self.firsts[m]]
+
+    def match(self, text, rows, quals, lowered, items, limit):
+        """ the rows (all if None) that match text and quals (None to skip them, a refine),
+            and (length, start, item) of the best `limit` of them.
+        """
+        nothing = (np.zeros(0, dtype=np.int64), [])
+        if not text.isascii(): # the rows are ascii.
+            return nothing
+        need = char_mask(text)
+        if quals is not None: 
+            include, exclude, include_re, exclude_re = quals
+            if not all(pattern.isascii() for pattern in include): 
+                return nothing
+            include = [ pattern.encode("ascii") for pattern in include ]
+            exclude = [ pattern.encode("ascii") for pattern in exclude if pattern.isascii() ]
+            for pattern in include: need |= char_mask(pattern.decode("ascii"))
+        query = text.encode("ascii")
+        rows = np.arange(len(self.ids)) if rows is None else rows
+        rows = rows[(self.masks[rows] & np.uint64(need)) == np.uint64(need)]
+        matched, lengths, starts = [], [], []
+        for part, matrix in self._chunks(rows):
+            if quals is not None and (include or exclude):
+                keep = np.ones(len(part), dtype=bool)
+                for pattern in include: keep &= _contains(matrix, pattern)
+                for pattern in exclude: keep &= ~_contains(matrix, pattern)
+                part, matrix = part[keep], matrix[:, keep]
+            if quals is not None and (include_re or exclude_re):
+                keep = [ all(regex.search(lowered[idx]) for regex in include_re) and 
+                         not any(regex.search(lowered[idx]) for regex in exclude_re) for idx in self.ids[part] ]
+                keep = np.array(keep, dtype=bool)
+                part, matrix = part[keep], matrix[:, keep]
+            if len(part) == 0: continue
+            length, start = _window(matrix, query)
+            found = length <= matrix.shape[0]
+            matched.append(part[found])
+            lengths.append(length[found])
+            starts.append(start[found])
+        if not matched: 
+            return nothing
+        matched, lengths, starts = np.concatenate(matched), np.concatenate(lengths), np.concatenate(starts)
+        rank = lengths << 16 | starts
+        top = np.arange(len(rank))
+        if len(rank) > limit:
+            last = np.partition(rank, limit - 1)[limit - 1]
+            top = np.nonzero(rank < last)[0]
+            ties = self.ids[matched[rank == last]] # a short query ties thousands.
+            ties = heapq.nsmallest(limit - len(top), (items[idx] for idx in ties.tolist()))
+            length, start = int(last >> 16), int(last & 0xffff)
+        scored = [ (int(lengths[i]), int(starts[i]), items[idx]) for i, idx in zip(top, self.ids[matched[top]]) ]
+        if len(rank) > limit:
+            scored += [ (length, start, item) for item in ties ]
+        return matched, scored
+
+class CandidateIndex:
+    """
+    The candidates of a fuzzy search, pre-processed once by set_items (in
+    the scatter workers, for their shard) instead of on every keystroke:
+
+        items  : the original strings, scored and returned.
+        lowered: lowercased, shares the string when it is lowercase already.
+        bases  : offset of the basename in the string.
+        masks  : char_mask of the lowered string, -1 (all the bits) for
+                 the non ascii strings, they are ranked by regex_match.
+        packed : PackedCandidates of the ascii strings when NumPy is there
+                 and the list has `min_packed` items, `others` are the ids
+                 ranked in python. None to rank all of them in python.
+
+    search() rejects the candidates by the mask first, then by the literal
+    qualifiers (`in` of the lowered string) and the regex ones (compiled
+    once per search). the rest are ranked like fuzzyfinder by
+    shortest_match, so long paths are fine.
+
+    the survivors (the matched ids) of the last `max_refines` queries are
+    kept per owner (the session of the shared host). a query whose text 
+    contains the text of a kept one in order (`fi` -> `fil`) with the same
+    qualifiers matches a subset of its survivors, so only those are ranked
+    again, and a kept query (backspace to `fi`) is answered from the cache.
+    """
+    max_refines = 16
+    use_numpy = np is not None
+    min_packed = 4096 # the lists of merge_search are ranked in python.
+
+    def __init__(self, items):
+        self.items = items
+        self.lowered = []
+        self.bases = []
+        self.masks = []
+        for item in items:
+            low = item.lower()
+            if low == item: low = item
+            self.lowered.append(low)
+            self.bases.append(low.rfind("/") + 1)
+            self.masks.append(char_mask(low) if item.isascii() else -1)
+        self.packed, self.others = None, None
+        if self.use_numpy and len(items) >= self.min_packed:
+            is_packed = lambda idx: self.masks[idx] != -1 and len(self.lowered[idx]) <= PackedCandidates.max_width
+            self.packed = PackedCandidates(self.lowered, self.masks, [ idx for idx in range(len(items)) if is_packed(idx) ])
+            self.others = array('I', [ idx for idx in range(len(items)) if not is_packed(idx) ])
+        self.refines = OrderedDict() # (owner, qualifier, text) -> (survivors, result, limit), LRU.
+        self.refined = 0 # searches answered from the survivors / the cache.
+
+    def __len__(self):
+        return len(self.items)
+
+    def discard(self, drop):
+        """ never return the items in drop (a set) again, the ids are kept: 
+            their masks are 0, no text passes them. the number of them.
+        """
+        lowered = { item.lower() for item in drop } # a list of str, faster than items.
+        dead = [ idx for idx, low in enumerate(self.lowered) if low in lowered and self.items[idx] in drop ]
+        for idx in dead: 
+            self.masks[idx] = 0
+        if dead and self.packed is not None:
+            self.packed.masks[np.isin(self.packed.ids, dead)] = 0
+        if dead: 
+            self.refines.clear() # the kept results may hold them.
+        return len(dead)
+
+    def basename(self, idx):
+        return self.items[idx][self.bases[idx]:]
+
+    def search(self, search_base, qualifier, limit=17, owner=None):
+        """ the best `limit` items that contain the chars of search_base in 
+            order and pass the `+` / `-` qualifiers, in the order of fuzzyfinder.
+        """
+        text = search_base.lower()
+        qualifier = tuple(qualifier)
+        key = (owner, qualifier, text)
+        if key in self.refines and self.refines[key][2] >= limit:
+            self.refines.move_to_end(key)
+            self.refined += 1
+            return self.refines[key][1][:limit]
+        base = self._refine_base(owner, qualifier, text)
+        if base is not None:
+            self.refined += 1
+        quals = parse_qualifier(qualifier) if base is None else None # the survivors passed them.
+        if self.packed is None:
+            survivors, scored = self._match(text, search_base, range(len(self.items)) if base is None else base, quals)
+        else:
+            rows, others = (None, self.others) if base is None else base
+            rows, scored = self.packed.match(text, rows, quals, self.lowered, self.items, limit)
+            others, more = self._match(text, search_base, others, quals)
+            survivors = (rows, others)
+            scored += more
+        result = [ item for length, start, item in heapq.nsmallest(limit, scored) ]
+        self.refines[key] = (survivors, result, limit)
+        if len(self.refines) > self.max_refines:
+            self.refines.popitem(last=False)
+        return result
+
+    def _refine_base(self, owner, qualifier, text):
+        """ the smallest kept survivors that contain the matches of text, None to scan all.
+        """
+        best, best_size = None, None
+        for (o, q, t), (survivors, result, limit) in self.refines.items():
+            if o == owner and q == qualifier and is_subsequence(t, text):
+                size = len(survivors) if self.packed is None else len(survivors[0]) + len(survivors[1])
+                if best is None or size < best_size: best, best_size = survivors, size
+        return best
+
+    def _match(self, text, search_base, ids, quals):
+        """ the ids that match text and quals (None to skip them, a refine), 
+            and their (length, start, item).
+        """
+        need = char_mask(text)
+        include, exclude, include_re, exclude_re = quals or ([], [], [], [])
+        for pattern in include: need |= char_mask(pattern)
+        survivors, scored = array('I'), []
+        masks, lowered, items = self.masks, self.lowered, self.items
+        for idx in cancellable(ids):
+            mask = masks[idx]
+            if mask & need != need: continue
+            low = lowered[idx]
+            if exclude and any(pattern in low for pattern in exclude): continue
+            if include and not all(pattern in low for pattern in include): continue
+            if include_re and not all(regex.search(low) for regex in include_re): continue
+            if exclude_re and any(regex.search(low) for regex in exclude_re): continue
+            rank = shortest_match(text, low) if mask != -1 else regex_match(search_base, items[idx])
+            if rank is not None: 
+                survivors.append(idx)
+                scored.append((rank[0], rank[1], items[idx]))
+        return survivors, scored
+
+if __name__ == "__main__":
+    index = CandidateIndex(["Paddle/fluid/Operators/conv_op.cc", "paddle/phi/kernels/conv_kernel.h", "build/paddle/conv.o"])
+    assert index.basename(0) == "conv_op.cc"
+    assert index.search("conv", ["-build/"]) == ["paddle/phi/kernels/conv_kernel.h", "Paddle/fluid/Operators/conv_op.cc"]
+    assert index.search("opconv", []) == ["Paddle/fluid/Operators/conv_op.cc"]
+    assert index.search("conv", ["+ker.*\\.h$"]) == ["paddle/phi/kernels/conv_kernel.h"]
+    assert index.search("xyz", []) == []
+    for text in ["c", "co", "con", "conv", "con", "cv"]: # typing, backspace, an edit.
+        assert index.search(text, []) == CandidateIndex(index.items).search(text, [])
+    assert index.refined == 5
+    assert index.discard({"paddle/phi/kernels/conv_kernel.h", "other"}) == 1
+    assert index.search("conv", ["-build/"]) == ["Paddle/fluid/Operators/conv_op.cc"]
+    paths = [ f"{a}/{b}_{i}/{c}{i % 7}.{ext}" for i, (a, b, c, ext) in enumerate(itertools.product(
+        ["paddle", "Fluid", "phi", "İo"], ["ops", "kernels", "tests"], ["conv", "matmul", "ſum", "reduce"], ["cc", "h", "py"])) ] * 50
+    for text, qualifier in [("cv", []), ("conv.h", ["-git/"]), ("ker", ["+conv", "-tests"]), ("s", ["+\\.py$"]), ("io", []), ("su", [])]:
+        CandidateIndex.use_numpy = np is not None
+        packed = CandidateIndex(paths).search(text, qualifier, 20)
+        CandidateIndex.use_numpy = False
+        assert packed == CandidateIndex(paths).search(text, qualifier, 20), text
+    CandidateIndex.use_numpy = np is not None
+    index = CandidateIndex(paths)
+    index.search("conv", [])
+    index.discard(set(paths[::2]))
+    assert index.search("conv", [], 40) == CandidateIndex(paths[1::2]).search("conv", [], 40)
+    assert shortest_match("abc", "xaxbxcabc") == (3, 6)
+    assert shortest_match("abc", "axbxc") == regex_match("abc", "axbxc") == (5, 0)
+    print ("ok")
@@ -3,48 +3,119 @@ import sys
 import json
 import time
 from .decorator import *
-from .functions import KillablePool
+from .fuzzy_index import CandidateIndex
+from .candidate_store import CandidateStore, items_digest, apply_items_delta
+from .worker_pool import current_owner
+
+def merge_search(outputs, name, search_text):
+    # reduce and post handle.
+    # fuzzy map on the returned value.
+    gather = []
+    for output in outputs: 
+        res, _ = output
+        if not res: continue
+        gather.extend(res)
+    return fuzzy_match(search_text, gather)
 
 class FuzzyList(AsyncServer):
     def __init__(self, queue, ppool):
         """ 
-        Save a mapping from: name:String -> items:List(String)
+        Save a mapping from: name:String -> items:CandidateList, in a 
+        CandidateStore bounded by its budget, the least recently used 
+        lists are evicted. the scatter workers of ppool keep a shard of 
+        every list, and the items added by patch_items since (extras).
         """
         self.queue = queue
         self.ppool = ppool
-        self.lists_dict = {}
+        self.lists = CandidateStore()
+        self.shards = {}
+        self.extras = {}
+
+    def get_service(self, key):
+        service = super().get_service(key)
+        if key != "search": return service
+        def search(id, name, search_text): # a search is a use of the list for the LRU.
+            self.lists.touch(name)
+            return service(id, name, search_text)
+        return search
+
+    @server_function
+    def set_items(self, name, items, pinned=False): 
+        """ pinned: the list is not evicted, for the files crawled by the server,
+            the client sends its lists again when sync_items is False.
+        """
+        self._store(name, items, pinned)
+        return None
+
+    def _store(self, name, items, pinned):
+        evicted = self.lists.put(name, items, pinned)
+        for old in evicted:
+            self.ppool.unshard(self, "load_shard", old)
+        self.ppool.shard(self, "load_shard", name, self.lists.get(name))
+
+    @server_function
+    def drop_items(self, name): 
+        self.lists.pop(name)
+        self.ppool.unshard(self, "load_shard", name)
+        return None
+
+    def load_shard(self, name, items):
+        """ run in the scatter workers, items is None to drop the list.
+            the shard is indexed once here, not on every search.
+        """
+        self.extras.pop(name, None)
+        if items is None: self.shards.pop(name, None)
+        else: self.shards[name] = CandidateIndex(items)
 
     @server_function
-    def set_items(self, name, items): 
-        self.lists_dict[name] = items
+    def patch_items(self, name, added, removed):
+        """ change the list of name in the workers without sending it again
+            (FileWatcher): the items in removed or added are dropped, then 
+            added are appended. the kept list (lists, its digest) is the one 
+            of the last set_items, the owner sets the whole list once the 
+            patches are many.
+        """
+        if name not in self.lists: return None
+        self.ppool.patch(self, "patch_shard", name, list(added), list(set(removed) | set(added)))
         return None
 
+    def patch_shard(self, name, added, drop):
+        """ run in the scatter workers, added is the shard of the new items.
+        """
+        drop = set(drop)
+        if name in self.shards: self.shards[name].discard(drop)
+        extras = self.extras.pop(name, None)
+        extras = [ item for item in (extras.items if extras else []) if item not in drop ] + added
+        if extras: self.extras[name] = CandidateIndex(extras)
+
     @server_function
     def is_init(self, name, hashid):
-        return name in self.lists_dict and hash(tuple(self.lists_dict[name])) == hashid
+        # hashid is items_digest, use sync_items to send a delta as well.
+        return self.lists.digest(name) == hashid
+
+    @server_function
+    def sync_items(self, name, digest, base=None, delta=None):
+        """ True if the list of name is `digest` now: it is kept already, or 
+            delta (see items_delta) of the kept version `base` gives it. 
+            False if the client has to send the list by set_items.
+        """
+        known = self.lists.digest(name)
+        if known is None: return False
+        if known == digest: return True
+        if base != known or delta is None: return False
+        items = apply_items_delta(self.lists.get(name), delta)
+        if items_digest(items) != digest: return False
+        self._store(name, items, name in self.lists.pinned) # the workers index the whole list again.
+        return True
         
-    # TODO: error handle is not prefect
-    #       when we have processes: Main -> Search -> Pool, 
-    #       when kill the Search Process, Pool Processes will raise a lot of BrokenPipeError
-    #       how to ignore them.
-    #       Hints: https://stackoverflow.com/questions/11312525/catch-ctrlc-sigint-and-exit-multiprocesses-gracefully-in-python
-    #@server_function
-    @async_function 
+    @scatter_function(reduce_fn=merge_search)
     def search(self, name, search_text): 
-        # map and calculate
-        num_worker=20
-        files = self.lists_dict.get(name, [])
-        with KillablePool(num_worker) as p:
-            inputs = default_map_fn(1, num_worker, search_text, files)
-            outputs = p.map(fuzzy_match_pool, inputs)
-        # reduce and post handle.
-        # fuzzy map on the returned value.
-        gather = []
-        for output in outputs: 
-            res, _ = output
-            if not res: continue
-            gather.extend(res)
-        return fuzzy_match(search_text, gather)
+        # map: run in every scatter worker with its shard, the index keeps 
+        # the survivors of the last queries of the session to refine them.
+        res, search_base = fuzzy_match(search_text, self.shards.get(name, []), current_owner())
+        if name in self.extras: # merge_search ranks them together.
+            res = res + fuzzy_match(search_text, self.extras[name])[0]
+        return res, search_base
 
 def fuzzy_match_pool(args):
     """
@@ -52,10 +123,13 @@ def fuzzy_match_pool(args):
     """
     return fuzzy_match(*args)
 
-def fuzzy_match(search_text, candidate):
+def fuzzy_match(search_text, candidate, owner=None):
+    """ candidate is a CandidateIndex or a list, a list is indexed for this call.
+        owner is the session of the refine cache, see CandidateIndex.
+    """
     assert candidate is not None, "candidate is None, error!"
-    import glob
-    import re
+    if not isinstance(candidate, CandidateIndex): 
+        candidate = CandidateIndex(candidate)
     join = []
     if isinstance(search_text, tuple): 
         search_text = search_text[0]
@@ -81,19 +155,8 @@ def fuzzy_match(search_text, candidate):
     if "cmake/" not in qualifier_name_set: 
         qualifier.append("-cmake/")
 
-    def filt(filepath): 
-        basename = os.path.basename(filepath).lower()
-        filepath = filepath.lower()
-        # speed of fuzzyfind is limited by len(filepath), speed up from 20s -> 1s
-        if (len(filepath) > 100): return False
-        for qual in qualifier: 
-            if qual.startswith("+") and not re.search(qual[1:], filepath): return False
-            if qual.startswith("-") and re.search(qual[1:], filepath): return False
-        return True
-
     if search_base is not None: 
-        from fuzzyfinder import fuzzyfinder
-        res = list(fuzzyfinder(search_base, filter(filt, candidate)))[:17]
+        res = candidate.search(search_base, qualifier, 17, owner)
     if search_base is None: 
         return [], None
     return res, search_base
@@ -3,11 +3,13 @@ import sys
 import json
 import time
 from .decorator import *
-from .functions import KillablePool
-from .utils import GetSearchGrepArgs, GetSearchConfig, escape
+from .worker_pool import is_cancelled, check_cancel, current_priority, lower_priority, BACKGROUND
+from multiprocessing.pool import ThreadPool
+import threading
+import signal
+from .utils import GetSearchGrepArgs, GetSearchConfig, escape, kill_child
 import os.path as osp
 import subprocess
-from .sema.sema import SemaPool, LinePos
 
 class GrepSearcher(AsyncServer):
     def __init__(self, queue, ppool):
@@ -38,17 +40,23 @@ class GrepSearcher(AsyncServer):
 
     @stream_function 
     def search(self, id, directory, search_text): 
+        # runs in a warm task worker, egrep does the work so threads are enough.
         extra_args = GetSearchGrepArgs(GetSearchConfig(directory))
         works = self.split_work(directory)
         num_worker=20
-        with KillablePool(num_worker) as p:
-            inputs = [(search_text, extra_args, work, id, self.queue) for work in works]
-            outputs = p.map(do_grep_search, inputs)
-        # reduce and post handle.
-        gather = []
-        for output in outputs: 
-            res = output
-            if len(res): gather.extend(res)
+        children = []
+        stop = threading.Event()
+        def work_fn(work):
+            return do_grep_search((search_text, extra_args, work, id, self.queue), children, stop)
+        with ThreadPool(num_worker) as p:
+            outputs = p.map_async(work_fn, works)
+            try:
+                while not outputs.ready():
+                    outputs.wait(0.1)
+                    check_cancel()
+            finally:
+                stop.set()
+                for child in children: kill_child(child)
         return []
 
     @server_function
@@ -56,10 +64,23 @@ class GrepSearcher(AsyncServer):
         self.ppool.terminal(self, "search") # close the last search process.
 
     def start_filter(self, items, search_text, func):
+        # the same threads as search: the filters read files and wait on the
+        # disk, a pool of processes per call is slower than the work.
         num_worker=20
-        with KillablePool(num_worker) as p:
-            inputs = [(search_text, [item]) for item in items]
-            outputs = p.map(func, inputs)
+        stop = threading.Event()
+        def work_fn(item):
+            if stop.is_set(): return []
+            return func((search_text, [item]))
+        with ThreadPool(num_worker) as p:
+            outputs = p.map_async(work_fn, items)
+            try:
+                while not outputs.ready():
+                    outputs.wait(0.1)
+                    if is_cancelled(): stop.set()
+                check_cancel()
+            finally:
+                stop.set()
+            outputs = outputs.get()
         gather = []
         for output in outputs: 
             res = output
@@ -96,6 +117,8 @@ def filter_by_context(args):
     return result
 
 def filter_by_definition(args):
+    # tree_sitter is only imported here, it is slow and may build the languages.
+    from .sema.sema import SemaPool, LinePos
     search_text, items = args
     def definition_filter(item):
         l = LinePos(item['filename'], int(item['lnum'])-1)
@@ -103,14 +126,23 @@ def filter_by_definition(args):
     items = list(filter(definition_filter, items))
     return items
 
-def do_grep_search(args):
+def do_grep_search(args, children=None, stop=None):
+    """ children and stop are used to kill the egrep when the search is cancelled.
+    """
     search_text, extra_args, directory, id, queue = args
+    if stop is not None and stop.is_set(): 
+        return []
     if directory.startswith("FILE:"): 
         directory = directory.split("FILE:")[1].strip()
         sh_cmd = "find %s -maxdepth 1 -type f | LC_ALL=C xargs egrep -H -I -n %s \"%s\"" % (directory, " ".join(extra_args), escape(search_text))
     else: 
         sh_cmd = "LC_ALL=C egrep -I -H -n %s -r \"%s\" %s" % (" ".join(extra_args), escape(search_text), directory)
-    child = subprocess.Popen(sh_cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    child = subprocess.Popen(sh_cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, start_new_session=True)
+    if current_priority() == BACKGROUND: 
+        lower_priority(child.pid)
+    if children is not None: 
+        children.append(child)
+        if stop.is_set(): kill_child(child)
     results = []
     for idx, line in enumerate(child.stdout.readlines()):
         try:
@@ -133,9 +165,7 @@ def do_grep_search(args):
 
 def test_main():
     from server_cluster import ServerCluster, printer_process_fn
-    import multiprocessing as mp
-    mp_manager = mp.Manager()
-    servers = ServerCluster(mp_manager)
+    servers = ServerCluster()
     servers.start_queue(printer_process_fn)
     #servers.grepfinder = GrepSearcher(servers.queue)
     fn = servers.get_server_fn("grepfinder.search")
@@ -62,8 +62,7 @@ class HoogleSearcher(Service):
 
 if __name__ == "__main__":
     from server_cluster import ServerCluster, printer_process_fn
-    mp_manager = mp.Manager()
-    servers = ServerCluster(mp_manager)
+    servers = ServerCluster()
     servers.start_queue(printer_process_fn)
     fn = servers.get_server_fn("hoogle.search")
     print (fn (1, "insert")[2])
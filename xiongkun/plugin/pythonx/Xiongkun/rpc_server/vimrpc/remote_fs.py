@@ -4,7 +4,8 @@ import json
 import time
 from .decorator import *
 from .functions import KillablePool
-from .utils import GetSearchConfig, ConvertToRePattern
+from .utils import GetSearchConfig, ConvertToRePattern, kill_child
+from .worker_pool import is_cancelled, Cancelled
 import os.path as osp
 import glob
 import re
@@ -118,11 +119,18 @@ class RemoteFS(Service):
     @server_function
     def eval(self, command_str):
         import subprocess
-        child = subprocess.Popen(command_str, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        child.stdin.close()
-        outputs = [line[:-1] for line in child.stdout.readlines()]
-        errors = [line[:-1] for line in child.stderr.readlines()]
-        code = child.wait()
+        child = subprocess.Popen(command_str, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, start_new_session=True)
+        while True:
+            try:
+                stdout, stderr = child.communicate(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                if is_cancelled(): 
+                    kill_child(child)
+                    raise Cancelled()
+        outputs = stdout.splitlines()
+        errors = stderr.splitlines()
+        code = child.returncode
         ret = {}
         ret['status'] = 'ok'
         ret['code'] = code
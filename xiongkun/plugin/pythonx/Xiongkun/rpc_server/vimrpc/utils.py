@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import time
+import signal
 
 def GetConfigByKey(key, directory='./'):
     import yaml  
@@ -65,7 +66,23 @@ def GetSearchFindArgs(excludes):
     return find_cmd
 
 
-def GetSearchFiles(directory):
+def GetSearchFiles(directory, relative=False, visit=None):
+    """ the files of GetSearchFindArgs without find, a CandidateList. 
+        visit(path, rel) sees every directory read, see FileWalker.
+    """
+    import threading
+    from .file_walker import FileWalker
+    from .worker_pool import current_priority, lower_priority, BACKGROUND
+    initializer = None
+    if current_priority() == BACKGROUND: # a rescan by set_root.
+        initializer = lambda: lower_priority(threading.get_native_id())
+    walker = FileWalker(GetSearchConfig(directory), visit)
+    return walker.walk(directory, relative, initializer)
+
+
+def GetSearchFilesFind(directory):
+    """ GetSearchFiles by the find command, the reference of FileWalker.
+    """
     base_cmd = f"find {directory} "
     excludes = GetSearchConfig(directory)
     find_args = GetSearchFindArgs(excludes)
@@ -75,7 +92,10 @@ def GetSearchFiles(directory):
 
 def GetSearchFilesFromCommand(find_cmd):
     import subprocess
+    from .worker_pool import current_priority, lower_priority, BACKGROUND
     child = subprocess.Popen(f"{find_cmd}", shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    if current_priority() == BACKGROUND: # a rescan by set_root.
+        lower_priority(child.pid)
     files = []
     for line in child.stdout.readlines():
         line = line.strip()
@@ -102,3 +122,11 @@ def escape(command, chars="'\\\""):
         if c in chars: l.append("\\" + c)
         else : l.append(c)
     return "".join(l)
+
+def kill_child(child):
+    # the child is started in a new session, kill the shell and the pipeline.
+    if child.poll() is None:
+        try:
+            os.killpg(child.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,392 @@
+import os
+import sys
+import time
+import signal
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from collections import deque
+from threading import Lock, Thread, Event, local
+from log import log
+
+class ResultChannel:
+    """
+    Results of the workers to the send loop, replace mp.Manager().Queue().
+
+    a pipe written by every worker process (and the threads in them) under a
+    process shared lock, the reader side is selectable, so vim_rpc_loop
+    waits on it next to the client socket.
+    """
+    def __init__(self):
+        self.reader, self.writer = mp.Pipe(duplex=False)
+        self.lock = mp.Lock()
+
+    def put(self, item):
+        with self.lock:
+            self.writer.send(item)
+
+    def get(self):
+        return self.reader.recv()
+
+    def poll(self, timeout=0.0):
+        return self.reader.poll(timeout)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+class Cancelled(Exception):
+    pass
+
+# priority of a request, the 4th item of [id, name, args, priority], smaller is served first.
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+# niceness of the background workers and their children, the kernel preempts them.
+BACKGROUND_NICE = 19
+
+def lower_priority(pid=None):
+    """ nice a background process, this one by default. with sched_autogroup 
+        the niceness only counts inside a session, so a child with its own 
+        session (start_new_session) gets its autogroup niced too.
+    """
+    try:
+        if pid is None: 
+            os.nice(BACKGROUND_NICE)
+            return
+        os.setpriority(os.PRIO_PROCESS, pid, BACKGROUND_NICE)
+        if os.getsid(pid) == pid: 
+            with open(f"/proc/{pid}/autogroup", "w") as fp: 
+                fp.write(str(BACKGROUND_NICE))
+    except OSError:
+        pass # exited, or the kernel has no autogroup.
+
+# the task running in this worker process, None in the main process.
+_current = None
+# the task running in this thread of the main process, see ThreadTask.
+_local = local()
+# this worker process runs the BACKGROUND calls.
+_background = False
+
+class _Task:
+    def __init__(self, id, conn, pending, cancelled):
+        self.id = id
+        self.conn = conn
+        self.pending = pending
+        self.cancelled = cancelled
+
+    def poll(self):
+        # cancel messages are picked out, other messages are kept in order.
+        while self.conn.poll():
+            msg = self.conn.recv()
+            if msg[0] == 'cancel': self.cancelled.add(msg[1])
+            else: self.pending.append(msg)
+        return self.id in self.cancelled
+
+class ThreadTask:
+    """ a call running in the thread pools of the main process,
+        ServerCluster.cancel sets the event.
+    """
+    def __init__(self, id, priority=NORMAL):
+        self.id = id
+        self.priority = priority
+        self.cancelled = Event()
+
+    def poll(self):
+        return self.cancelled.is_set()
+
+def bind_task(task):
+    """ make is_cancelled() of this thread follow task, None to unbind.
+    """
+    _local.task = task
+
+def is_cancelled():
+    """ cooperative cancellation: long running functions call this
+        in the worker or thread pool, it is cheap but a syscall in the
+        worker, so not for every item.
+    """
+    task = _current or getattr(_local, 'task', None)
+    return task is not None and task.poll()
+
+def current_priority():
+    """ priority of the request running in this thread, NORMAL out of a request.
+    """
+    task = getattr(_local, 'task', None)
+    if task is not None: 
+        return task.priority
+    return BACKGROUND if _background else NORMAL
+
+def current_owner():
+    """ the session of the running call in the shared host (ids are (session, id)), None otherwise.
+    """
+    task = _current or getattr(_local, 'task', None)
+    if task is not None and isinstance(task.id, tuple): 
+        return task.id[0]
+    return None
+
+def check_cancel():
+    if is_cancelled(): raise Cancelled()
+
+def cancellable(iterable, every=2048):
+    """ yield from iterable and raise Cancelled when the task is cancelled.
+    """
+    for idx, item in enumerate(iterable):
+        if idx % every == 0: check_cancel()
+        yield item
+
+def _worker_main(index, group, conn, services, queue):
+    global _current, _background
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if group == 'background': 
+        _background = True
+        lower_priority()
+    pending = deque()
+    cancelled = set()
+    while True:
+        try:
+            msg = pending.popleft() if pending else conn.recv()
+        except EOFError:
+            break
+        kind = msg[0]
+        if kind == 'stop':
+            break
+        elif kind == 'cancel':
+            cancelled.add(msg[1])
+        elif kind == 'state':
+            _, path, funcname, args = msg
+            try:
+                getattr(type(services[path]), funcname)(services[path], *args)
+            except Exception as e:
+                traceback.print_exc()
+        elif kind == 'call':
+            _, id, path, funcname, args, mode = msg
+            if id not in cancelled:
+                _current = _Task(id, conn, pending, cancelled)
+                output = None
+                try:
+                    output = getattr(type(services[path]), funcname)(services[path], *args)
+                    if mode != 'part': queue.put((id, True, output))
+                except Cancelled:
+                    log(f"[WorkerPool] {path}.{funcname} ({id}) is cancelled.")
+                except Exception as e:
+                    traceback.print_exc()
+                _current = None
+                if mode == 'part': conn.send(('part', id, output))
+            cancelled.discard(id)
+            conn.send(('done', id))
+        sys.stdout.flush()
+
+class _Worker:
+    def __init__(self, index, group, pool):
+        self.index = index
+        self.group = group
+        self.load = 0
+        self.lock = Lock()
+        self.conn, child_conn = mp.Pipe()
+        self.proc = mp.Process(target=_worker_main, args=(index, group, child_conn, pool.services, pool.queue), daemon=False)
+        self.proc.start()
+        child_conn.close()
+
+    def send(self, msg):
+        with self.lock:
+            self.conn.send(msg)
+
+class WorkerPool:
+    """
+    Long lived worker processes for the AsyncServer functions, replace a
+    fork per call. there are two groups of workers:
+
+    scatter workers: every one keeps a shard of the big lists (see shard),
+        a scatter call runs on all of them and the parts are reduced here.
+    task workers: run the async / stream functions, one worker per call.
+    background workers: task workers for the BACKGROUND calls (grep crawls, 
+        sema_filter ...), they are niced so the kernel preempts them for 
+        the interactive work, and never hold a task worker.
+
+    workers are forked after the services are created, so they own a copy
+    of them, and run the undecorated functions of the service class.
+    a new call of the same (service, function) cancels the last one, the
+    running function notices it by is_cancelled() / cancellable().
+    """
+    def __init__(self, num_scatter=None, num_task=2, num_background=1):
+        self.num_scatter = num_scatter or max(2, min(8, (os.cpu_count() or 2)))
+        self.num_task = num_task
+        self.num_background = num_background
+        self.services = {} # path -> service
+        self.paths = {} # id(service) -> path
+        self.workers = []
+        self.running = {} # (path, funcname) -> id
+        self.inflight = {} # id -> workers running it, cancel is only sent to them.
+        self.gathers = {} # id -> [outputs, reduce_fn, args]
+        self.states = {} # (path, funcname, key) -> items of shard, sent again to a respawned worker.
+        self.patches = {} # (path, key) -> [(funcname, items, args)] since the last shard of key, see patch.
+        self.queue = None
+        self._stop = False
+        self.lock = Lock()
+
+    def register(self, path, service):
+        self.services[path] = service
+        self.paths[id(service)] = path
+
+    def path_of(self, service):
+        return self.paths[id(service)]
+
+    def start(self, queue):
+        self.queue = queue
+        self.workers = [ _Worker(i, 'scatter', self) for i in range(self.num_scatter) ]
+        self.workers += [ _Worker(i, 'task', self) for i in range(self.num_task) ]
+        self.workers += [ _Worker(i, 'background', self) for i in range(self.num_background) ]
+        self.collector = Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def group(self, name):
+        return [ w for w in self.workers if w.group == name ]
+
+    def _respawn(self, worker):
+        log(f"[WorkerPool] respawn {worker.group} worker {worker.index}.")
+        new = _Worker(worker.index, worker.group, self)
+        self.workers[self.workers.index(worker)] = new
+        with self.lock:
+            for id in list(self.inflight.keys()):
+                self._finish(id, worker)
+        if new.group == 'scatter':
+            for (path, funcname, key), items in list(self.states.items()):
+                new.send(self._shard_message(path, funcname, key, items, new.index))
+            for (path, key), patches in list(self.patches.items()):
+                for funcname, items, args in list(patches):
+                    new.send(self._shard_message(path, funcname, key, items, new.index, args))
+
+    def _collect(self):
+        while not self._stop:
+            conns = { w.conn: w for w in self.workers }
+            for conn in wait(list(conns.keys()), timeout=1.0):
+                worker = conns[conn]
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    if not self._stop: self._respawn(worker)
+                    continue
+                if msg[0] == 'done':
+                    with self.lock:
+                        worker.load -= 1
+                        self._finish(msg[1], worker)
+                elif msg[0] == 'part':
+                    self._gather(msg[1], msg[2])
+
+    def _gather(self, id, output):
+        with self.lock:
+            if id not in self.gathers: return # cancelled.
+            outputs, reduce_fn, args = self.gathers[id]
+            outputs.append(output)
+            if len(outputs) < self.num_scatter: return
+            del self.gathers[id]
+        if any(o is None for o in outputs): return
+        try:
+            self.queue.put((id, True, reduce_fn(outputs, *args)))
+        except Exception as e:
+            traceback.print_exc()
+
+    def _finish(self, id, worker):
+        workers = self.inflight.get(id, None)
+        if workers is None: return
+        if worker in workers: workers.remove(worker)
+        if not workers: del self.inflight[id]
+
+    def _replace_running(self, server, funcname, call_id):
+        # ids of the shared host are (session, id), a session only replaces its own call.
+        owner = call_id[0] if isinstance(call_id, tuple) else None
+        key = (self.path_of(server), funcname, owner)
+        with self.lock:
+            last = self.running.get(key, None)
+            self.running[key] = call_id
+        if last is not None:
+            self.cancel(last)
+        return key[0]
+
+    def submit(self, server, funcname, id, args):
+        """ run `server.funcname(*args)` in a task worker, put (id, True, output) into the queue.
+            a BACKGROUND request (see current_priority) runs in a background worker.
+        """
+        path = self._replace_running(server, funcname, id)
+        group = 'background' if current_priority() == BACKGROUND and self.num_background else 'task'
+        with self.lock:
+            worker = min(self.group(group), key=lambda w: w.load)
+            worker.load += 1
+            self.inflight[id] = [worker]
+        worker.send(('call', id, path, funcname, args, 'async'))
+
+    def scatter(self, server, funcname, id, args, reduce_fn):
+        """ run `server.funcname(*args)` in all scatter workers,
+            put (id, True, reduce_fn(outputs, *args)) into the queue.
+        """
+        path = self._replace_running(server, funcname, id)
+        with self.lock:
+            self.gathers[id] = [[], reduce_fn, args]
+            self.inflight[id] = self.group('scatter')
+            for worker in self.inflight[id]:
+                worker.load += 1
+        for worker in self.group('scatter'):
+            worker.send(('call', id, path, funcname, args, 'part'))
+
+    def _shard_message(self, path, funcname, key, items, index, args=()):
+        each_len = len(items) // self.num_scatter + 1
+        return ('state', path, funcname, (key, items[index*each_len:(index+1)*each_len], *args))
+
+    def shard(self, server, funcname, key, items):
+        """ split items and call `server.funcname(key, shard)` in every scatter worker.
+            items is kept (not its shards) for a respawned worker.
+        """
+        path = self.path_of(server)
+        self.states[(path, funcname, key)] = items
+        self.patches.pop((path, key), None)
+        for worker in self.group('scatter'):
+            worker.send(self._shard_message(path, funcname, key, items, worker.index))
+
+    def unshard(self, server, funcname, key):
+        """ call `server.funcname(key, None)` in every scatter worker and forget the shards of key.
+        """
+        path = self.path_of(server)
+        self.states.pop((path, funcname, key), None)
+        self.patches.pop((path, key), None)
+        for worker in self.group('scatter'):
+            worker.send(('state', path, funcname, (key, None)))
+
+    def patch(self, server, funcname, key, items, *args):
+        """ split items and call `server.funcname(key, shard, *args)` in every scatter
+            worker, a change of the shards of key without sending them again. the
+            patches are kept in order for a respawned worker until the next shard.
+        """
+        path = self.path_of(server)
+        self.patches.setdefault((path, key), []).append((funcname, items, args))
+        for worker in self.group('scatter'):
+            worker.send(self._shard_message(path, funcname, key, items, worker.index, args))
+
+    def cancel(self, id):
+        """ cancel the call `id` if it is running in the workers, return True if found.
+        """
+        with self.lock:
+            self.gathers.pop(id, None)
+            workers = list(self.inflight.get(id, []))
+        for worker in workers:
+            worker.send(('cancel', id))
+        return len(workers) > 0
+
+    def terminal(self, server, funcname, owner=None):
+        """ cancel the running call of `server.funcname`, owner is the session of the shared host.
+        """
+        key = (self.path_of(server), funcname, owner)
+        with self.lock:
+            last = self.running.pop(key, None)
+        if last is not None:
+            self.cancel(last)
+
+    def terminal_all(self):
+        self._stop = True
+        for worker in self.workers:
+            try:
+                worker.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.proc.join(1.0)
+            if worker.proc.exitcode is None:
+                worker.proc.terminate()
+                worker.proc.join()
+        self.workers = []
@@ -0,0 +1,115 @@
+import time
+
+class SearchScheduler:
+    """
+    Debounce and coalesce the searches of one FuzzyList.
+
+    at most one search is in flight, the keys typed meanwhile only update the
+    newest text, which is sent when the response returns. every query has a
+    sequence number and the stale responses are dropped before on_result.
+    the debounce delay follows the measured latency (RTT + server time), a
+    local server searches on every key, a slow link waits for a typing pause.
+
+    timer is the PythonFunctionTimer() of vim_utils (do_later and
+    fire_interval), passed in so that this module runs without vim:
+
+        python3 search_scheduler.py
+    """
+    max_delay = 0.15 # second
+    lost_timeout = 3.0 # a search without response for so long is given up.
+
+    def __init__(self, send, on_result, timer):
+        self.send = send # send(search_text, on_return)
+        self.on_result = on_result
+        self.timer = timer
+        self.seq = 0
+        self.text = ""
+        self.inflight = None # (seq, start time) of the search in flight.
+        self.sent = 0 # seq of the last sent search.
+        self.dirty = False
+        self.latency = None # moving average of the response time.
+
+    def delay(self):
+        if self.latency is None: return 0.0
+        return min(self.max_delay, self.latency / 2)
+
+    def submit(self, text):
+        self.seq += 1
+        self.text = text
+        delay = self.delay()
+        if delay < self.timer.fire_interval:
+            self._fire(self.seq)
+        else:
+            self.timer.do_later(delay, self._fire, [self.seq])
+
+    def _fire(self, seq):
+        if seq != self.seq or seq == self.sent:
+            return # a newer key comes during the delay, or sent by the coalescing.
+        if self.inflight is not None:
+            wait = self.lost_timeout - (time.time() - self.inflight[1])
+            if wait > 0:
+                self.dirty = True
+                self.timer.do_later(wait, self._fire, [seq]) # in case the response is lost.
+                return
+        self._send()
+
+    def _send(self):
+        seq, start = self.seq, time.time()
+        self.inflight = (seq, start)
+        self.sent = seq
+        self.dirty = False
+        def on_return(res):
+            cost = time.time() - start
+            self.latency = cost if self.latency is None else 0.7 * self.latency + 0.3 * cost
+            if self.inflight is not None and self.inflight[0] == seq:
+                self.inflight = None
+                if self.dirty: self._send()
+            if seq == self.seq:
+                self.on_result(res)
+        self.send(self.text, on_return)
+
+if __name__ == "__main__":
+    class Timer: # PythonFunctionTimer without vim, fire() runs what is due.
+        fire_interval = 0.01
+        def __init__(self):
+            self.todos = []
+        def do_later(self, delay, func, args):
+            self.todos.append((time.time() + delay, func, args))
+        def fire(self):
+            due = [ todo for todo in self.todos if todo[0] <= time.time() ]
+            self.todos = [ todo for todo in self.todos if todo[0] > time.time() ]
+            for _, func, args in due: func(*args)
+
+    sends, results = [], []
+    timer = Timer()
+    scheduler = SearchScheduler(lambda text, on_return: sends.append((text, on_return)), results.append, timer)
+    # the first key: no latency yet, it is sent at once.
+    scheduler.submit("a")
+    assert [ text for text, _ in sends ] == ["a"] and not timer.todos
+    # the keys typed while "a" is in flight are coalesced into the newest.
+    scheduler.submit("ab")
+    scheduler.submit("abc")
+    assert len(sends) == 1 and scheduler.dirty and len(timer.todos) == 2 # sent anyway after lost_timeout.
+    sends[0][1]("result of a") # stale, dropped, and "abc" is sent.
+    assert results == [] and [ text for text, _ in sends ] == ["a", "abc"]
+    sends[1][1]("result of abc")
+    assert results == ["result of abc"] and scheduler.inflight is None
+    timer.todos = [] # the lost_timeout checks of "ab" and "abc", they are stale.
+    # a slow link: the next keys wait for the debounce delay.
+    scheduler.latency = 0.1
+    scheduler.submit("abcd")
+    scheduler.submit("abcde")
+    assert len(sends) == 2 and len(timer.todos) == 2
+    time.sleep(scheduler.delay())
+    timer.fire()
+    assert [ text for text, _ in sends ] == ["a", "abc", "abcde"] # "abcd" is superseded.
+    # a lost response: the newest text is sent after lost_timeout.
+    scheduler.lost_timeout = 0.3
+    scheduler.submit("abcdef")
+    time.sleep(scheduler.delay())
+    timer.fire()
+    assert len(sends) == 3
+    time.sleep(scheduler.lost_timeout)
+    timer.fire()
+    assert [ text for text, _ in sends ][-1] == "abcdef"
+    print ("search_scheduler ok.")
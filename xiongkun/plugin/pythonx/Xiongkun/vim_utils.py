@@ -973,11 +973,10 @@ def GetSearchFilesFromCommand(find_cmd):
     return files
 
 def GetSearchFiles(directory):
-    base_cmd = f"find {directory} "
+    # the files of GetSearchFindArgs without find, see rpc_server/vimrpc/file_walker.py
+    from .rpc_server.vimrpc.file_walker import FileWalker
     excludes = GetSearchConfig(directory)
-    find_args = GetSearchFindArgs(excludes)
-    find_cmd = base_cmd + find_args
-    return GetSearchFilesFromCommand(find_cmd)
+    return list(FileWalker(excludes).walk(directory))
 
 class PopupList:
     # depends on vim_quick#ui
@@ -879,8 +879,7 @@ class GrepSearcher(Searcher):# {{{
                 )
 
             def cancel(self):
-                from .rpc import rpc_call
-                rpc_call("grepfinder.cancel_search", None)
+                # the server stops the search when the stream is deleted.
                 self.stream.delete()
 
             def set_callback(self, finish, process):